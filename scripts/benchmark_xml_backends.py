@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+XMLバックエンドごとのパース速度を計測するスクリプト
+
+同じエクスポートを各バックエンドでストリーミングパースし、件/秒を比較する。
+--saveを指定すると最も速いバックエンドを保存し、parse_apple_health.pyの既定にする。
+"""
+import sys
+import argparse
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.parsers.apple_health import AppleHealthParser
+from src.parsers.xml_stream import XML_BACKENDS, available_backends, save_backend_preference
+
+# ベンチマークで選んだバックエンドの保存先
+BACKEND_PREFERENCE_PATH = project_root / 'data' / 'cache' / 'xml_backend.json'
+
+
+def parse_args():
+    """コマンドライン引数を解析"""
+    arg_parser = argparse.ArgumentParser(description='XMLバックエンドごとのパース速度を計測')
+    arg_parser.add_argument('export_path', help='export.zip、export.xml、またはエクスポートのディレクトリ')
+    arg_parser.add_argument('--backends', nargs='+', choices=XML_BACKENDS, default=None,
+                            help='計測するバックエンド（既定は利用できるすべて）')
+    arg_parser.add_argument('--repeat', type=int, default=3,
+                            help='バックエンドごとの計測回数（最も速い回を採用）')
+    arg_parser.add_argument('--save', action='store_true',
+                            help='最も速いバックエンドをparse_apple_health.pyの既定として保存')
+    return arg_parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+
+    backends = args.backends or available_backends()
+    unavailable = [backend for backend in backends if backend not in available_backends()]
+    if unavailable:
+        print(f"利用できないバックエンドを除外します: {', '.join(unavailable)}")
+        backends = [backend for backend in backends if backend not in unavailable]
+    if not backends:
+        print("エラー: 計測できるバックエンドがありません")
+        return
+
+    print("=" * 60)
+    print(f"XMLバックエンドのベンチマーク: {args.export_path}")
+    print("=" * 60)
+
+    results = {}
+    for backend in backends:
+        best = 0.0
+        for _ in range(max(1, args.repeat)):
+            parser = AppleHealthParser(args.export_path)
+            parser.parse(streaming=True, backend=backend)
+            best = max(best, parser.stats['records_per_sec'])
+        results[backend] = best
+
+    print("\n" + "=" * 60)
+    print("結果（件/秒、速い順）")
+    print("=" * 60)
+    fastest = max(results, key=results.get)
+    for backend, records_per_sec in sorted(results.items(), key=lambda item: -item[1]):
+        ratio = records_per_sec / results[fastest] if results[fastest] > 0 else 0.0
+        print(f"  {backend:6s}: {records_per_sec:12.0f}件/秒 ({ratio:.0%})")
+
+    if args.save:
+        save_backend_preference(str(BACKEND_PREFERENCE_PATH), fastest, results)
+        print(f"\n{fastest}を既定のバックエンドとして保存しました: {BACKEND_PREFERENCE_PATH}")
+    else:
+        print(f"\n最も速いバックエンド: {fastest}（--saveで既定として保存）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+export.xmlのバイト位置の索引を作成するスクリプト
+
+トップレベル要素のラン（要素名・type属性・開始月が同じ要素の並び）のバイト位置を
+export.xmlの隣（export.xml.index.npz）に保存する。以降のストリーミングパースは、
+期間・データタイプを指定すると該当する範囲だけを読み込む。
+（ストリーミングパースで全体を読み込んだ際にも自動的に作成される）
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.parsers.apple_health import AppleHealthParser
+
+
+def parse_args():
+    """コマンドライン引数を解析"""
+    arg_parser = argparse.ArgumentParser(description='export.xmlのバイト位置の索引を作成')
+    arg_parser.add_argument('export_path', help='export.xml、または展開済みのエクスポートのディレクトリ')
+    return arg_parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    args = parse_args()
+    parser = AppleHealthParser(args.export_path)
+    if parser.export.is_zip:
+        print("エラー: zip内のXMLはシークできないため索引を作れません（展開してから実行してください）")
+        return
+
+    started = time.perf_counter()
+    index = parser.build_index()
+    elapsed = time.perf_counter() - started
+    print(f"索引を作成しました（{elapsed:.1f}秒）: {index.describe()}")
+
+    # 要素名・typeごとの範囲数と要素数
+    summary = {}
+    for tag, type_name, count in zip(index.tag.tolist(), index.type_name.tolist(), index.count.tolist()):
+        runs, elements = summary.get((tag, type_name), (0, 0))
+        summary[(tag, type_name)] = (runs + 1, elements + count)
+    for (tag, type_name), (runs, elements) in sorted(summary.items(), key=lambda item: -item[1][1]):
+        print(f"  {tag:12s} {type_name or '-':55s} {runs:6d}範囲 {elements:10d}要素")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@
 """
 import sys
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
 # プロジェクトルートをパスに追加
@@ -14,7 +15,19 @@ from src.database.db_setup import Database
 from src.calculators.recovery_stress import RecoveryStressCalculator
 from src.calculators.sleep_score import SleepScoreCalculator
 from src.models.health_data import DailyHealth
+from src.parsers.record_ledger import RecordLedger
+from src.parsers.watermarks import load_watermarks
 from datetime import date
+from dataclasses import fields
+
+
+def nan_to_none(daily_health: DailyHealth) -> DailyHealth:
+    """DBから読み込んだ欠損値（NaN）をNoneに揃える"""
+    for field in fields(daily_health):
+        value = getattr(daily_health, field.name)
+        if isinstance(value, float) and pd.isna(value):
+            setattr(daily_health, field.name, None)
+    return daily_health
 
 
 def main():
@@ -42,28 +55,34 @@ def main():
     print(f"データ件数: {len(df)}日")
     
     # DailyHealthオブジェクトのリストを作成
+    # CSVにある計測値の列だけを使う（古いCSVにない列はNoneのまま）
+    measurement_columns = [
+        column for column in DailyHealth.measurement_field_names() if column in df.columns
+    ]
     daily_health_list = []
     for _, row in df.iterrows():
         daily_health = DailyHealth(
             date=row['date'],
-            sleep_minutes=row.get('sleep_minutes') if pd.notna(row.get('sleep_minutes')) else None,
-            deep_sleep_minutes=row.get('deep_sleep_minutes') if pd.notna(row.get('deep_sleep_minutes')) else None,
-            rem_sleep_minutes=row.get('rem_sleep_minutes') if pd.notna(row.get('rem_sleep_minutes')) else None,
-            light_sleep_minutes=row.get('light_sleep_minutes') if pd.notna(row.get('light_sleep_minutes')) else None,
-            hrv_avg=row.get('hrv_avg') if pd.notna(row.get('hrv_avg')) else None,
-            hrv_deep_sleep_avg=row.get('hrv_deep_sleep_avg') if pd.notna(row.get('hrv_deep_sleep_avg')) else None,
-            hrv_deep_sleep_stddev=row.get('hrv_deep_sleep_stddev') if pd.notna(row.get('hrv_deep_sleep_stddev')) else None,
-            hrv_min=row.get('hrv_min') if pd.notna(row.get('hrv_min')) else None,
-            hrv_max=row.get('hrv_max') if pd.notna(row.get('hrv_max')) else None,
-            resting_heart_rate=row.get('resting_heart_rate') if pd.notna(row.get('resting_heart_rate')) else None,
-            avg_heart_rate=row.get('avg_heart_rate') if pd.notna(row.get('avg_heart_rate')) else None,
-            steps=row.get('steps') if pd.notna(row.get('steps')) else None,
-            active_energy=row.get('active_energy') if pd.notna(row.get('active_energy')) else None,
+            **{column: row[column] if pd.notna(row[column]) else None for column in measurement_columns},
         )
         daily_health_list.append(daily_health)
     
-    # スコア計算器を初期化（ベースライン計算用に全データを渡す）
-    recovery_calculator = RecoveryStressCalculator(baseline_data=daily_health_list)
+    # インクリメンタルインポートの場合は、それ以前の取り込み済みデータもベースラインに含める
+    # （--dedupeで飛び飛びの日だけを再集計した場合は、間の取り込み済みの日も含める）
+    history = []
+    if daily_health_list:
+        last_date = max(daily_health.date for daily_health in daily_health_list)
+        imported_dates = {daily_health.date for daily_health in daily_health_list}
+        for daily_health in db.get_all_daily_health(end_date=last_date):
+            # DBの日付は文字列のため、CSVの行と同じdateにしてから比較・並べ替える
+            if isinstance(daily_health.date, str):
+                daily_health.date = date.fromisoformat(daily_health.date[:10])
+            if daily_health.date not in imported_dates:
+                history.append(nan_to_none(daily_health))
+    
+    # スコア計算器を初期化（ベースライン計算用に全データを日付順に渡す）
+    baseline_data = sorted(history + daily_health_list, key=lambda daily_health: daily_health.date)
+    recovery_calculator = RecoveryStressCalculator(baseline_data=baseline_data)
     sleep_calculator = SleepScoreCalculator()
     
     # 各日のスコアを計算してデータベースに保存
@@ -87,6 +106,20 @@ def main():
     
     print(f"\nデータベースへの保存完了: {saved_count}日")
     
+    # パース時に記録した高水位標を反映（次回のインクリメンタルインポートの起点になる）
+    watermark_path = project_root / 'data' / 'processed' / 'import_watermarks.json'
+    if watermark_path.exists():
+        db.update_import_watermarks(load_watermarks(watermark_path))
+        print(f"高水位標を更新しました: {watermark_path}")
+    
+    # parse_apple_health.py --dedupeで見つけた新しいレコードを台帳に追加（次回からは取り込み済みとして扱う）
+    fingerprint_path = project_root / 'data' / 'processed' / 'new_record_fingerprints.npy'
+    if fingerprint_path.exists():
+        ledger = RecordLedger(str(project_root / 'data' / 'db' / 'record_ledger'))
+        added = ledger.add(np.load(fingerprint_path))
+        fingerprint_path.unlink()
+        print(f"取り込み済みのレコードの台帳に追加しました: {added}件（合計{len(ledger)}件）")
+    
     # データの概要を表示
     print("\n" + "=" * 60)
     print("保存されたデータの概要")
@@ -4,38 +4,265 @@ Apple Health XMLデータをパースして、日次データを集計するス
 """
 import sys
 import os
+import argparse
 from pathlib import Path
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
 # プロジェクトルートをパスに追加
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 from src.parsers.apple_health import AppleHealthParser
-from src.aggregators.daily_aggregator import DailyAggregator
+from src.aggregators.pipeline import PIPELINE_QUEUE_DEPTH, PipelinedIngest
+from src.aggregators.vectorized_aggregator import AGGREGATION_ENGINES, DEFAULT_AGGREGATION_ENGINE
+from src.database.db_setup import Database
+from src.models.health_data import DailyHealth
+from src.parsers.calendar_ics import CalendarIngester
+from src.parsers.ecg import EcgIngester
+from src.parsers.export_index import ExportIndex
+from src.parsers.fitbit import FitbitImporter
+from src.parsers.garmin import GarminImporter
+from src.parsers.oura import OuraImporter
+from src.parsers.record_filter import RecordFilter
+from src.parsers.record_ledger import RecordLedger, affected_date_ranges, fingerprint_frames
+from src.parsers.type_registry import DEFAULT_REGISTRY
+from src.parsers.wearable_import import combine_dataframes
+from src.parsers.timestamps import NO_LOCAL_DAY, day_from_number, frame_local_days
+from src.parsers.workout_routes import WorkoutRouteIngester
+from src.parsers.xml_stream import XML_BACKENDS, AUTO_BACKEND, load_backend_preference
+from src.parsers.watermarks import (
+    LOOKBACK_DAYS, backfill_date, compute_watermarks, parse_start_date, resume_date, save_watermarks,
+    stale_watermarks,
+)
+import numpy as np
 import pandas as pd
 
 
+def find_default_export() -> Path:
+    """デフォルトのエクスポートのパス（展開済みのexport.xml、なければexport.zip）"""
+    xml_path = project_root / 'apple_health_export' / 'export.xml'
+    if xml_path.exists():
+        return xml_path
+    return project_root / 'export.zip'
+
+
+def daily_frame(daily_health_list) -> pd.DataFrame:
+    """
+    DailyHealthのリストを日次データのDataFrameに変換
+
+    スコアなどの計算値はimport_to_db.pyで求めるため、計測値の列だけにする。
+    """
+    columns = ['date'] + DailyHealth.measurement_field_names()
+    daily_data = [
+        {column: getattr(daily_health, column) for column in columns}
+        for daily_health in daily_health_list
+    ]
+    return pd.DataFrame(daily_data, columns=columns)
+
+
+def merge_daily_csv(path: Path, df_daily: pd.DataFrame, date_ranges) -> pd.DataFrame:
+    """
+    再集計した日を前回の日次データのCSVに反映（再集計しなかった日は前回の値を残す）
+
+    パラメータ:
+    - path: 日次データのCSVのパス
+    - df_daily: 再集計した日の日次データ
+    - date_ranges: 再集計した(初日, 最終日)のリスト
+
+    戻り値:
+    - 日付順の日次データ
+    """
+    if not path.exists():
+        return df_daily
+    previous = pd.read_csv(path)
+    previous_dates = pd.to_datetime(previous['date']).dt.date
+    recomputed = np.zeros(len(previous), dtype=bool)
+    for first_date, last_date in date_ranges:
+        recomputed |= ((previous_dates >= first_date) & (previous_dates <= last_date)).to_numpy()
+    previous = previous.loc[~recomputed].reindex(columns=df_daily.columns).assign(date=previous_dates[~recomputed])
+    merged = pd.concat([previous, df_daily], ignore_index=True) if not previous.empty else df_daily
+    return merged.sort_values('date', kind='stable').reset_index(drop=True)
+
+
+def load_exports(args, parser, wearable_exports, since, stream_since, backend) -> dict:
+    """
+    Apple Healthと他のウェアラブルのエクスポートを読み込み、データタイプごとのDataFrameにする
+
+    パラメータ:
+    - args: コマンドライン引数
+    - parser: AppleHealthParser（他のウェアラブルのエクスポートだけを読み込む場合はNone）
+    - wearable_exports: (インポーターのクラス, パス)のリスト
+    - since: この日付より前に始まるレコードを読み飛ばす
+    - stream_since: (データタイプ名, ソース名) → そのソースだけに使う読み込み開始日
+    - backend: XMLバックエンド
+
+    戻り値:
+    - データタイプごとのDataFrameの辞書
+    """
+    dataframes = {}
+    if parser is not None:
+        # データを抽出（エクスポートが前回から変わっていなければキャッシュから読み込む）
+        print("\nデータを抽出中...")
+        cache_dir = None if args.no_cache else str(project_root / 'data' / 'cache' / 'parsed')
+        # 大きなエクスポートのパースが中断しても、次回は書き出し済みの区間から再開する
+        checkpoint_dir = None if args.no_checkpoint else str(project_root / 'data' / 'cache' / 'checkpoints')
+        dataframes = parser.load_dataframes(
+            workers=args.workers, since=since, until=args.until,
+            sources=args.sources, exclude_sources=args.exclude_sources, cache_dir=cache_dir,
+            backend=backend, checkpoint_dir=checkpoint_dir, stream_since=stream_since,
+        )
+    
+    # 他のウェアラブルのエクスポートを同じ形のDataFrameとして読み込み、結合する
+    # （重なる時間帯の重複は日次集計の前にSourceMergerが除く）
+    if wearable_exports:
+        print("\nウェアラブルのエクスポートを読み込み中...")
+        record_filter = RecordFilter(
+            since=since, until=args.until, sources=args.sources, exclude_sources=args.exclude_sources,
+            stream_since=stream_since,
+        )
+        sources = [dataframes] if dataframes else []
+        for importer_class, path in wearable_exports:
+            options = {'time_zone': args.fitbit_time_zone} if importer_class is FitbitImporter else {}
+            importer = importer_class(path, record_filter=record_filter, workers=args.workers, **options)
+            sources.append(importer.ingest())
+        dataframes = combine_dataframes(sources)
+    return dataframes
+
+
+def parse_args():
+    """コマンドライン引数を解析"""
+    arg_parser = argparse.ArgumentParser(description='Apple Healthデータをパースして日次データを集計')
+    arg_parser.add_argument('export_path', nargs='?', default=None,
+                            help='export.zip、export.xml、またはエクスポートのディレクトリ')
+    arg_parser.add_argument('--workers', type=int, default=None,
+                            help='並列パースのプロセス数（2以上で有効）')
+    arg_parser.add_argument('--incremental', action='store_true',
+                            help='前回インポート以降のデータのみを読み込んで再集計')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='パース済みのキャッシュを使わずにパースし直す')
+    arg_parser.add_argument('--no-checkpoint', action='store_true',
+                            help='パースの途中経過を書き出さない（中断した場合は最初からパースし直す）')
+    arg_parser.add_argument('--dedupe', action='store_true',
+                            help='取り込み済みのレコードを指紋で見分け、新しいレコードがある日だけを再集計')
+    arg_parser.add_argument('--pipeline', action='store_true',
+                            help='展開済みのexport.xmlを月ごとにパースしながら、確定した日から集計する（メモリを抑える）')
+    arg_parser.add_argument('--queue-depth', type=int, default=PIPELINE_QUEUE_DEPTH,
+                            help='--pipelineで先行してパースする月の数の上限')
+    arg_parser.add_argument('--aggregation-engine', choices=tuple(AGGREGATION_ENGINES),
+                            default=DEFAULT_AGGREGATION_ENGINE,
+                            help='日次集計の方法（vectorized: 全日分をデータタイプごとにまとめて集計、loop: 日ごとに集計）')
+    arg_parser.add_argument('--since', type=date.fromisoformat, default=None,
+                            help='この日付（YYYY-MM-DD）以降に始まるレコードのみ読み込む')
+    arg_parser.add_argument('--until', type=date.fromisoformat, default=None,
+                            help='この日付（YYYY-MM-DD）までに始まるレコードのみ読み込む')
+    arg_parser.add_argument('--sources', nargs='+', default=None,
+                            help='読み込むソース名（例: "Apple Watch"）')
+    arg_parser.add_argument('--exclude-sources', nargs='+', default=None,
+                            help='読み飛ばすソース名')
+    arg_parser.add_argument('--garmin', default=None,
+                            help='Garmin Connectのエクスポート（.fitファイルのディレクトリまたはzip）')
+    arg_parser.add_argument('--fitbit', default=None,
+                            help='Fitbitのデータエクスポート（ディレクトリまたはzip）')
+    arg_parser.add_argument('--fitbit-time-zone', default=None,
+                            help='Fitbitの現地時刻のタイムゾーン（既定はProfile.csvのもの）')
+    arg_parser.add_argument('--oura', default=None,
+                            help='Oura Ringのデータエクスポート（JSONファイルまたはディレクトリ）')
+    arg_parser.add_argument('--calendar', nargs='+', default=None,
+                            help='カレンダー（.icsファイルまたは.icsファイルのディレクトリ）')
+    arg_parser.add_argument('--calendar-time-zone', default=None,
+                            help='日ごとに集計するカレンダーのタイムゾーン（既定はX-WR-TIMEZONE）')
+    arg_parser.add_argument('--all-busy-events', action='store_true',
+                            help='会議以外の予定ありの予定も会議時間に含める')
+    arg_parser.add_argument('--xml-backend', choices=XML_BACKENDS + (AUTO_BACKEND,), default=None,
+                            help='XMLバックエンド（既定はbenchmark_xml_backends.py --saveで選んだもの）')
+    return arg_parser.parse_args()
+
+
 def main():
     """メイン処理"""
-    # XMLファイルのパス
-    xml_path = project_root / 'apple_health_export' / 'export.xml'
+    args = parse_args()
     
-    if not xml_path.exists():
-        print(f"エラー: XMLファイルが見つかりません: {xml_path}")
+    # エクスポートのパス（zipは展開せずに直接読み込む）
+    export_path = Path(args.export_path) if args.export_path else find_default_export()
+    # Apple Health以外のウェアラブルのエクスポート
+    wearable_exports = [
+        (importer_class, path) for importer_class, path in (
+            (GarminImporter, args.garmin), (FitbitImporter, args.fitbit), (OuraImporter, args.oura),
+        ) if path
+    ]
+    
+    if not export_path.exists() and not wearable_exports:
+        print(f"エラー: エクスポートが見つかりません: {export_path}")
         return
     
     print("=" * 60)
     print("Apple Health XMLデータのパース開始")
     print("=" * 60)
     
-    # パーサーを初期化
-    parser = AppleHealthParser(str(xml_path))
-    parser.parse()
+    # インクリメンタルインポートの場合、前回の高水位標から再集計の初日を決める
+    resume = None
+    since = args.since
+    stale = {}
+    stream_since = None
+    if args.incremental:
+        watermarks = Database().get_import_watermarks()
+        resume = resume_date(watermarks)
+        if resume is None:
+            print("取り込み済みのデータがないため、全期間をパースします")
+        else:
+            since = max(parse_start_date(resume), since) if since else parse_start_date(resume)
+            print(f"インクリメンタルインポート: {resume}以降を再集計（{since}以降のレコードを読み込み）")
+            # 長く同期していないソースは再開位置の計算から外し、自身の高水位標より後のレコードを読み込む
+            # （後から同期した古い日付のレコードを取りこぼさないため）
+            stale = stale_watermarks(watermarks)
+            if stale:
+                stream_since = {
+                    key: max(start.date(), args.since) if args.since else start.date()
+                    for key, start in stale.items()
+                }
+                print(f"  {len(stale)}件の古いソースは各自の高水位標以降を読み込みます:")
+                for (data_type, source), start in sorted(stale.items()):
+                    print(f"    {data_type} / {source}: {start}")
+    
+    # パーサーを初期化（他のウェアラブルのエクスポートだけを読み込む場合はNone）
+    parser = AppleHealthParser(str(export_path)) if export_path.exists() else None
+    ecg_files = []
+    route_files = []
+    dataframes = {}
+    backend = None
     
-    # データを抽出
-    print("\nデータを抽出中...")
-    dataframes = parser.to_dataframes()
+    # パイプラインは展開済みのexport.xmlの索引で月ごとに読み込むため、他の読み込み方とは組み合わせない
+    use_pipeline = args.pipeline and parser is not None
+    if use_pipeline and (parser.export.is_zip or wearable_exports or args.dedupe):
+        print("--pipelineは展開済みのexport.xmlのみ（--garmin/--fitbit/--oura/--dedupeなし）で使えます。"
+              "通常の方法で処理します")
+        use_pipeline = False
+    
+    if parser is not None:
+        ecg_files = parser.export.list_members('electrocardiograms', '.csv')
+        route_files = parser.export.list_members('workout-routes', '.gpx')
+        print(f"心電図ファイル: {len(ecg_files)}件, ワークアウトルート: {len(route_files)}件")
+        backend = args.xml_backend or load_backend_preference(
+            str(project_root / 'data' / 'cache' / 'xml_backend.json')
+        )
+    
+    if use_pipeline:
+        # レコードは集計しながらパースするため、ここでは絞り込み条件だけを設定する
+        # （古いソースが再集計の初日より前の日付のレコードを送ってきても、パイプラインは読み直さない）
+        parser.configure(
+            since=since, until=args.until, sources=args.sources,
+            exclude_sources=args.exclude_sources, backend=backend, stream_since=stream_since,
+        )
+    else:
+        dataframes = load_exports(args, parser, wearable_exports, since, stream_since, backend)
+        backfill = backfill_date(dataframes, stale, resume) if stale else None
+        if backfill is not None:
+            # 古いソースの新しいレコードの日付から、すべてのソースを読み込み直して再集計する
+            resume = backfill
+            since = max(parse_start_date(resume), args.since) if args.since else parse_start_date(resume)
+            print(f"古いソースに{backfill}の新しいレコードがあるため、{resume}以降を再集計します"
+                  f"（{since}以降のレコードを読み込み）")
+            dataframes = load_exports(args, parser, wearable_exports, since, None, backend)
     
     # データの概要を表示
     print("\n" + "=" * 60)
@@ -48,63 +275,165 @@ def main():
             if 'start_date' in df.columns:
                 print(f"  期間: {df['start_date'].min()} ～ {df['start_date'].max()}")
     
+    # 心電図（CSV）を読み込み、R波を検出して記録ごとのHRVを計算（日次集計で日付ごとに使う）
+    ecg_tables = {}
+    if ecg_files:
+        print("\n心電図を解析中...")
+        ecg_tables = EcgIngester(parser.export, workers=args.workers).ingest()
+        dataframes['ecg_recordings'] = ecg_tables['ecg_recordings']
+    
+    # カレンダー（.ics）の繰り返しを展開し、日ごとの会議の負荷を求める（日次データに結合する）
+    calendar_tables = {}
+    if args.calendar:
+        print("\nカレンダーを読み込み中...")
+        calendar_tables = CalendarIngester(
+            args.calendar, time_zone=args.calendar_time_zone, since=since, until=args.until,
+            meetings_only=not args.all_busy_events,
+        ).ingest()
+        dataframes['calendar_daily'] = calendar_tables['calendar_daily']
+        print(f"  予定: {len(calendar_tables['calendar_events'])}件")
+    
     # 日次データを集計
     print("\n" + "=" * 60)
     print("日次データを集計中...")
     print("=" * 60)
     
-    aggregator = DailyAggregator(dataframes)
+    aggregator_class = AGGREGATION_ENGINES[args.aggregation_engine]
+    output_dir = project_root / 'data' / 'processed'
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_file = output_dir / 'daily_health.csv'
+    new_fingerprints = None
     
-    # データの期間を取得
-    all_dates = []
-    for df in dataframes.values():
-        if not df.empty and 'start_date' in df.columns:
-            all_dates.extend(df['start_date'].dt.date.tolist())
+    if use_pipeline:
+        # 月ごとにパースしながら、後の月のレコードの影響を受けない日から集計して書き出す
+        # （心電図・カレンダーの日ごとのデータは各期間の集計にそのまま渡す）
+        index = ExportIndex.load(parser.export.xml_member) or parser.build_index()
+        pipeline = PipelinedIngest(
+            parser, index, workers=args.workers, queue_depth=args.queue_depth, extra_frames=dataframes,
+            aggregator_class=aggregator_class,
+        )
+        start_date = resume
+        if start_date is None and since is not None:
+            start_date = since + timedelta(days=LOOKBACK_DAYS)
+        
+        daily_health_list = []
+        daily_frame([]).to_csv(output_file, index=False)
+        for batch in pipeline.run(start_date, args.until):
+            daily_frame(batch).to_csv(output_file, mode='a', header=False, index=False)
+            daily_health_list.extend(batch)
+            if batch:
+                print(f"  {batch[0].date} ～ {batch[-1].date}を集計しました")
+        
+        print(f"レコード数: {pipeline.record_count}")
+        if not daily_health_list:
+            print("エラー: 日付データが見つかりません")
+            return
+        df_daily = daily_frame(daily_health_list)
+        workouts = pipeline.workouts_frame()
+        watermarks = pipeline.watermarks
+    else:
+        # 複数のソース（iPhone・Apple Watch・他のアプリ）が重なる時間帯は優先度の高いソースだけを使う
+        aggregator = aggregator_class(dataframes)
+        print(f"ソースの統合: {aggregator.source_merger.describe()}")
     
-    if not all_dates:
-        print("エラー: 日付データが見つかりません")
-        return
+        # データの期間を取得（各レコードを記録した現地の日付）
+        all_days = []
+        for df in dataframes.values():
+            if not df.empty and 'start_date' in df.columns:
+                days = frame_local_days(df)
+                days = days[days != NO_LOCAL_DAY]
+                if len(days):
+                    all_days.extend([int(days.min()), int(days.max())])
     
-    start_date = min(all_dates)
-    end_date = max(all_dates)
+        if not all_days:
+            print("エラー: 日付データが見つかりません")
+            return
     
-    print(f"集計期間: {start_date} ～ {end_date}")
+        start_date = day_from_number(min(all_days))
+        end_date = day_from_number(max(all_days))
+        if resume is not None:
+            # 再集計の初日より前の日は、必要なレコードが揃っていないため集計しない
+            start_date = max(start_date, resume)
+        elif since is not None:
+            # 読み込み開始日は前日夜の睡眠などが欠けるため、その翌日から集計する
+            start_date = max(start_date, since + timedelta(days=LOOKBACK_DAYS))
     
-    # 日次データを集計
-    daily_health_list = aggregator.aggregate_date_range(start_date, end_date)
-    
-    # DataFrameに変換
-    daily_data = []
-    for daily_health in daily_health_list:
-        daily_data.append({
-            'date': daily_health.date,
-            'sleep_minutes': daily_health.sleep_minutes,
-            'deep_sleep_minutes': daily_health.deep_sleep_minutes,
-            'rem_sleep_minutes': daily_health.rem_sleep_minutes,
-            'light_sleep_minutes': daily_health.light_sleep_minutes,
-            'hrv_avg': daily_health.hrv_avg,
-            'hrv_deep_sleep_avg': daily_health.hrv_deep_sleep_avg,
-            'hrv_deep_sleep_stddev': daily_health.hrv_deep_sleep_stddev,
-            'hrv_min': daily_health.hrv_min,
-            'hrv_max': daily_health.hrv_max,
-            'resting_heart_rate': daily_health.resting_heart_rate,
-            'avg_heart_rate': daily_health.avg_heart_rate,
-            'steps': daily_health.steps,
-            'active_energy': daily_health.active_energy,
-        })
+        print(f"集計期間: {start_date} ～ {end_date}")
     
-    df_daily = pd.DataFrame(daily_data)
+        # 取り込み済みのレコードを指紋で見分け、新しいレコードがある日だけを再集計する
+        # （全期間のエクスポートを取り込み直しても、集計の手間は新しいデータの分だけになる）
+        date_ranges = [(start_date, end_date)]
+        if args.dedupe:
+            ledger = RecordLedger(str(project_root / 'data' / 'db' / 'record_ledger'))
+            # ワークアウトも日次集計に使うため、レコードと同じく新しいものがある日を再集計する
+            record_frames = {
+                data_type: df for data_type, df in dataframes.items()
+                if data_type in DEFAULT_REGISTRY or data_type == RecordFilter.WORKOUTS
+            }
+            fingerprints = fingerprint_frames(record_frames)
+            new_masks = ledger.new_record_masks(fingerprints)
+            new_fingerprints = np.concatenate(
+                [fingerprints[data_type][mask] for data_type, mask in new_masks.items()] + [np.empty(0, np.uint64)]
+            )
+            new_days = np.concatenate(
+                [frame_local_days(record_frames[data_type])[mask] for data_type, mask in new_masks.items()]
+                + [np.empty(0, np.int32)]
+            )
+            date_ranges = affected_date_ranges(new_days, start_date, end_date, LOOKBACK_DAYS)
+            total = sum(len(values) for values in fingerprints.values())
+            day_count = sum((last_date - first_date).days + 1 for first_date, last_date in date_ranges)
+            print(f"新しいレコード: {len(new_fingerprints)}件 / {total}件（取り込み済み: {len(ledger)}件）")
+            print(f"再集計する日: {day_count}日")
     
-    # データを保存
-    output_dir = project_root / 'data' / 'processed'
-    output_dir.mkdir(parents=True, exist_ok=True)
+        # 日次データを集計
+        daily_health_list = []
+        for first_date, last_date in date_ranges:
+            daily_health_list.extend(aggregator.aggregate_date_range(first_date, last_date))
     
-    output_file = output_dir / 'daily_health.csv'
-    df_daily.to_csv(output_file, index=False)
+        df_daily = daily_frame(daily_health_list)
+        if args.dedupe:
+            # 再集計しなかった日も残すため、前回のCSVの同じ日だけを置き換える
+            merged = merge_daily_csv(output_file, df_daily, date_ranges)
+            merged.to_csv(output_file, index=False)
+            print(f"前回の日次データに{len(df_daily)}日分を反映しました（合計{len(merged)}日）")
+        else:
+            df_daily.to_csv(output_file, index=False)
+        workouts = dataframes.get('workouts', pd.DataFrame())
+        watermarks = compute_watermarks({
+            data_type: df for data_type, df in dataframes.items()
+            if data_type in DEFAULT_REGISTRY
+        })
     
     print(f"\n日次データを保存しました: {output_file}")
     print(f"データ件数: {len(df_daily)}日")
     
+    for name, df in {**ecg_tables, **calendar_tables}.items():
+        table_file = output_dir / f'{name}.csv'
+        df.to_csv(table_file, index=False)
+        print(f"{name}を保存しました: {table_file}（{len(df)}件）")
+    
+    # ワークアウトルート（GPX）を読み込み、距離・獲得標高・1kmごとのスプリットを計算
+    if route_files:
+        print("\nワークアウトルートを読み込み中...")
+        route_tables = WorkoutRouteIngester(parser.export, workers=args.workers).ingest(workouts)
+        for name, df in route_tables.items():
+            route_file = output_dir / f'{name}.csv'
+            df.to_csv(route_file, index=False)
+            print(f"{name}を保存しました: {route_file}（{len(df)}件）")
+    
+    # 高水位標を保存（import_to_db.pyでのインポート完了後にDBへ反映する）
+    watermark_file = output_dir / 'import_watermarks.json'
+    save_watermarks(watermarks, watermark_file)
+    print(f"高水位標を保存しました: {watermark_file}")
+    
+    # 新しいレコードの指紋を保存（import_to_db.pyでのインポート完了後に台帳へ追加する）
+    fingerprint_file = output_dir / 'new_record_fingerprints.npy'
+    if new_fingerprints is not None:
+        np.save(fingerprint_file, new_fingerprints)
+        print(f"新しいレコードの指紋を保存しました: {fingerprint_file}")
+    else:
+        fingerprint_file.unlink(missing_ok=True)
+    
     # データの概要を表示
     print("\n" + "=" * 60)
     print("集計結果の概要")
@@ -121,6 +450,10 @@ def main():
         print(f"\n平均HRV: {df_daily['hrv_avg'].mean():.2f}ms")
         print(f"HRV範囲: {df_daily['hrv_avg'].min():.2f} ～ {df_daily['hrv_avg'].max():.2f}ms")
     
+    if df_daily['hrv_rmssd'].notna().any():
+        print(f"\n拍動から求めたRMSSDがある日: {df_daily['hrv_rmssd'].notna().sum()}日")
+        print(f"平均RMSSD: {df_daily['hrv_rmssd'].mean():.2f}ms, 平均pNN50: {df_daily['hrv_pnn50'].mean():.1f}%")
+    
     print("\n処理完了！")
 
 
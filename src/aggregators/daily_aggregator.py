@@ -2,24 +2,183 @@
 日次データの集計処理
 """
 import pandas as pd
-from datetime import date, datetime
-from typing import Dict, Optional, List
+from datetime import date
+from typing import Dict, Optional, List, Sequence
 import numpy as np
+from src.aggregators.source_merge import SourceMerger
+from src.calculators.hrv_metrics import beat_metrics, pooled_metrics
 from src.models.health_data import DailyHealth
+from src.parsers.hrv_beats import HRV_BEATS_TABLE
+from src.parsers.timestamps import NO_LOCAL_DAY, day_from_number, day_number, frame_local_days, frame_local_ns
+from src.parsers.type_registry import DEFAULT_REGISTRY, HealthTypeRegistry
+
+# カテゴリに存在しない値のコード（どのコードとも一致しない）
+NO_CODE = -2
+# 欠損した日時のナノ秒表現
+NAT_NS = np.iinfo(np.int64).min
+DAY_NS = 24 * 60 * 60 * 10**9
+HOUR_NS = 60 * 60 * 10**9
+
+# 日付キーの種類 → 現地時刻をずらす時間と、その日に含める時間帯の長さ
+# 'night': 前日22:00～当日10:00（2時間ずらすと0:00～12:00）
+# 'sleep': 前日18:00～当日18:00に始まるもの（6時間ずらすと0:00～24:00）
+_DAY_WINDOWS = {
+    'night': (2 * HOUR_NS, 12 * HOUR_NS),
+    'sleep': (6 * HOUR_NS, DAY_NS),
+}
+
+
+def _category_codes(df: pd.DataFrame, column: str, default: str) -> tuple:
+    """
+    文字列の列をカテゴリの整数コードとして取得
+    
+    パーサーが出力するカテゴリ型の列はそのままコードを使い、
+    それ以外の列（CSVから読み込んだものなど）はカテゴリ型に変換する。
+    
+    パラメータ:
+    - df: DataFrame
+    - column: 列名
+    - default: 列がない場合にすべての行の値とみなす文字列
+    
+    戻り値:
+    - (コードの配列（欠損値は-1）, 文字列 → コードの辞書)
+    """
+    if column not in df.columns:
+        return np.zeros(len(df), dtype=np.int8), {default: 0}
+    series = df[column]
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype('category')
+    lookup = {name: code for code, name in enumerate(series.cat.categories)}
+    return series.cat.codes.to_numpy(), lookup
+
+
+def _to_ns(series: pd.Series) -> np.ndarray:
+    """日時の列をUTCエポックのナノ秒（int64、欠損値はNAT_NS）に変換"""
+    return series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+class _DayIndex:
+    """
+    レコードを整数の日付キーで引くための索引
+    
+    日付キーでソートした行番号を持ち、指定日のレコードを二分探索で取り出す。
+    """
+    
+    def __init__(self, keys: np.ndarray):
+        """
+        パラメータ:
+        - keys: 各レコードの日付キー（1970-01-01からの日数、対象外のレコードはNO_LOCAL_DAY）
+        """
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+    
+    def rows(self, first_day: int, last_day: Optional[int] = None) -> np.ndarray:
+        """
+        日付キーが範囲内のレコードの行番号（元の順序）
+        
+        パラメータ:
+        - first_day: 最初の日付キー
+        - last_day: 最後の日付キー（Noneの場合はfirst_dayのみ）
+        
+        戻り値:
+        - 行番号の配列
+        """
+        last_day = first_day if last_day is None else last_day
+        low = np.searchsorted(self.sorted_keys, first_day, side='left')
+        high = np.searchsorted(self.sorted_keys, last_day, side='right')
+        return np.sort(self.order[low:high])
 
 
 class DailyAggregator:
     """日次データを集計するクラス"""
     
-    def __init__(self, dataframes: Dict[str, pd.DataFrame]):
+    def __init__(self, dataframes: Dict[str, pd.DataFrame],
+                 registry: HealthTypeRegistry = DEFAULT_REGISTRY,
+                 source_priorities: Optional[Dict[str, Sequence[str]]] = None,
+                 merge_sources: bool = True):
         """
         集計器を初期化
         
         パラメータ:
         - dataframes: データタイプごとのDataFrameの辞書
+        - registry: データタイプの登録簿（日次集計の方法が宣言されたタイプをまとめて集計する）
+        - source_priorities: データタイプ名 → 優先度の高い順のソース名のパターン
+          （指定のないタイプはDEFAULT_SOURCE_PRIORITY）
+        - merge_sources: Trueの場合、統合方法が宣言されたタイプは複数のソースの重複を除いてから集計する
+        """
+        self.registry = registry
+        self.source_merger = SourceMerger(registry, source_priorities)
+        self.dataframes = self.source_merger.merge(dataframes) if merge_sources else dataframes
+        # HRVサンプルごとの拍動の指標（初回のaggregate_hrv()で計算する）
+        self._beat_metrics: Optional[pd.DataFrame] = None
+        # 心電図の記録の日ごとの平均（初回のaggregate_ecg()で計算する）
+        self._daily_ecg: Optional[Dict[date, Dict]] = None
+        self._daily_calendar: Optional[Dict[date, Dict]] = None
+        # データタイプごとの開始日時の現地時刻と、日付キーの索引（初回に使う際に一度だけ計算する）
+        self._local_ns: Dict[str, np.ndarray] = {}
+        self._day_indexes: Dict[tuple, _DayIndex] = {}
+        self._long_sleep: Optional[np.ndarray] = None
+        measurement_fields = set(DailyHealth.measurement_field_names())
+        for health_type in registry.reduced_types():
+            if health_type.daily_column not in measurement_fields:
+                raise ValueError(
+                    f"{health_type.name}: daily_column '{health_type.daily_column}'はDailyHealthの列ではありません"
+                )
+        
+    def _local_start_ns(self, name: str) -> np.ndarray:
+        """
+        各レコードの開始日時の現地の壁時計時刻のナノ秒
+        
+        レコードごとのUTCオフセット（HKTimeZoneがあればそのタイムゾーン）で求めるため、
+        旅行や夏時間でオフセットが混在していても各レコードの現地時刻になる。
+        """
+        local_ns = self._local_ns.get(name)
+        if local_ns is None:
+            local_ns = frame_local_ns(self.dataframes[name])
+            self._local_ns[name] = local_ns
+        return local_ns
+    
+    def _day_index(self, name: str, window: str = 'day') -> _DayIndex:
         """
-        self.dataframes = dataframes
+        データタイプのレコードを現地の日付キーで引く索引
         
+        パラメータ:
+        - name: データタイプ名
+        - window: 'day'（開始日時の現地の日付）、'night'または'sleep'（_DAY_WINDOWSの時間帯）
+        
+        戻り値:
+        - _DayIndex
+        """
+        index = self._day_indexes.get((name, window))
+        if index is None:
+            if window == 'day':
+                keys = frame_local_days(self.dataframes[name])
+            else:
+                shift, length = _DAY_WINDOWS[window]
+                local_ns = self._local_start_ns(name)
+                shifted = local_ns + shift
+                keys = np.where(
+                    (local_ns != NAT_NS) & (shifted % DAY_NS < length), shifted // DAY_NS, NO_LOCAL_DAY
+                ).astype(np.int32)
+            index = _DayIndex(keys)
+            self._day_indexes[(name, window)] = index
+        return index
+    
+    def _long_sleep_rows(self) -> np.ndarray:
+        """24時間を超える睡眠レコードの行番号（前日より前に始まっても対象期間と重なりうるもの）"""
+        if self._long_sleep is None:
+            df = self.dataframes['sleep']
+            start_ns = _to_ns(df['start_date'])
+            end_ns = _to_ns(df['end_date'])
+            valid = (start_ns != NAT_NS) & (end_ns != NAT_NS)
+            self._long_sleep = np.flatnonzero(valid & (end_ns - start_ns > DAY_NS))
+        return self._long_sleep
+    
+    def _day_frame(self, name: str, target_date: date) -> pd.DataFrame:
+        """開始日時の現地の日付が指定日のレコード"""
+        df = self.dataframes[name]
+        return df.iloc[self._day_index(name).rows(day_number(target_date))]
+    
     def aggregate_sleep(self, target_date: date) -> Dict:
         """
         指定日の睡眠データを集計
@@ -35,23 +194,18 @@ class DailyAggregator:
         
         df = self.dataframes['sleep']
         
-        # 日付でフィルタ（タイムゾーンを考慮）
         # 睡眠は前日の夜から当日の朝まで続く可能性があるため、前日の18:00から当日の18:00までを対象とする
-        prev_date = target_date - pd.Timedelta(days=1)
-        
-        if df['start_date'].dt.tz is not None:
-            tz = df['start_date'].dt.tz
-            start = pd.Timestamp(datetime.combine(prev_date, datetime(1900, 1, 1, 18, 0).time()), tz=tz)
-            end = pd.Timestamp(datetime.combine(target_date, datetime(1900, 1, 1, 18, 0).time()), tz=tz)
-        else:
-            start = pd.Timestamp(datetime.combine(prev_date, datetime(1900, 1, 1, 18, 0).time()))
-            end = pd.Timestamp(datetime.combine(target_date, datetime(1900, 1, 1, 18, 0).time()))
-        
-        # 睡眠セッションが対象期間と重なるものを抽出
-        day_sleep = df[
-            (df['start_date'] < end) & 
-            (df['end_date'] > start)
-        ]
+        # （各レコード自身の現地時刻で判定する）
+        target = day_number(target_date)
+        window_start = target * DAY_NS - 6 * HOUR_NS
+        window_end = target * DAY_NS + 18 * HOUR_NS
+        
+        # 対象期間と重なるのは、前日・当日の18:00基準の日付キーのものと、24時間を超える長いものだけ
+        rows = np.union1d(self._day_index('sleep', 'sleep').rows(target - 1, target), self._long_sleep_rows())
+        local_start = self._local_start_ns('sleep')[rows]
+        local_end = local_start + (_to_ns(df['end_date'].iloc[rows]) - _to_ns(df['start_date'].iloc[rows]))
+        overlaps = (local_start < window_end) & (local_end > window_start)
+        day_sleep = df.iloc[rows[overlaps]]
         
         if day_sleep.empty:
             return {}
@@ -67,29 +221,39 @@ class DailyAggregator:
         # 睡眠セッションを時系列でソート
         day_sleep = day_sleep.sort_values('start_date')
         
+        # ステージは文字列ではなくカテゴリの整数コードで比較する
+        stage_codes, lookup = _category_codes(day_sleep, 'stage', 'unknown')
+        deep, rem, light, awake = (
+            lookup.get(name, NO_CODE) for name in ('deep', 'rem', 'light', 'awake')
+        )
+        detailed_codes = {deep, rem, light} - {NO_CODE}
+        excluded_codes = {lookup.get(name, NO_CODE) for name in ('unknown', 'unspecified')} - {NO_CODE}
+        
+        # 日時は各レコードの現地の壁時計時刻のナノ秒で扱う
+        start_ns = frame_local_ns(day_sleep, 'start_date')
+        end_ns = frame_local_ns(day_sleep, 'end_date')
+        
         # 重複を排除するため、セッションをマージ
         merged_sessions = []
-        for _, row in day_sleep.iterrows():
-            if pd.isna(row['start_date']) or pd.isna(row['end_date']):
+        for session_start, session_end, stage in zip(start_ns.tolist(), end_ns.tolist(), stage_codes.tolist()):
+            if session_start == NAT_NS or session_end == NAT_NS:
                 continue
             
             # 睡眠セッションの開始と終了を対象期間内に制限
-            session_start = max(row['start_date'], start)
-            session_end = min(row['end_date'], end)
+            session_start = max(session_start, window_start)
+            session_end = min(session_end, window_end)
             
             if session_start >= session_end:
                 continue
             
-            duration = (session_end - session_start).total_seconds() / 60
+            duration = (session_end - session_start) / 1e9 / 60
             
             # 異常に長い睡眠（12時間以上）は除外（unspecifiedやunknownの長いセッションを除外）
             if duration > 12 * 60:
                 continue
             
-            stage = row.get('stage', 'unknown')
-            
             # unspecifiedやunknownのステージは、他のステージと重複している可能性があるため除外
-            if stage in ['unknown', 'unspecified']:
+            if stage in excluded_codes:
                 continue
             
             merged_sessions.append({
@@ -111,14 +275,14 @@ class DailyAggregator:
                 # 時間が重複している場合
                 if (session['start'] < existing['end'] and session['end'] > existing['start']):
                     # より詳細なステージ（deep, rem, light）を優先
-                    if session['stage'] in ['deep', 'rem', 'light'] and existing['stage'] in ['deep', 'rem', 'light']:
+                    if session['stage'] in detailed_codes and existing['stage'] in detailed_codes:
                         # より長い方を採用
                         if session['duration'] > existing['duration']:
                             processed_sessions.remove(existing)
                             processed_sessions.append(session)
                         is_duplicate = True
                         break
-                    elif session['stage'] in ['deep', 'rem', 'light']:
+                    elif session['stage'] in detailed_codes:
                         # 詳細なステージを優先
                         processed_sessions.remove(existing)
                         processed_sessions.append(session)
@@ -136,15 +300,15 @@ class DailyAggregator:
             stage = session['stage']
             duration = session['duration']
             
-            if stage == 'deep':
+            if stage == deep:
                 sleep_data['deep_sleep_minutes'] += duration
-            elif stage == 'rem':
+            elif stage == rem:
                 sleep_data['rem_sleep_minutes'] += duration
-            elif stage == 'light':
+            elif stage == light:
                 sleep_data['light_sleep_minutes'] += duration
             
             # 覚醒以外は総睡眠時間に含める
-            if stage != 'awake':
+            if stage != awake:
                 sleep_data['sleep_minutes'] += duration
         
         # 異常に長い総睡眠時間（20時間以上）は除外
@@ -170,22 +334,8 @@ class DailyAggregator:
         df = self.dataframes['hrv']
         
         # 前日の夜から当日の朝まで（睡眠期間）のHRVを取得
-        # 前日の22:00から当日の10:00まで
-        prev_date = target_date - pd.Timedelta(days=1)
-        
-        # タイムゾーンを考慮
-        if df['start_date'].dt.tz is not None:
-            tz = df['start_date'].dt.tz
-            start = pd.Timestamp(datetime.combine(prev_date, datetime(1900, 1, 1, 22, 0).time()), tz=tz)
-            end = pd.Timestamp(datetime.combine(target_date, datetime(1900, 1, 1, 10, 0).time()), tz=tz)
-        else:
-            start = pd.Timestamp(datetime.combine(prev_date, datetime(1900, 1, 1, 22, 0).time()))
-            end = pd.Timestamp(datetime.combine(target_date, datetime(1900, 1, 1, 10, 0).time()))
-        
-        night_hrv = df[
-            (df['start_date'] >= start) & 
-            (df['start_date'] < end)
-        ]
+        # 前日の22:00から当日の10:00まで（各レコード自身の現地時刻）
+        night_hrv = df.iloc[self._day_index('hrv', 'night').rows(day_number(target_date))]
         
         if night_hrv.empty:
             return {}
@@ -207,8 +357,74 @@ class DailyAggregator:
                 hrv_data['hrv_deep_sleep_avg'] = float(deep_sleep_hrv.mean())
                 hrv_data['hrv_deep_sleep_stddev'] = float(deep_sleep_hrv.std())
         
+        # 拍動ごとの瞬間心拍数がある場合は、夜間の全サンプルの連続差分からRMSSD・pNN50を求める
+        # （hrvの行番号が拍動のsample_id）
+        night_beats = pooled_metrics(self.get_beat_metrics(), night_hrv.index)
+        if night_beats is not None:
+            hrv_data['hrv_rmssd'] = night_beats['rmssd']
+            hrv_data['hrv_ln_rmssd'] = night_beats['ln_rmssd']
+            hrv_data['hrv_pnn50'] = night_beats['pnn50']
+        
         return hrv_data
     
+    def get_beat_metrics(self) -> pd.DataFrame:
+        """
+        HRVサンプルごとのRMSSD・lnRMSSD・pNN50を取得（全サンプル分を一度だけ計算する）
+        
+        戻り値:
+        - beat_metrics()の結果（拍動データがない場合は空のDataFrame）
+        """
+        if self._beat_metrics is None:
+            self._beat_metrics = beat_metrics(self.dataframes.get(HRV_BEATS_TABLE))
+        return self._beat_metrics
+    
+    def aggregate_ecg(self, target_date: date) -> Dict:
+        """
+        指定日の心電図の記録から求めたHRVを集計
+        
+        パラメータ:
+        - target_date: 集計対象の日付
+        
+        戻り値:
+        - ecg_rmssd, ecg_ln_rmssd, ecg_pnn50の辞書（記録した現地の日付が指定日のものの平均）
+        """
+        if self._daily_ecg is None:
+            self._daily_ecg = {}
+            df = self.dataframes.get('ecg_recordings')
+            if df is not None and not df.empty:
+                # 全記録を一度だけ日付ごとにまとめておく
+                valid = df[df['rmssd'].notna() & df['date'].notna()]
+                means = valid.groupby('date')[['rmssd', 'ln_rmssd', 'pnn50']].mean()
+                for day, row in zip(means.index.tolist(), means.itertuples(index=False)):
+                    self._daily_ecg[day] = {
+                        'ecg_rmssd': float(row.rmssd),
+                        'ecg_ln_rmssd': float(row.ln_rmssd),
+                        'ecg_pnn50': float(row.pnn50),
+                    }
+        return self._daily_ecg.get(target_date, {})
+    
+    def aggregate_calendar(self, target_date: date) -> Dict:
+        """
+        指定日のカレンダーの予定から求めた会議の負荷
+        
+        パラメータ:
+        - target_date: 集計対象の日付
+        
+        戻り値:
+        - meeting_count, meeting_minutes, back_to_back_meetings, late_meetings,
+          longest_free_block_minutesの辞書（カレンダーの期間外の日は空）
+        """
+        if self._daily_calendar is None:
+            self._daily_calendar = {}
+            df = self.dataframes.get('calendar_daily')
+            if df is not None and not df.empty:
+                columns = [column for column in df.columns if column != 'date']
+                for day, row in zip(df['date'].tolist(), df[columns].itertuples(index=False)):
+                    self._daily_calendar[day] = {
+                        column: int(value) for column, value in zip(columns, row)
+                    }
+        return self._daily_calendar.get(target_date, {})
+    
     def aggregate_heart_rate(self, target_date: date) -> Dict:
         """
         指定日の心拍数データを集計
@@ -223,42 +439,16 @@ class DailyAggregator:
         
         # 安静時心拍数
         if 'resting_heart_rate' in self.dataframes and not self.dataframes['resting_heart_rate'].empty:
-            df = self.dataframes['resting_heart_rate']
-            
-            # タイムゾーンを考慮
-            if df['start_date'].dt.tz is not None:
-                tz = df['start_date'].dt.tz
-                start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()), tz=tz)
-                end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()), tz=tz)
-            else:
-                start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()))
-                end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()))
-            
-            day_hr = df[
-                (df['start_date'] >= start) & 
-                (df['start_date'] < end)
-            ]
+            # 開始日時の現地の日付が指定日のもの
+            day_hr = self._day_frame('resting_heart_rate', target_date)
             
             if not day_hr.empty:
                 heart_rate_data['resting_heart_rate'] = int(day_hr['value'].mean())
         
         # 平均心拍数
         if 'heart_rate' in self.dataframes and not self.dataframes['heart_rate'].empty:
-            df = self.dataframes['heart_rate']
-            
-            # タイムゾーンを考慮
-            if df['start_date'].dt.tz is not None:
-                tz = df['start_date'].dt.tz
-                start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()), tz=tz)
-                end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()), tz=tz)
-            else:
-                start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()))
-                end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()))
-            
-            day_hr = df[
-                (df['start_date'] >= start) & 
-                (df['start_date'] < end)
-            ]
+            # 開始日時の現地の日付が指定日のもの
+            day_hr = self._day_frame('heart_rate', target_date)
             
             if not day_hr.empty:
                 heart_rate_data['avg_heart_rate'] = int(day_hr['value'].mean())
@@ -280,21 +470,8 @@ class DailyAggregator:
         if 'workouts' not in self.dataframes or self.dataframes['workouts'].empty:
             return workout_data
         
-        df = self.dataframes['workouts']
-        
-        # タイムゾーンを考慮
-        if df['start_date'].dt.tz is not None:
-            tz = df['start_date'].dt.tz
-            start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()), tz=tz)
-            end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()), tz=tz)
-        else:
-            start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()))
-            end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()))
-        
-        day_workouts = df[
-            (df['start_date'] >= start) & 
-            (df['start_date'] < end)
-        ]
+        # 開始日時の現地の日付が指定日のもの
+        day_workouts = self._day_frame('workouts', target_date)
         
         if not day_workouts.empty:
             # ワークアウトタイプごとに集計
@@ -334,87 +511,101 @@ class DailyAggregator:
         
         # 歩数
         if 'steps' in self.dataframes and not self.dataframes['steps'].empty:
-            df = self.dataframes['steps']
-            
-            # タイムゾーンを考慮
-            if df['start_date'].dt.tz is not None:
-                tz = df['start_date'].dt.tz
-                start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()), tz=tz)
-                end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()), tz=tz)
-            else:
-                start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()))
-                end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()))
-            
-            day_steps = df[
-                (df['start_date'] >= start) & 
-                (df['start_date'] < end)
-            ]
+            # 開始日時の現地の日付が指定日のもの
+            day_steps = self._day_frame('steps', target_date)
             
             if not day_steps.empty:
-                # Apple Healthの歩数データは各レコードが「その時間帯の歩数」を表している
-                # ただし、同じ時間帯に複数のソース（iPhone/Apple Watch）から
-                # 重複したレコードがある可能性があるため、重複を除外する
-                
-                # 時間帯を1分単位で分割し、重複している時間帯の最大値を使用
-                from datetime import timedelta
-                
-                min_slots = {}
-                for _, row in day_steps.iterrows():
-                    current = row['start_date']
-                    end = row['end_date']
-                    duration_minutes = max(1, (end - current).total_seconds() / 60)
-                    value_per_minute = row['value'] / duration_minutes
-                    
-                    # このレコードの時間帯を1分単位で分割
-                    while current < end:
-                        slot_key = current.floor('1min')
-                        if slot_key not in min_slots:
-                            min_slots[slot_key] = []
-                        min_slots[slot_key].append(value_per_minute)
-                        current += timedelta(minutes=1)
-                
-                # 各スロットの最大値を使用（重複排除）
-                total_steps = 0
-                for slot, values in min_slots.items():
-                    total_steps += max(values)
+                # 各レコードは「その時間帯の歩数」。複数のソース（iPhone/Apple Watch）が重なる時間帯は
+                # 集計前にSourceMergerが優先度の高いソースだけにしているため、そのまま合計する
+                total_steps = day_steps['value'].sum()
                 
                 activity_data['steps'] = int(total_steps)
         
         # アクティブエネルギー
         if 'active_energy' in self.dataframes and not self.dataframes['active_energy'].empty:
-            df = self.dataframes['active_energy']
-            
-            # タイムゾーンを考慮
-            if df['start_date'].dt.tz is not None:
-                tz = df['start_date'].dt.tz
-                start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()), tz=tz)
-                end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()), tz=tz)
-            else:
-                start = pd.Timestamp(datetime.combine(target_date, datetime.min.time()))
-                end = pd.Timestamp(datetime.combine(target_date, datetime.max.time()))
-            
-            day_energy = df[
-                (df['start_date'] >= start) & 
-                (df['start_date'] < end)
-            ]
+            # 開始日時の現地の日付が指定日のもの
+            day_energy = self._day_frame('active_energy', target_date)
             
             if not day_energy.empty:
                 activity_data['active_energy'] = float(day_energy['value'].sum())
         
         return activity_data
     
-    def aggregate_daily(self, target_date: date) -> DailyHealth:
+    def aggregate_registered(self, start_date: date, end_date: date) -> Dict[date, Dict]:
+        """
+        日次集計の方法が登録簿で宣言されたデータタイプを、日付範囲でまとめて集計
+        
+        日ごとにDataFrameを絞り込むのではなく、各レコードの日付キーを一度に計算し、
+        groupbyで全日分を集計する。
+        
+        パラメータ:
+        - start_date: 開始日
+        - end_date: 終了日
+        
+        戻り値:
+        - 日付 → {daily_column: 値}の辞書（値がない日は含まない）
+        """
+        results: Dict[date, Dict] = {}
+        range_start = pd.Timestamp(start_date).value
+        range_end = pd.Timestamp(end_date).value + DAY_NS
+        
+        for health_type in self.registry.reduced_types():
+            df = self.dataframes.get(health_type.name)
+            if df is None or df.empty:
+                continue
+            
+            local_ns = self._local_start_ns(health_type.name)
+            values = df['value'].to_numpy(dtype=np.float64)
+            valid = (local_ns != NAT_NS) & ~np.isnan(values)
+            
+            if health_type.reduction.startswith('night_'):
+                # 前日22:00～当日10:00を当日の夜とする（2時間ずらすと0:00～12:00になる）
+                shifted = local_ns + 2 * HOUR_NS
+                valid &= (shifted % DAY_NS) < 12 * HOUR_NS
+            else:
+                shifted = local_ns
+            valid &= (shifted >= range_start) & (shifted < range_end)
+            if not valid.any():
+                continue
+            
+            series = pd.Series(values[valid], index=shifted[valid] // DAY_NS)
+            if health_type.reduction == 'day_last':
+                # 開始日時の順で最後の値（現地時刻はオフセットが混在しうるためUTCの順）
+                series = series.iloc[np.argsort(_to_ns(df['start_date'])[valid], kind='stable')]
+            grouped = series.groupby(level=0)
+            reduced = {
+                'night_mean': grouped.mean,
+                'night_min': grouped.min,
+                'day_mean': grouped.mean,
+                'day_sum': grouped.sum,
+                'day_max': grouped.max,
+                'day_last': grouped.last,
+            }[health_type.reduction]() * health_type.scale
+            
+            for number, value in zip(reduced.index.tolist(), reduced.tolist()):
+                results.setdefault(day_from_number(number), {})[health_type.daily_column] = float(value)
+        
+        return results
+    
+    def aggregate_daily(self, target_date: date,
+                        registered_data: Optional[Dict] = None) -> DailyHealth:
         """
         指定日のすべてのデータを集計
         
         パラメータ:
         - target_date: 集計対象の日付
+        - registered_data: aggregate_registered()で集計済みの指定日の値（Noneの場合はその日だけ集計する）
         
         戻り値:
         - DailyHealthオブジェクト
         """
+        if registered_data is None:
+            registered_data = self.aggregate_registered(target_date, target_date).get(target_date, {})
+        
         sleep_data = self.aggregate_sleep(target_date)
         hrv_data = self.aggregate_hrv(target_date, sleep_data)
+        ecg_data = self.aggregate_ecg(target_date)
+        calendar_data = self.aggregate_calendar(target_date)
         heart_rate_data = self.aggregate_heart_rate(target_date)
         activity_data = self.aggregate_activity(target_date)
         workout_data = self.aggregate_workouts(target_date)
@@ -424,8 +615,11 @@ class DailyAggregator:
             date=target_date,
             **sleep_data,
             **hrv_data,
+            **ecg_data,
             **heart_rate_data,
-            **activity_data
+            **activity_data,
+            **calendar_data,
+            **registered_data
         )
         
         # ワークアウトデータは別途保存（将来的にテーブルを追加）
@@ -446,9 +640,11 @@ class DailyAggregator:
         """
         daily_health_list = []
         current_date = start_date
+        # 登録簿のデータタイプは日付範囲でまとめて集計しておく
+        registered = self.aggregate_registered(start_date, end_date)
         
         while current_date <= end_date:
-            daily_health = self.aggregate_daily(current_date)
+            daily_health = self.aggregate_daily(current_date, registered.get(current_date, {}))
             daily_health_list.append(daily_health)
             current_date += pd.Timedelta(days=1)
         
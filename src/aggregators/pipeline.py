@@ -0,0 +1,288 @@
+"""
+パースと日次集計を重ねて進めるパイプライン
+
+export.xmlの索引（月ごとのラン）を使い、月の順にパースする。パースはワーカープロセスで先行して進め、
+完了した月のレコードは深さの決まったキューを通って集計側に渡る。集計側は月を受け取るたびに、
+それより後の月のレコードの影響を受けない日を確定して返し、確定した日より前のレコードは捨てる。
+メモリ使用量はエクスポート全体ではなく、キューの深さ分の月と集計中の月のレコード数で決まる。
+"""
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple, Type
+import numpy as np
+import pandas as pd
+from src.aggregators.daily_aggregator import DailyAggregator
+from src.models.health_data import DailyHealth
+from src.parsers.export_index import ExportIndex
+from src.parsers.hrv_beats import HRV_BEATS_TABLE
+from src.parsers.parallel import parse_byte_range
+from src.parsers.record_collector import RecordCollector
+from src.parsers.timestamps import NO_LOCAL_DAY, day_from_number, day_number, frame_local_days
+from src.parsers.watermarks import Watermarks, compute_watermarks, merge_watermarks
+from src.parsers.wearable_import import combine_dataframes
+from src.parsers.workout_tables import WORKOUT_TABLES
+
+# パース済みで集計を待つ月の数の上限（これ以上は先行してパースしない）
+PIPELINE_QUEUE_DEPTH = 4
+# 各日の集計が参照する前日の日数（前日18:00以降の睡眠・22:00以降のHRV）
+LOOKBACK_DAYS = 1
+# 索引の月（開始日時の文字列の月）と、各レコード自身のタイムゾーンの日付がずれうる日数
+BOUNDARY_MARGIN_DAYS = 1
+
+
+def _month_first_day(month: int) -> date:
+    """索引の月番号（年 * 12 + 月 - 1）の初日"""
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def parse_month(xml_path: str, spans: List[Tuple[int, int]], collector_args: tuple,
+                backend: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+    """
+    1か月分のバイト範囲をパースしてDataFrameにする（ワーカープロセスで実行）
+
+    パラメータ:
+    - xml_path: XMLファイルのパス
+    - spans: その月のレコードを含む(開始位置, 終了位置)のリスト
+    - collector_args: RecordCollectorの初期化引数
+    - backend: XMLバックエンド名
+
+    戻り値:
+    - AppleHealthParser.to_dataframes()と同じ形のDataFrameの辞書
+    """
+    collector = RecordCollector(*collector_args)
+    for start, end in spans:
+        collector.merge(parse_byte_range(xml_path, start, end, collector_args, backend))
+    dataframes = {data_type: columns.to_frame() for data_type, columns in collector.records.items()}
+    dataframes[HRV_BEATS_TABLE] = collector.hrv_beats.to_frame()
+    dataframes.update(collector.workouts.to_frames())
+    return dataframes
+
+
+def trim_dataframes(dataframes: Dict[str, pd.DataFrame], first_day: int) -> Dict[str, pd.DataFrame]:
+    """
+    現地の日付がfirst_dayより前のレコードを除く
+
+    hrv_beatsとワークアウトの子テーブルは、自身の日時ではなく親のレコードを残すかどうかで選び、
+    sample_id・workout_idを残した親の行番号に付け直す（workoutsのworkout_idも付け直す）。
+
+    パラメータ:
+    - dataframes: データタイプごとのDataFrameの辞書
+    - first_day: 残す最初の日付（1970-01-01からの日数）
+
+    戻り値:
+    - 除いた後のDataFrameの辞書
+    """
+    # 子テーブル → (親のテーブル, 親の行番号の列)
+    child_tables = {HRV_BEATS_TABLE: ('hrv', 'sample_id')}
+    child_tables.update({name: ('workouts', 'workout_id') for name in WORKOUT_TABLES if name != 'workouts'})
+
+    trimmed = {}
+    kept_rows: Dict[str, np.ndarray] = {}
+    for name, df in dataframes.items():
+        if name in child_tables or df.empty or 'start_date' not in df.columns:
+            continue
+        days = frame_local_days(df)
+        keep = (days >= first_day) | (days == NO_LOCAL_DAY)
+        if name == 'sleep':
+            # 前日より前に始まる長い睡眠も、残す期間と重なるものは残す
+            end_ns = df['end_date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+            keep |= end_ns >= first_day * 86400 * 10**9
+        kept_rows[name] = keep
+        trimmed[name] = df[keep].reset_index(drop=True)
+    if 'workouts' in trimmed and 'workout_id' in trimmed['workouts'].columns:
+        trimmed['workouts'] = trimmed['workouts'].assign(
+            workout_id=np.arange(len(trimmed['workouts']), dtype=np.int32)
+        )
+
+    for name, df in dataframes.items():
+        if name in trimmed:
+            continue
+        parent_name, column = child_tables.get(name, (None, None))
+        if parent_name not in kept_rows or df.empty:
+            trimmed[name] = df
+            continue
+        # 親の行番号 → 残した行の中での番号
+        parent = kept_rows[parent_name]
+        new_ids = np.cumsum(parent) - 1
+        ids = df[column].to_numpy()
+        keep = parent[ids]
+        trimmed[name] = df[keep].assign(**{column: new_ids[ids[keep]]}).reset_index(drop=True)
+    return trimmed
+
+
+class PipelinedIngest:
+    """
+    export.xmlを月の順にパースしながら、確定した日から順に日次集計するクラス
+
+    パースは最大workersプロセスで先行し、集計を待つ月がPIPELINE_QUEUE_DEPTHに達すると止まる。
+    ある月まで受け取ると、その月の最終日のBOUNDARY_MARGIN_DAYS日前までは後の月のレコードの影響を
+    受けないため確定し、DailyAggregatorで集計する。
+    """
+
+    def __init__(self, parser, index: ExportIndex, workers: Optional[int] = None,
+                 queue_depth: int = PIPELINE_QUEUE_DEPTH,
+                 extra_frames: Optional[Dict[str, pd.DataFrame]] = None,
+                 aggregator_class: Type[DailyAggregator] = DailyAggregator):
+        """
+        パイプラインを初期化
+
+        パラメータ:
+        - parser: AppleHealthParser（絞り込み条件・XMLバックエンドはparser.configure()で設定したもの）
+        - index: export.xmlの索引
+        - workers: パースするプロセス数（Noneの場合は1）
+        - queue_depth: パース済みで集計を待つ月の数の上限
+        - extra_frames: 各期間の集計にそのまま渡す日ごとのDataFrame（'ecg_recordings'・'calendar_daily'）
+        - aggregator_class: 確定した期間を集計するクラス（DailyAggregatorまたはそのサブクラス）
+        """
+        self.parser = parser
+        self.index = index
+        self.workers = max(1, workers or 1)
+        self.queue_depth = max(1, queue_depth)
+        self.extra_frames = extra_frames or {}
+        self.aggregator_class = aggregator_class
+        # 受け取ったレコードの高水位標と、ワークアウトの一覧（ルートの読み込み用、件数は少ない）
+        self.watermarks: Watermarks = {}
+        self.workouts: List[pd.DataFrame] = []
+        self.record_count = 0
+
+    def months(self) -> List[Tuple[int, List[Tuple[int, int]]]]:
+        """
+        パースする月と、その月のレコードを含むバイト範囲
+
+        戻り値:
+        - (月番号, (開始位置, 終了位置)のリスト)のリスト（月の順）
+        """
+        record_filter = self.parser.record_filter
+        identifiers = [
+            identifier for data_type, identifier in self.parser.DATA_TYPES.items()
+            if record_filter.includes_type(data_type)
+        ]
+        months = np.unique(self.index.month[self.index.month >= 0]).tolist()
+        since = record_filter.earliest_since
+        if since is not None:
+            months = [month for month in months if _month_first_day(month) >= since.replace(day=1)]
+        if record_filter.until is not None:
+            months = [month for month in months if _month_first_day(month) <= record_filter.until]
+        plan = []
+        for month in months:
+            first = _month_first_day(month)
+            spans = self.index.spans(
+                identifiers, workouts=record_filter.includes_type(record_filter.WORKOUTS),
+                since=first, until=first,
+            )
+            if spans:
+                plan.append((month, spans))
+        return plan
+
+    def _produce(self, executor: ProcessPoolExecutor, plan, futures: queue.Queue, stop: threading.Event):
+        """月ごとのパースを提出し、結果の受け取り口をキューに入れる（キューが満杯なら待つ）"""
+        try:
+            for month, spans in plan:
+                if stop.is_set():
+                    break
+                future = executor.submit(
+                    parse_month, self.parser.export.xml_member, spans,
+                    self.parser.collector_args(), self.parser.backend,
+                )
+                futures.put((month, future))
+        finally:
+            futures.put(None)
+
+    def run(self, start_date: Optional[date] = None, end_date: Optional[date] = None) -> Iterator[List[DailyHealth]]:
+        """
+        パースしながら日次集計し、確定した日のDailyHealthを日付順に返す
+
+        パラメータ:
+        - start_date: この日より前は集計しない（Noneの場合は最初のレコードの日）
+        - end_date: この日より後は集計しない（Noneの場合は最後のレコードの日）
+
+        戻り値:
+        - 確定した日のDailyHealthのリストのイテレーター（月ごと）
+        """
+        plan = self.months()
+        print(f"  {len(plan)}か月を{self.workers}プロセスでパースし、確定した日から集計します"
+              f"（先行してパースする月: 最大{self.queue_depth}）")
+        futures: queue.Queue = queue.Queue(maxsize=self.queue_depth)
+        stop = threading.Event()
+        buffer: Dict[str, pd.DataFrame] = {}
+        # 次に集計する日と、これまでに受け取ったレコードの最後の日
+        next_day = day_number(start_date) if start_date is not None else None
+        last_seen = None
+        last_day = day_number(end_date) if end_date is not None else None
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            producer = threading.Thread(
+                target=self._produce, args=(executor, plan, futures, stop), daemon=True
+            )
+            producer.start()
+            try:
+                while True:
+                    item = futures.get()
+                    if item is None:
+                        break
+                    month, future = item
+                    frames = future.result()
+                    self._observe(frames)
+                    buffer = combine_dataframes([buffer, frames]) if buffer else frames
+
+                    days = np.concatenate([
+                        frame_local_days(df) for df in frames.values()
+                        if not df.empty and 'start_date' in df.columns
+                    ] + [np.empty(0, dtype=np.int32)])
+                    days = days[days != NO_LOCAL_DAY]
+                    if len(days):
+                        if next_day is None:
+                            next_day = int(days.min())
+                        last_seen = int(days.max()) if last_seen is None else max(last_seen, int(days.max()))
+
+                    # この月より後の月のレコードは、翌月の初日からBOUNDARY_MARGIN_DAYS日前より後にしか現れない
+                    next_month = month + 1
+                    final_day = day_number(_month_first_day(next_month)) - 1 - BOUNDARY_MARGIN_DAYS
+                    if last_seen is not None:
+                        # 最後のレコードより後の日は、後の月のレコードが届いてから集計する
+                        final_day = min(final_day, last_seen)
+                    if last_day is not None:
+                        final_day = min(final_day, last_day)
+                    if next_day is not None and final_day >= next_day:
+                        yield self._aggregate(buffer, next_day, final_day)
+                        next_day = final_day + 1
+                        buffer = trim_dataframes(buffer, next_day - LOOKBACK_DAYS - BOUNDARY_MARGIN_DAYS)
+            finally:
+                stop.set()
+                # 提出待ちの生産者を止めるため、キューに残った結果を読み捨てる
+                while producer.is_alive():
+                    try:
+                        futures.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+        # 最後の月のレコードの日まで集計する
+        if next_day is not None and last_seen is not None:
+            final_day = last_seen if last_day is None else min(last_seen, last_day)
+            if final_day >= next_day:
+                yield self._aggregate(buffer, next_day, final_day)
+
+    def _observe(self, frames: Dict[str, pd.DataFrame]):
+        """受け取った月のレコードの高水位標とワークアウトを記録"""
+        self.record_count += sum(
+            len(df) for name, df in frames.items() if name in self.parser.DATA_TYPES
+        )
+        self.watermarks = merge_watermarks(self.watermarks, compute_watermarks({
+            name: df for name, df in frames.items() if name in self.parser.DATA_TYPES
+        }))
+        if not frames.get('workouts', pd.DataFrame()).empty:
+            self.workouts.append(frames['workouts'])
+
+    def _aggregate(self, buffer: Dict[str, pd.DataFrame], first_day: int, last_day: int) -> List[DailyHealth]:
+        """確定した期間を集計"""
+        aggregator = self.aggregator_class({**buffer, **self.extra_frames})
+        return aggregator.aggregate_date_range(day_from_number(first_day), day_from_number(last_day))
+
+    def workouts_frame(self) -> pd.DataFrame:
+        """受け取ったすべてのワークアウト（workout_idは通し番号）"""
+        if not self.workouts:
+            return pd.DataFrame()
+        workouts = combine_dataframes([{'workouts': df} for df in self.workouts])['workouts']
+        return workouts.assign(workout_id=np.arange(len(workouts), dtype=np.int32))
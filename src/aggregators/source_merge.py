@@ -0,0 +1,307 @@
+"""
+複数のソース（iPhone・Apple Watch・他のアプリ）のレコードの統合
+
+同じ時間帯のレコードを複数のソースが記録していると、合計する量は二重に数えられ、
+測定値は異なる機器の値が混ざって平均される。データタイプごとに宣言された統合方法
+（HealthType.merge）とソースの優先順位に従って、重なった時間帯は優先度の最も高いソースの
+レコードだけを残し、集計処理には重複のない1本のレコード列を渡す。
+
+重なりの判定はソースごとにまとめて行う。優先度の高いソースから順に、それまでのソースが
+覆う時間帯を互いに重ならない区間の和集合（開始位置でソートした配列）として持ち、
+各レコードとの重なりは二分探索で求める。
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from src.parsers.timestamps import local_day_numbers
+from src.parsers.type_registry import DEFAULT_REGISTRY, HealthType, HealthTypeRegistry
+
+# 既定のソースの優先順位（ソース名に含まれる文字列、大文字・小文字は区別しない）
+# どれにも当てはまらないソース（他のアプリなど）はその後ろで、レコード数の多い順
+DEFAULT_SOURCE_PRIORITY = ('watch', 'iphone')
+
+_NAT_NS = np.iinfo(np.int64).min
+_MIN_NS = np.iinfo(np.int64).min
+_MAX_NS = np.iinfo(np.int64).max
+
+
+class SourcePriority:
+    """ソースの優先順位"""
+
+    def __init__(self, patterns: Sequence[str] = DEFAULT_SOURCE_PRIORITY):
+        """
+        パラメータ:
+        - patterns: 優先度の高い順のソース名のパターン（ソース名に含まれる文字列）
+        """
+        self.patterns = [pattern.lower() for pattern in patterns]
+
+    def rank(self, source: str) -> int:
+        """
+        ソースの順位（小さいほど優先）
+
+        パラメータ:
+        - source: ソース名
+
+        戻り値:
+        - 最初に当てはまるパターンの位置（当てはまらない場合はパターンの数）
+        """
+        name = (source or '').lower()
+        for position, pattern in enumerate(self.patterns):
+            if pattern in name:
+                return position
+        return len(self.patterns)
+
+    def order(self, sources: Sequence[str], counts: Sequence[int]) -> List[int]:
+        """
+        ソースを優先度の高い順に並べる
+
+        パラメータ:
+        - sources: ソース名のリスト
+        - counts: ソースごとのレコード数
+
+        戻り値:
+        - sourcesのインデックスのリスト（順位が同じ場合はレコード数の多い順、次にソース名の順）
+        """
+        return sorted(
+            range(len(sources)),
+            key=lambda i: (self.rank(sources[i]), -int(counts[i]), str(sources[i])),
+        )
+
+
+def _to_ns(series: pd.Series) -> np.ndarray:
+    """日時の列をUTCエポックのナノ秒（int64、欠損値は_NAT_NS）に変換"""
+    return series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def _union(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    区間の和集合を、互いに重ならない区間に開始位置の順でまとめる
+
+    パラメータ:
+    - starts: 区間の開始位置
+    - ends: 区間の終了位置
+
+    戻り値:
+    - (開始位置, 終了位置)
+    """
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    reach = np.maximum.accumulate(ends[order])
+    # それまでの区間の終了位置より後に始まる区間から新しい区間になる
+    new = np.empty(len(starts), dtype=bool)
+    new[0] = True
+    new[1:] = starts[1:] > reach[:-1]
+    first = np.flatnonzero(new)
+    return starts[first], reach[np.append(first[1:] - 1, len(starts) - 1)]
+
+
+def _covered_points(points: np.ndarray, union_starts: np.ndarray, union_ends: np.ndarray) -> np.ndarray:
+    """各時点が和集合の区間に含まれるかどうか"""
+    position = np.searchsorted(union_starts, points, side='right') - 1
+    inside = position >= 0
+    inside[inside] = points[inside] <= union_ends[position[inside]]
+    return inside
+
+
+def _uncovered_pieces(starts: np.ndarray, ends: np.ndarray,
+                      union_starts: np.ndarray, union_ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    各区間のうち、和集合に覆われていない部分を求める
+
+    和集合の隙間（最初の区間の前・区間の間・最後の区間の後）のうち各区間と重なるものを
+    二分探索で求め、区間と隙間の共通部分を切り出す。
+
+    パラメータ:
+    - starts, ends: 区間の開始・終了位置
+    - union_starts, union_ends: _union()でまとめた和集合
+
+    戻り値:
+    - (元の区間の番号, 部分の開始位置, 部分の終了位置)。長さ0の部分は含まない
+    """
+    gap_starts = np.concatenate([[_MIN_NS], union_ends])
+    gap_ends = np.concatenate([union_starts, [_MAX_NS]])
+    first_gap = np.searchsorted(gap_ends, starts, side='right')
+    end_gap = np.searchsorted(gap_starts, ends, side='left')
+    counts = np.maximum(end_gap - first_gap, 0)
+
+    owners = np.repeat(np.arange(len(starts)), counts)
+    # 区間ごとに重なる隙間の番号を連番で展開する
+    group_start = np.repeat(np.cumsum(counts) - counts, counts)
+    gaps = np.repeat(first_gap, counts) + (np.arange(len(owners)) - group_start)
+    piece_starts = np.maximum(starts[owners], gap_starts[gaps])
+    piece_ends = np.minimum(ends[owners], gap_ends[gaps])
+    keep = piece_ends > piece_starts
+    return owners[keep], piece_starts[keep], piece_ends[keep]
+
+
+def merge_sources(df: pd.DataFrame, method: str, priority: SourcePriority,
+                  tolerance_sec: float = 0.0) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    1データタイプのレコードを、ソースの優先順位に従って重複のないレコード列にする
+
+    パラメータ:
+    - df: start_date, end_date, source, value列を持つDataFrame
+    - method: 統合方法（'cumulative'、'discrete'、'interval'）
+    - priority: ソースの優先順位
+    - tolerance_sec: discreteの場合に、優先度の高いソースの記録とみなす前後の幅（秒）
+
+    戻り値:
+    - (統合したDataFrame, {'removed': 除いたレコード数, 'trimmed': 一部だけ残したレコード数})
+    """
+    stats = {'removed': 0, 'trimmed': 0}
+    if df.empty or 'source' not in df.columns:
+        return df, stats
+    source = df['source']
+    if not isinstance(source.dtype, pd.CategoricalDtype):
+        source = source.astype('category')
+    codes = source.cat.codes.to_numpy()
+    names = list(source.cat.categories)
+    counts = np.bincount(codes[codes >= 0], minlength=len(names))
+    if np.count_nonzero(counts) <= 1:
+        return df, stats
+
+    start = _to_ns(df['start_date'])
+    end = _to_ns(df['end_date'])
+    dated = (start != _NAT_NS) & (end != _NAT_NS)
+    end = np.where(dated, np.maximum(end, start), end)
+    tolerance = int(tolerance_sec * 1e9) if method == 'discrete' else 0
+
+    # cumulative: 残す割合、discrete: 0か1、interval: 覆われていない部分
+    keep_fraction = np.ones(len(df))
+    piece_rows: List[np.ndarray] = []
+    piece_bounds: List[Tuple[np.ndarray, np.ndarray]] = []
+    covered_starts = np.empty(0, dtype=np.int64)
+    covered_ends = np.empty(0, dtype=np.int64)
+
+    for code in priority.order(names, counts):
+        if counts[code] == 0:
+            continue
+        rows = np.flatnonzero((codes == code) & dated)
+        row_starts = start[rows]
+        row_ends = end[rows]
+        if len(covered_starts):
+            if method == 'discrete':
+                covered = _covered_points(row_starts, covered_starts, covered_ends)
+                keep_fraction[rows[covered]] = 0.0
+            else:
+                owners, piece_starts, piece_ends = _uncovered_pieces(
+                    row_starts, row_ends, covered_starts, covered_ends
+                )
+                lengths = row_ends - row_starts
+                uncovered = np.bincount(owners, weights=piece_ends - piece_starts, minlength=len(rows))
+                # 長さ0のレコード（時点の値）は、その時点が覆われているかで判定する
+                point = lengths == 0
+                fraction = np.where(point, 1.0, uncovered / np.where(point, 1, lengths))
+                fraction[point & _covered_points(row_starts, covered_starts, covered_ends)] = 0.0
+                keep_fraction[rows] = fraction
+                if method == 'interval':
+                    partial = (fraction > 0) & (fraction < 1) & ~point
+                    in_partial = partial[owners]
+                    piece_rows.append(rows[owners[in_partial]])
+                    piece_bounds.append((piece_starts[in_partial], piece_ends[in_partial]))
+        covered_starts, covered_ends = _union(
+            np.concatenate([covered_starts, row_starts - tolerance]),
+            np.concatenate([covered_ends, row_ends + tolerance]),
+        )
+
+    removed = keep_fraction == 0
+    trimmed = (keep_fraction > 0) & (keep_fraction < 1)
+    stats['removed'] = int(removed.sum())
+    stats['trimmed'] = int(trimmed.sum())
+    if not removed.any() and not trimmed.any():
+        return df, stats
+
+    if method == 'cumulative':
+        kept = np.flatnonzero(~removed)
+        merged = df.iloc[kept].copy()
+        merged['value'] = df['value'].to_numpy(dtype=np.float64)[kept] * keep_fraction[kept]
+        return merged, stats
+
+    if method == 'discrete':
+        return df.iloc[np.flatnonzero(~removed)], stats
+
+    # interval: そのまま残すレコードと、一部だけ残すレコードの覆われていない部分を元の順序で並べる
+    whole = np.flatnonzero(~removed & ~trimmed)
+    rows = np.concatenate([whole] + piece_rows)
+    new_starts = np.concatenate([start[whole]] + [bounds[0] for bounds in piece_bounds])
+    new_ends = np.concatenate([end[whole]] + [bounds[1] for bounds in piece_bounds])
+    order = np.lexsort((new_starts, rows))
+    rows, new_starts, new_ends = rows[order], new_starts[order], new_ends[order]
+    merged = df.iloc[rows].copy()
+    tz = df['start_date'].dt.tz
+    for column, values in (('start_date', new_starts), ('end_date', new_ends)):
+        index = pd.DatetimeIndex(values.view('datetime64[ns]'))
+        if tz is not None:
+            index = index.tz_localize('UTC').tz_convert(tz)
+        merged[column] = index
+    if 'local_day' in merged.columns and 'utc_offset' in merged.columns:
+        merged['local_day'] = local_day_numbers(new_starts, merged['utc_offset'].to_numpy())
+    return merged, stats
+
+
+class SourceMerger:
+    """登録簿で統合方法が宣言されたデータタイプの、複数のソースの重複を除くクラス"""
+
+    def __init__(self, registry: HealthTypeRegistry = DEFAULT_REGISTRY,
+                 priorities: Optional[Dict[str, Sequence[str]]] = None,
+                 default_priority: Sequence[str] = DEFAULT_SOURCE_PRIORITY):
+        """
+        パラメータ:
+        - registry: データタイプの登録簿
+        - priorities: データタイプ名 → 優先度の高い順のソース名のパターン（指定のないタイプはdefault_priority）
+        - default_priority: 既定のソースの優先順位
+        """
+        self.registry = registry
+        self.priorities = {name: SourcePriority(patterns) for name, patterns in (priorities or {}).items()}
+        self.default_priority = SourcePriority(default_priority)
+        # 直近のmerge()でデータタイプごとに除いた・一部だけ残したレコード数
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def priority(self, name: str) -> SourcePriority:
+        """データタイプのソースの優先順位"""
+        return self.priorities.get(name, self.default_priority)
+
+    def merge_type(self, health_type: HealthType, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        1データタイプのレコードを統合
+
+        パラメータ:
+        - health_type: データタイプの定義
+        - df: データタイプのDataFrame
+
+        戻り値:
+        - 統合したDataFrame
+        """
+        merged, stats = merge_sources(
+            df, health_type.merge, self.priority(health_type.name), health_type.merge_tolerance
+        )
+        self.stats[health_type.name] = stats
+        return merged
+
+    def merge(self, dataframes: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        """
+        統合方法が宣言されたすべてのデータタイプを統合
+
+        パラメータ:
+        - dataframes: データタイプごとのDataFrameの辞書
+
+        戻り値:
+        - 統合したDataFrameに置き換えた新しい辞書（元の辞書とDataFrameは変更しない）
+        """
+        merged = dict(dataframes)
+        self.stats = {}
+        for health_type in self.registry.merged_types():
+            df = dataframes.get(health_type.name)
+            if df is not None and not df.empty:
+                merged[health_type.name] = self.merge_type(health_type, df)
+        return merged
+
+    def describe(self) -> str:
+        """直近のmerge()の概要（ログ表示用）"""
+        parts = [
+            f"{name}: {stats['removed']}件除外" + (f", {stats['trimmed']}件を一部のみ採用" if stats['trimmed'] else '')
+            for name, stats in self.stats.items() if stats['removed'] or stats['trimmed']
+        ]
+        return ', '.join(parts) if parts else '重複なし'
@@ -0,0 +1,380 @@
+"""
+日付範囲の日次データを一度に集計する処理
+
+DailyAggregatorは日ごとに各データタイプのレコードを取り出して集計する。ここでは各データタイプの
+レコードに一度だけ日付キー（現地の日付・夜・睡眠の時間帯）を割り当て、キーでソートした配列の
+区間ごとにまとめて集計する。結果はDailyAggregator.aggregate_date_range()と同じDailyHealthのリストになる。
+"""
+from datetime import date
+from typing import Dict, List, Tuple
+import numpy as np
+from src.aggregators.daily_aggregator import (
+    DAY_NS, HOUR_NS, NAT_NS, NO_CODE, DailyAggregator, _DayIndex, _category_codes, _to_ns,
+)
+from src.models.health_data import DailyHealth
+from src.parsers.timestamps import day_from_number, day_number, frame_local_ns
+
+# 睡眠の集計対象の時間帯（前日18:00～当日18:00）の、当日0:00からのずれ
+SLEEP_WINDOW_START_NS = -6 * HOUR_NS
+SLEEP_WINDOW_END_NS = 18 * HOUR_NS
+# 除外する睡眠セッション・日の長さ（DailyAggregator.aggregate_sleep()と同じ）
+MAX_SESSION_MINUTES = 12 * 60
+MAX_SLEEP_MINUTES = 20 * 60
+
+
+def _day_segments(index: _DayIndex, first_day: int, last_day: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    日付キーでソートした行番号（index.order）の、各日の区間
+
+    パラメータ:
+    - index: _DayIndex
+    - first_day: 最初の日付キー
+    - last_day: 最後の日付キー
+
+    戻り値:
+    - (各日の区間の開始位置の配列, 終了位置の配列)（first_dayからの日数が添字）
+    """
+    days = np.arange(first_day, last_day + 1)
+    return (
+        np.searchsorted(index.sorted_keys, days, side='left'),
+        np.searchsorted(index.sorted_keys, days, side='right'),
+    )
+
+
+def _segment_sums(values: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """
+    区間ごとの合計（空の区間は0）
+
+    np.add.reduceatは先頭から順に足すため、pandasのSeries.sum()・mean()（numpyのペアワイズ加算）と
+    最後の桁が異なりうる。日ごとに集計した結果と一致させるため、区間ごとにnp.sumで合計する。
+
+    パラメータ:
+    - values: 値の配列（区間は連続した範囲）
+    - low: 各区間の開始位置
+    - high: 各区間の終了位置
+
+    戻り値:
+    - 合計の配列
+    """
+    sums = np.zeros(len(low))
+    for i, (start, end) in enumerate(zip(low.tolist(), high.tolist())):
+        if end > start:
+            sums[i] = values[start:end].sum()
+    return sums
+
+
+def _compact_segments(keep: np.ndarray, low: np.ndarray, high: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    keepの行だけを残したときの各区間の開始・終了位置
+
+    パラメータ:
+    - keep: 残す行のブール配列
+    - low: 各区間の開始位置
+    - high: 各区間の終了位置
+
+    戻り値:
+    - (残した行の中での開始位置, 終了位置)
+    """
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    return kept_before[low], kept_before[high]
+
+
+class VectorizedDailyAggregator(DailyAggregator):
+    """
+    日付範囲の全日分をデータタイプごとにまとめて集計するDailyAggregator
+
+    各レコードの日付キーでソートした配列を日ごとの区間に分け、区間ごとに集計する。
+    同じ日の睡眠セッションが重なる日だけは、重複の除き方がセッションの順序に依存するため
+    DailyAggregator.aggregate_sleep()で集計する。
+    """
+
+    def aggregate_date_range(self, start_date: date, end_date: date) -> List[DailyHealth]:
+        """
+        日付範囲のデータを集計
+
+        パラメータ:
+        - start_date: 開始日
+        - end_date: 終了日
+
+        戻り値:
+        - DailyHealthオブジェクトのリスト（DailyAggregator.aggregate_date_range()と同じもの）
+        """
+        first_day = day_number(start_date)
+        last_day = day_number(end_date)
+        if last_day < first_day:
+            return []
+
+        registered = self.aggregate_registered(start_date, end_date)
+        sleep = self._range_sleep(first_day, last_day)
+        hrv = self._range_hrv(first_day, last_day, sleep)
+        heart_rate = self._range_heart_rate(first_day, last_day)
+        activity = self._range_activity(first_day, last_day)
+
+        daily_health_list = []
+        for offset in range(last_day - first_day + 1):
+            target_date = day_from_number(first_day + offset)
+            # ワークアウトはDailyHealthに含めないため集計しない（DailyAggregator.aggregate_daily()と同じ）
+            daily_health_list.append(DailyHealth(
+                date=target_date,
+                **sleep.get(offset, {}),
+                **hrv.get(offset, {}),
+                **self.aggregate_ecg(target_date),
+                **heart_rate.get(offset, {}),
+                **activity.get(offset, {}),
+                **self.aggregate_calendar(target_date),
+                **registered.get(target_date, {})
+            ))
+        return daily_health_list
+
+    def _has_data(self, name: str) -> bool:
+        """データタイプのレコードがあるか"""
+        return name in self.dataframes and not self.dataframes[name].empty
+
+    def _range_sleep(self, first_day: int, last_day: int) -> Dict[int, Dict]:
+        """
+        日付範囲の睡眠データを集計
+
+        各レコードを重なる日ごとの断片（その日の18:00基準の時間帯に切り詰めたもの）に分け、
+        日・開始時刻の順に並べて、ステージごとの時間を合計する。
+
+        戻り値:
+        - first_dayからの日数 → aggregate_sleep()と同じ睡眠データの辞書
+        """
+        if not self._has_data('sleep'):
+            return {}
+        df = self.dataframes['sleep']
+        local_start = self._local_start_ns('sleep')
+        start_ns = _to_ns(df['start_date'])
+        end_ns = _to_ns(df['end_date'])
+        local_end = local_start + (end_ns - start_ns)
+
+        # aggregate_sleep()の候補（前日・当日の18:00基準の日付キーのもの、24時間を超える長いもの）と、
+        # その中で対象期間と重なる日の範囲
+        candidate = local_start != NAT_NS
+        first_overlap = (local_start + 6 * HOUR_NS) // DAY_NS
+        last_overlap = (local_end + 6 * HOUR_NS - 1) // DAY_NS
+        is_long = np.zeros(len(df), dtype=bool)
+        is_long[self._long_sleep_rows()] = True
+        last_overlap = np.where(is_long, last_overlap, np.minimum(last_overlap, first_overlap + 1))
+        low = np.maximum(first_overlap, first_day)
+        high = np.minimum(last_overlap, last_day)
+        counts = np.where(candidate, np.maximum(high - low + 1, 0), 0)
+
+        # 行 × 重なる日の断片
+        rows = np.repeat(np.arange(len(df)), counts)
+        days = np.repeat(low, counts) + (np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts))
+        offsets = (days - first_day).astype(np.int64)
+        # 重なるレコードがある日は、有効なセッションがなくても各ステージ0分の結果になる
+        has_rows = np.bincount(offsets, minlength=last_day - first_day + 1) > 0
+
+        session_start = frame_local_ns(df, 'start_date')[rows]
+        session_end = frame_local_ns(df, 'end_date')[rows]
+        stage_codes, lookup = _category_codes(df, 'stage', 'unknown')
+        stages = stage_codes[rows].astype(np.int64)
+        excluded = [lookup[name] for name in ('unknown', 'unspecified') if name in lookup]
+        valid = (session_start != NAT_NS) & (session_end != NAT_NS) & ~np.isin(stages, excluded)
+
+        # 対象期間内に制限し、長すぎるセッションを除く
+        window_start = days * DAY_NS + SLEEP_WINDOW_START_NS
+        window_end = days * DAY_NS + SLEEP_WINDOW_END_NS
+        session_start = np.maximum(session_start, window_start)
+        session_end = np.minimum(session_end, window_end)
+        valid &= session_start < session_end
+        durations = (session_end - session_start).astype(np.float64) / 1e9 / 60
+        valid &= durations <= MAX_SESSION_MINUTES
+
+        order = np.lexsort((session_start[valid], offsets[valid]))
+        offsets = offsets[valid][order]
+        session_start = session_start[valid][order]
+        session_end = session_end[valid][order]
+        stages = stages[valid][order]
+        durations = durations[valid][order]
+
+        # 日ごとの時間帯は重ならず日の順に並ぶため、直前までの終了時刻の最大値で同じ日の重なりを検出できる
+        previous_end = np.maximum.accumulate(np.concatenate([[NAT_NS], session_end]))[:-1]
+        overlapping_days = np.unique(offsets[session_start < previous_end])
+
+        size = last_day - first_day + 1
+        deep, rem, light, awake = (lookup.get(name, NO_CODE) for name in ('deep', 'rem', 'light', 'awake'))
+        # bincountは配列の順に足すため、aggregate_sleep()でセッションの順に足した値と一致する
+        totals = {
+            'sleep_minutes': np.bincount(offsets, weights=durations * (stages != awake), minlength=size),
+            'deep_sleep_minutes': np.bincount(offsets, weights=durations * (stages == deep), minlength=size),
+            'rem_sleep_minutes': np.bincount(offsets, weights=durations * (stages == rem), minlength=size),
+            'light_sleep_minutes': np.bincount(offsets, weights=durations * (stages == light), minlength=size),
+        }
+        columns = {name: values.tolist() for name, values in totals.items()}
+
+        sleep: Dict[int, Dict] = {}
+        for offset in np.flatnonzero(has_rows).tolist():
+            sleep_data = {name: values[offset] for name, values in columns.items()}
+            if sleep_data['sleep_minutes'] <= MAX_SLEEP_MINUTES:
+                sleep[offset] = sleep_data
+        for offset in overlapping_days.tolist():
+            # 重なるセッションは、優先するステージ・長さで1つずつ除く必要があるため日ごとに集計する
+            sleep_data = self.aggregate_sleep(day_from_number(first_day + offset))
+            if sleep_data:
+                sleep[offset] = sleep_data
+            else:
+                sleep.pop(offset, None)
+        return sleep
+
+    def _range_hrv(self, first_day: int, last_day: int, sleep: Dict[int, Dict]) -> Dict[int, Dict]:
+        """
+        日付範囲のHRVデータを集計（前日22:00～当日10:00のサンプル）
+
+        戻り値:
+        - first_dayからの日数 → aggregate_hrv()と同じHRVデータの辞書
+        """
+        if not self._has_data('hrv'):
+            return {}
+        df = self.dataframes['hrv']
+        index = self._day_index('hrv', 'night')
+        low, high = _day_segments(index, first_day, last_day)
+        values = df['value'].to_numpy(dtype=np.float64)[index.order]
+
+        # 値が欠損したサンプルを除いた平均・最小・最大
+        present = ~np.isnan(values)
+        present_values = values[present]
+        value_low, value_high = _compact_segments(present, low, high)
+        counts = value_high - value_low
+        sums = _segment_sums(present_values, value_low, value_high)
+
+        # 拍動から求めたサンプルごとの差分の数・二乗和・NN50の数（sample_idはhrvの行のインデックス）
+        pooled = self._pooled_beat_columns(df.index.to_numpy()[index.order])
+
+        hrv: Dict[int, Dict] = {}
+        for offset in np.flatnonzero(high > low).tolist():
+            count = int(counts[offset])
+            start, end = int(value_low[offset]), int(value_high[offset])
+            day_values = present_values[start:end]
+            hrv_data = {
+                'hrv_avg': float(sums[offset] / count) if count else None,
+                'hrv_min': float(day_values.min()) if count else None,
+                'hrv_max': float(day_values.max()) if count else None,
+            }
+            sleep_data = sleep.get(offset)
+            if sleep_data and sleep_data['deep_sleep_minutes'] > 0:
+                # 夜間HRVの後半30%を深い睡眠中のHRVとみなす（aggregate_hrv()と同じ簡易版）
+                tail_count = int(count * 0.3)
+                if tail_count:
+                    hrv_data.update(_tail_statistics(day_values[count - tail_count:]))
+            if pooled is not None:
+                hrv_data.update(pooled(int(low[offset]), int(high[offset])))
+            hrv[offset] = hrv_data
+        return hrv
+
+    def _pooled_beat_columns(self, sample_ids: np.ndarray):
+        """
+        HRVサンプルの並びに対して、区間ごとのRMSSD・lnRMSSD・pNN50を求める関数を返す
+
+        パラメータ:
+        - sample_ids: 日付キーの順に並べたHRVサンプルのsample_id
+
+        戻り値:
+        - (開始位置, 終了位置) → pooled_metrics()と同じ指標の辞書（差分がなければ空）を返す関数
+          （拍動データがない場合はNone）
+        """
+        metrics = self.get_beat_metrics()
+        if metrics.empty:
+            return None
+        metric_ids = metrics.index.to_numpy()
+        position = np.searchsorted(metric_ids, sample_ids)
+        position = np.minimum(position, len(metric_ids) - 1)
+        found = metric_ids[position] == sample_ids
+        diff_count = metrics['diff_count'].to_numpy()[position[found]]
+        sum_squared = metrics['sum_squared_diff'].to_numpy(dtype=np.float64)[position[found]]
+        nn50_count = metrics['nn50_count'].to_numpy()[position[found]]
+        found_before = np.concatenate([[0], np.cumsum(found)])
+
+        def pooled(start: int, end: int) -> Dict:
+            low, high = int(found_before[start]), int(found_before[end])
+            count = diff_count[low:high].sum()
+            if count == 0:
+                return {}
+            rmssd = float(np.sqrt(sum_squared[low:high].sum() / count))
+            return {
+                'hrv_rmssd': rmssd,
+                'hrv_ln_rmssd': float(np.log(rmssd)) if rmssd > 0 else None,
+                'hrv_pnn50': float(nn50_count[low:high].sum() / count * 100),
+            }
+        return pooled
+
+    def _range_day_values(self, name: str, first_day: int, last_day: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        開始日時の現地の日付ごとの、レコードの数・値がある数・値の合計
+
+        戻り値:
+        - (レコード数の配列, 値がある数の配列, 欠損値を0とした合計の配列)（first_dayからの日数が添字）
+        """
+        index = self._day_index(name)
+        low, high = _day_segments(index, first_day, last_day)
+        values = self.dataframes[name]['value'].to_numpy(dtype=np.float64)[index.order]
+        present = ~np.isnan(values)
+        # pandasのsum()・mean()と同じく、欠損値を0にした配列で合計する
+        sums = _segment_sums(np.where(present, values, 0.0), low, high)
+        present_before = np.concatenate([[0], np.cumsum(present)])
+        return high - low, present_before[high] - present_before[low], sums
+
+    def _range_heart_rate(self, first_day: int, last_day: int) -> Dict[int, Dict]:
+        """
+        日付範囲の心拍数データを集計
+
+        戻り値:
+        - first_dayからの日数 → aggregate_heart_rate()と同じ心拍数データの辞書
+        """
+        heart_rate: Dict[int, Dict] = {}
+        for name, column in (('resting_heart_rate', 'resting_heart_rate'), ('heart_rate', 'avg_heart_rate')):
+            if not self._has_data(name):
+                continue
+            counts, present, sums = self._range_day_values(name, first_day, last_day)
+            for offset in np.flatnonzero(counts).tolist():
+                heart_rate.setdefault(offset, {})[column] = int(sums[offset] / present[offset])
+        return heart_rate
+
+    def _range_activity(self, first_day: int, last_day: int) -> Dict[int, Dict]:
+        """
+        日付範囲の活動データを集計
+
+        戻り値:
+        - first_dayからの日数 → aggregate_activity()と同じ活動データの辞書
+        """
+        activity: Dict[int, Dict] = {}
+        for name, convert in (('steps', int), ('active_energy', float)):
+            if not self._has_data(name):
+                continue
+            counts, _, sums = self._range_day_values(name, first_day, last_day)
+            for offset in np.flatnonzero(counts).tolist():
+                activity.setdefault(offset, {})[name] = convert(sums[offset])
+        return activity
+
+
+def _tail_statistics(values: np.ndarray) -> Dict:
+    """
+    深い睡眠中とみなすHRVの平均と標準偏差（pandasのmean()・std()と同じ計算）
+
+    パラメータ:
+    - values: 夜間HRVの後半の値（欠損値なし、1件以上）
+
+    戻り値:
+    - hrv_deep_sleep_avg, hrv_deep_sleep_stddevの辞書
+    """
+    count = len(values)
+    mean = values.sum() / count
+    if count > 1:
+        # 2パスで分散を求める（pandasのnanvar()と同じ）
+        stddev = np.sqrt(((mean - values) ** 2).sum() / (count - 1))
+    else:
+        stddev = np.nan
+    return {
+        'hrv_deep_sleep_avg': float(mean),
+        'hrv_deep_sleep_stddev': float(stddev),
+    }
+
+
+# 日次集計のエンジン名 → 集計器のクラス（'loop'は日ごとに集計する従来の方法）
+AGGREGATION_ENGINES = {
+    'loop': DailyAggregator,
+    'vectorized': VectorizedDailyAggregator,
+}
+DEFAULT_AGGREGATION_ENGINE = 'vectorized'
@@ -0,0 +1,108 @@
+"""
+拍動ごとのRR間隔からのHRV指標（RMSSD・lnRMSSD・pNN50）の計算
+
+計算はすべてnumpyのベクトル演算で行い、拍動をPythonのオブジェクトとして扱わない。
+"""
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+
+# pNN50の閾値（隣り合うRR間隔の差、ミリ秒）
+NN50_THRESHOLD_MS = 50.0
+# 生理的にありえる瞬間心拍数の範囲（範囲外の拍動はアーチファクトとして除外）
+MIN_VALID_BPM = 30.0
+MAX_VALID_BPM = 220.0
+# 1サンプルでRMSSDを求めるのに必要な連続差分の最小数
+MIN_DIFFERENCES = 2
+
+
+def successive_differences(beats: pd.DataFrame) -> tuple:
+    """
+    同じサンプル内で隣り合うRR間隔の差を求める
+
+    パラメータ:
+    - beats: sample_id, bpm, rr_ms列のDataFrame（サンプル内は拍動の順序）
+
+    戻り値:
+    - (差分が属するsample_idの配列, 差分（ミリ秒）の配列)
+    """
+    sample_ids = beats['sample_id'].to_numpy(dtype=np.int64)
+    bpm = beats['bpm'].to_numpy(dtype=np.float64)
+    rr_ms = beats['rr_ms'].to_numpy(dtype=np.float64)
+    rr_ms = np.where((bpm >= MIN_VALID_BPM) & (bpm <= MAX_VALID_BPM), rr_ms, np.nan)
+
+    differences = np.diff(rr_ms)
+    # サンプルの境界をまたぐ差分と、除外した拍動を含む差分は使わない
+    valid = (sample_ids[1:] == sample_ids[:-1]) & ~np.isnan(differences)
+    return sample_ids[1:][valid], differences[valid]
+
+
+def beat_metrics(beats: pd.DataFrame) -> pd.DataFrame:
+    """
+    サンプル（HRVレコード）ごとのRMSSD・lnRMSSD・pNN50を計算
+
+    夜間などの複数サンプルをまとめて評価できるよう、差分の数・二乗和・NN50の数も返す。
+
+    パラメータ:
+    - beats: sample_id, bpm, rr_ms列のDataFrame
+
+    戻り値:
+    - sample_idをインデックスとし、diff_count, sum_squared_diff, nn50_count,
+      rmssd, ln_rmssd, pnn50列を持つDataFrame（差分が足りないサンプルは含まない）
+    """
+    if beats is None or beats.empty:
+        return pd.DataFrame()
+    owners, differences = successive_differences(beats)
+    if len(owners) == 0:
+        return pd.DataFrame()
+
+    size = int(owners.max()) + 1
+    diff_count = np.bincount(owners, minlength=size)
+    sum_squared = np.bincount(owners, weights=differences * differences, minlength=size)
+    nn50_count = np.bincount(owners, weights=np.abs(differences) > NN50_THRESHOLD_MS, minlength=size)
+
+    sample_ids = np.flatnonzero(diff_count >= MIN_DIFFERENCES)
+    metrics = pd.DataFrame({
+        'diff_count': diff_count[sample_ids],
+        'sum_squared_diff': sum_squared[sample_ids],
+        'nn50_count': nn50_count[sample_ids].astype(np.int64),
+    }, index=pd.Index(sample_ids, name='sample_id'))
+    _add_rates(metrics)
+    return metrics
+
+
+def _add_rates(metrics: pd.DataFrame):
+    """差分の数・二乗和・NN50の数からRMSSD・lnRMSSD・pNN50の列を追加"""
+    count = metrics['diff_count'].to_numpy(dtype=np.float64)
+    rmssd = np.sqrt(metrics['sum_squared_diff'].to_numpy() / count)
+    metrics['rmssd'] = rmssd
+    with np.errstate(divide='ignore'):
+        metrics['ln_rmssd'] = np.where(rmssd > 0, np.log(rmssd), np.nan)
+    metrics['pnn50'] = metrics['nn50_count'].to_numpy() / count * 100
+
+
+def pooled_metrics(metrics: pd.DataFrame, sample_ids) -> Optional[Dict[str, float]]:
+    """
+    複数サンプルの差分をまとめたRMSSD・lnRMSSD・pNN50を計算（1晩分の評価など）
+
+    サンプルごとのRMSSDの平均ではなく、すべての差分の二乗平均の平方根を求める。
+
+    パラメータ:
+    - metrics: beat_metrics()の結果
+    - sample_ids: まとめるサンプルのsample_id
+
+    戻り値:
+    - rmssd, ln_rmssd, pnn50の辞書（差分がない場合はNone）
+    """
+    if metrics.empty:
+        return None
+    rows = metrics.reindex(np.asarray(sample_ids)).dropna(subset=['diff_count'])
+    count = rows['diff_count'].sum()
+    if count == 0:
+        return None
+    rmssd = float(np.sqrt(rows['sum_squared_diff'].sum() / count))
+    return {
+        'rmssd': rmssd,
+        'ln_rmssd': float(np.log(rmssd)) if rmssd > 0 else None,
+        'pnn50': float(rows['nn50_count'].sum() / count * 100),
+    }
@@ -38,15 +38,43 @@ class RecoveryStressCalculator:
         hrv_values = [d.hrv_deep_sleep_avg for d in recent_data if d.hrv_deep_sleep_avg is not None]
         hr_values = [d.resting_heart_rate for d in recent_data if d.resting_heart_rate is not None]
         energy_values = [d.active_energy for d in recent_data if d.active_energy is not None]
+        ln_rmssd_values = [d.hrv_ln_rmssd for d in recent_data if d.hrv_ln_rmssd is not None]
+        ecg_ln_rmssd_values = [d.ecg_ln_rmssd for d in recent_data if d.ecg_ln_rmssd is not None]
         
         self._baseline = {
             'hrv_baseline': np.mean(hrv_values) if hrv_values else None,
+            'ln_rmssd_baseline': np.mean(ln_rmssd_values) if ln_rmssd_values else None,
+            'ecg_ln_rmssd_baseline': np.mean(ecg_ln_rmssd_values) if ecg_ln_rmssd_values else None,
             'resting_hr_baseline': np.mean(hr_values) if hr_values else None,
             'active_energy_baseline': np.mean(energy_values) if energy_values else None,
         }
         
         return self._baseline
     
+    def _rmssd_ratio(self, daily_health: DailyHealth, baseline: dict) -> Optional[float]:
+        """
+        RR間隔から求めたRMSSDのベースラインに対する比
+        
+        lnRMSSDの差を指数に戻したもの（ベースラインはRMSSDの幾何平均）で、
+        SDNNの要約値よりも副交感神経の活動を直接反映する。
+        夜間のHRVレコードの拍動を優先し、なければその日の心電図の記録を使う
+        （計測条件が異なるため、それぞれ自身のベースラインと比べる）。
+        
+        パラメータ:
+        - daily_health: DailyHealthオブジェクト
+        - baseline: calculate_baseline()の結果
+        
+        戻り値:
+        - 比（RR間隔のデータがない場合はNone）
+        """
+        for value, baseline_key in (
+            (daily_health.hrv_ln_rmssd, 'ln_rmssd_baseline'),
+            (daily_health.ecg_ln_rmssd, 'ecg_ln_rmssd_baseline'),
+        ):
+            if value is not None and baseline.get(baseline_key) is not None:
+                return float(np.exp(value - baseline[baseline_key]))
+        return None
+    
     def calculate_recovery_score(self, daily_health: DailyHealth) -> Optional[int]:
         """
         リカバリースコアを計算（0-100）
@@ -60,12 +88,17 @@ class RecoveryStressCalculator:
         baseline = self.calculate_baseline()
         
         # 必要なデータがない場合はNoneを返す
-        if not daily_health.hrv_deep_sleep_avg and not daily_health.hrv_avg:
+        if (not daily_health.hrv_deep_sleep_avg and not daily_health.hrv_avg
+                and daily_health.ecg_ln_rmssd is None):
             return None
         
         # HRVスコア（0-40点）
         hrv_score = 0
-        if daily_health.hrv_deep_sleep_avg and baseline.get('hrv_baseline'):
+        rmssd_ratio = self._rmssd_ratio(daily_health, baseline)
+        if rmssd_ratio is not None:
+            # RR間隔から求めたRMSSDがある場合はそれを優先
+            hrv_score = min(40, max(0, (rmssd_ratio - 0.5) * 80))
+        elif daily_health.hrv_deep_sleep_avg and baseline.get('hrv_baseline'):
             hrv_ratio = daily_health.hrv_deep_sleep_avg / baseline['hrv_baseline']
             # ベースラインの80%以上で満点、50%以下で0点
             hrv_score = min(40, max(0, (hrv_ratio - 0.5) * 80))
@@ -118,13 +151,17 @@ class RecoveryStressCalculator:
         baseline = self.calculate_baseline()
         
         # 必要なデータがない場合はNoneを返す
-        if not daily_health.hrv_avg and not daily_health.resting_heart_rate:
+        if (not daily_health.hrv_avg and not daily_health.resting_heart_rate
+                and daily_health.ecg_ln_rmssd is None):
             return None
         
         # HRV低下スコア（0-40点、高いほどストレス高）
-        hrv_stress = 0
-        if daily_health.hrv_avg and baseline.get('hrv_baseline'):
+        # RR間隔から求めたRMSSDがある場合はそれを優先し、なければ夜間平均HRV（SDNN）を使う
+        hrv_ratio = self._rmssd_ratio(daily_health, baseline)
+        if hrv_ratio is None and daily_health.hrv_avg and baseline.get('hrv_baseline'):
             hrv_ratio = daily_health.hrv_avg / baseline['hrv_baseline']
+        hrv_stress = 0
+        if hrv_ratio is not None:
             # ベースラインより低いほどストレス高
             hrv_stress = max(0, (1.0 - hrv_ratio) * 40)
         
@@ -151,9 +188,8 @@ class RecoveryStressCalculator:
         # オーバートレーニングスコア（0-10点）
         overtraining_stress = 0
         if (daily_health.active_energy and baseline.get('active_energy_baseline') and
-            daily_health.hrv_avg and baseline.get('hrv_baseline')):
+            hrv_ratio is not None):
             energy_ratio = daily_health.active_energy / baseline['active_energy_baseline']
-            hrv_ratio = daily_health.hrv_avg / baseline['hrv_baseline']
             # 活動量が多いのにHRVが低い = オーバートレーニング
             if energy_ratio > 1.2 and hrv_ratio < 0.9:
                 overtraining_stress = 10
@@ -4,7 +4,7 @@
 import sqlite3
 from pathlib import Path
 from datetime import date
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import pandas as pd
 from src.models.health_data import DailyHealth
 
@@ -12,6 +12,26 @@ from src.models.health_data import DailyHealth
 class Database:
     """SQLiteデータベースの操作クラス"""
     
+    # 既存のデータベースに後から追加したdaily_healthのカラム
+    ADDED_COLUMNS = {
+        'sleep_score': 'INTEGER',
+        'spo2_avg': 'REAL',
+        'respiratory_rate_avg': 'REAL',
+        'wrist_temperature_avg': 'REAL',
+        'vo2max': 'REAL',
+        'hrv_rmssd': 'REAL',
+        'hrv_ln_rmssd': 'REAL',
+        'hrv_pnn50': 'REAL',
+        'ecg_rmssd': 'REAL',
+        'ecg_ln_rmssd': 'REAL',
+        'ecg_pnn50': 'REAL',
+        'meeting_count': 'INTEGER',
+        'meeting_minutes': 'INTEGER',
+        'back_to_back_meetings': 'INTEGER',
+        'late_meetings': 'INTEGER',
+        'longest_free_block_minutes': 'INTEGER',
+    }
+    
     def __init__(self, db_path: str = 'data/db/risely.db'):
         """
         データベースを初期化
@@ -43,6 +63,12 @@ class Database:
                 hrv_deep_sleep_stddev REAL,
                 hrv_min REAL,
                 hrv_max REAL,
+                hrv_rmssd REAL,
+                hrv_ln_rmssd REAL,
+                hrv_pnn50 REAL,
+                ecg_rmssd REAL,
+                ecg_ln_rmssd REAL,
+                ecg_pnn50 REAL,
                 hrv_baseline REAL,
                 -- 心拍数データ
                 resting_heart_rate INTEGER,
@@ -50,6 +76,17 @@ class Database:
                 -- 活動データ
                 steps INTEGER,
                 active_energy REAL,
+                -- 夜間のバイタル・心肺機能
+                spo2_avg REAL,
+                respiratory_rate_avg REAL,
+                wrist_temperature_avg REAL,
+                vo2max REAL,
+                -- カレンダーの予定
+                meeting_count INTEGER,
+                meeting_minutes INTEGER,
+                back_to_back_meetings INTEGER,
+                late_meetings INTEGER,
+                longest_free_block_minutes INTEGER,
                 -- 計算されたスコア
                 recovery_score INTEGER,
                 stress_score INTEGER,
@@ -59,11 +96,23 @@ class Database:
             )
         ''')
         
-        # sleep_scoreカラムが存在しない場合は追加
+        # 後から追加したカラムが存在しない場合は追加
         cursor.execute("PRAGMA table_info(daily_health)")
         columns = [column[1] for column in cursor.fetchall()]
-        if 'sleep_score' not in columns:
-            cursor.execute('ALTER TABLE daily_health ADD COLUMN sleep_score INTEGER')
+        for column, column_type in self.ADDED_COLUMNS.items():
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE daily_health ADD COLUMN {column} {column_type}')
+        
+        # インクリメンタルインポート用の高水位標（データタイプ・ソースごとの最新開始日時）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS import_watermarks (
+                data_type TEXT NOT NULL,
+                source TEXT NOT NULL,
+                last_start_date TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (data_type, source)
+            )
+        ''')
         
         conn.commit()
         conn.close()
@@ -78,34 +127,53 @@ class Database:
         conn = sqlite3.connect(str(self.db_path))
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO daily_health (
-                date, sleep_minutes, deep_sleep_minutes, rem_sleep_minutes, light_sleep_minutes,
-                hrv_avg, hrv_deep_sleep_avg, hrv_deep_sleep_stddev, hrv_min, hrv_max, hrv_baseline,
-                resting_heart_rate, avg_heart_rate,
-                steps, active_energy,
-                recovery_score, stress_score, sleep_score
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            daily_health.date,
-            daily_health.sleep_minutes,
-            daily_health.deep_sleep_minutes,
-            daily_health.rem_sleep_minutes,
-            daily_health.light_sleep_minutes,
-            daily_health.hrv_avg,
-            daily_health.hrv_deep_sleep_avg,
-            daily_health.hrv_deep_sleep_stddev,
-            daily_health.hrv_min,
-            daily_health.hrv_max,
-            daily_health.hrv_baseline,
-            daily_health.resting_heart_rate,
-            daily_health.avg_heart_rate,
-            daily_health.steps,
-            daily_health.active_energy,
-            daily_health.recovery_score,
-            daily_health.stress_score,
-            daily_health.sleep_score,
-        ))
+        # DailyHealthの各フィールドをそのままカラムとして保存する
+        columns = DailyHealth.field_names()
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO daily_health ({', '.join(columns)})
+            VALUES ({', '.join('?' * len(columns))})
+        ''', tuple(getattr(daily_health, column) for column in columns))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_import_watermarks(self) -> Dict[Tuple[str, str], pd.Timestamp]:
+        """
+        取り込み済みデータの高水位標を取得
+        
+        戻り値:
+        - (データタイプ, ソース名)ごとの最新開始日時
+        """
+        conn = sqlite3.connect(str(self.db_path))
+        cursor = conn.cursor()
+        cursor.execute('SELECT data_type, source, last_start_date FROM import_watermarks')
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return {
+            (data_type, source): pd.Timestamp(last_start_date)
+            for data_type, source, last_start_date in rows
+        }
+    
+    def update_import_watermarks(self, watermarks: Dict[Tuple[str, str], pd.Timestamp]):
+        """
+        高水位標を更新（既存の値より新しい場合のみ書き換える）
+        
+        パラメータ:
+        - watermarks: (データタイプ, ソース名)ごとの最新開始日時
+        """
+        current = self.get_import_watermarks()
+        
+        conn = sqlite3.connect(str(self.db_path))
+        cursor = conn.cursor()
+        for (data_type, source), start in watermarks.items():
+            existing = current.get((data_type, source))
+            if existing is not None and existing >= start:
+                continue
+            cursor.execute('''
+                INSERT OR REPLACE INTO import_watermarks (data_type, source, last_start_date, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (data_type, source, start.isoformat()))
         
         conn.commit()
         conn.close()
@@ -138,23 +206,7 @@ class Database:
         data = dict(zip(columns, row))
         daily_health = DailyHealth(
             date=data['date'],
-            sleep_minutes=data.get('sleep_minutes'),
-            deep_sleep_minutes=data.get('deep_sleep_minutes'),
-            rem_sleep_minutes=data.get('rem_sleep_minutes'),
-            light_sleep_minutes=data.get('light_sleep_minutes'),
-            hrv_avg=data.get('hrv_avg'),
-            hrv_deep_sleep_avg=data.get('hrv_deep_sleep_avg'),
-            hrv_deep_sleep_stddev=data.get('hrv_deep_sleep_stddev'),
-            hrv_min=data.get('hrv_min'),
-            hrv_max=data.get('hrv_max'),
-            hrv_baseline=data.get('hrv_baseline'),
-            resting_heart_rate=data.get('resting_heart_rate'),
-            avg_heart_rate=data.get('avg_heart_rate'),
-            steps=data.get('steps'),
-            active_energy=data.get('active_energy'),
-            recovery_score=data.get('recovery_score'),
-            stress_score=data.get('stress_score'),
-            sleep_score=data.get('sleep_score'),
+            **{name: data.get(name) for name in DailyHealth.field_names() if name != 'date'},
         )
         
         return daily_health
@@ -193,23 +245,7 @@ class Database:
         for _, row in df.iterrows():
             daily_health = DailyHealth(
                 date=row['date'],
-                sleep_minutes=row.get('sleep_minutes'),
-                deep_sleep_minutes=row.get('deep_sleep_minutes'),
-                rem_sleep_minutes=row.get('rem_sleep_minutes'),
-                light_sleep_minutes=row.get('light_sleep_minutes'),
-                hrv_avg=row.get('hrv_avg'),
-                hrv_deep_sleep_avg=row.get('hrv_deep_sleep_avg'),
-                hrv_deep_sleep_stddev=row.get('hrv_deep_sleep_stddev'),
-                hrv_min=row.get('hrv_min'),
-                hrv_max=row.get('hrv_max'),
-                hrv_baseline=row.get('hrv_baseline'),
-                resting_heart_rate=row.get('resting_heart_rate'),
-                avg_heart_rate=row.get('avg_heart_rate'),
-                steps=row.get('steps'),
-                active_energy=row.get('active_energy'),
-                recovery_score=row.get('recovery_score'),
-                stress_score=row.get('stress_score'),
-                sleep_score=row.get('sleep_score'),
+                **{name: row.get(name) for name in DailyHealth.field_names() if name != 'date'},
             )
             daily_health_list.append(daily_health)
         
@@ -6,6 +6,7 @@ import numpy as np
 from typing import Dict, List, Optional
 from datetime import date, timedelta
 from src.database.db_setup import Database
+from src.parsers.timestamps import day_numbers_to_dates, frame_local_days
 
 
 class ComprehensiveInsights:
@@ -27,19 +28,15 @@ class ComprehensiveInsights:
         
         xml_path = Path('apple_health_export/export.xml')
         parser = AppleHealthParser(str(xml_path))
-        parser.parse()
-        
-        workouts = parser.extract_workouts()
-        df_workouts = pd.DataFrame(workouts)
+        # ワークアウト以外のレコードはパース時に読み飛ばし、2回目以降はキャッシュから読み込む
+        # （期間で絞り込むとレポートの期間ごとに別のキャッシュになるため、期間はここで絞り込む）
+        df_workouts = parser.load_dataframes(data_types=['workouts'])['workouts']
         
         if df_workouts.empty:
             return pd.DataFrame()
         
-        if 'start_date' in df_workouts.columns:
-            df_workouts['start_date'] = pd.to_datetime(df_workouts['start_date'])
-            df_workouts['date'] = df_workouts['start_date'].dt.date
-            df_workouts['duration'] = pd.to_numeric(df_workouts['duration'], errors='coerce')
-            df_workouts['total_energy_burned'] = pd.to_numeric(df_workouts['total_energy_burned'], errors='coerce')
+        # 日付・数値はパース時に変換済み（日付は各ワークアウトを記録した現地の日付）
+        df_workouts['date'] = day_numbers_to_dates(frame_local_days(df_workouts))
         
         df_workouts = df_workouts[
             (df_workouts['date'] >= start_date) & 
@@ -84,6 +81,10 @@ class ComprehensiveInsights:
                 'resting_heart_rate': dh.resting_heart_rate,
                 'steps': dh.steps,
                 'active_energy': dh.active_energy,
+                'meeting_minutes': dh.meeting_minutes,
+                'back_to_back_meetings': dh.back_to_back_meetings,
+                'late_meetings': dh.late_meetings,
+                'longest_free_block_minutes': dh.longest_free_block_minutes,
                 'recovery_score': dh.recovery_score,
                 'stress_score': dh.stress_score,
                 'sleep_score': dh.sleep_score,
@@ -638,6 +639,41 @@ class ComprehensiveInsights:
                         long_run_pct = (long_run_count / total * 100) if total > 0 else 0
                         report += f"  {weekday}: 高負荷運動日 {long_run_count}日 / 通常日 {normal_count}日 ({long_run_pct:.0f}%が高負荷運動日)\n"
         
+        # 8.11 会議の負荷と当日・翌日のHRV・睡眠の関係（カレンダーを取り込んだ場合のみ）
+        if 'meeting_minutes' in df.columns and df['meeting_minutes'].notna().sum() > 5:
+            valid_data = df[df['meeting_minutes'].notna()].copy()
+            # 会議時間でグループ化
+            valid_data['meeting_category'] = pd.cut(
+                valid_data['meeting_minutes'] / 60,
+                bins=[-0.1, 0, 2, 4, float('inf')],
+                labels=['会議なし', '2h以下', '2-4h', '4h超']
+            )
+            meeting_load = valid_data.groupby('meeting_category', observed=True).agg({
+                'hrv_avg': 'mean',
+                'next_day_hrv': 'mean',
+                'next_day_sleep': 'mean',
+            })
+            
+            report += "\n【8.11 会議の負荷と当日・翌日のHRV・睡眠の関係】\n"
+            for category in meeting_load.index:
+                stats = meeting_load.loc[category]
+                report += f"  会議が{category}の日:\n"
+                if pd.notna(stats['hrv_avg']):
+                    report += f"    当日の平均HRV: {stats['hrv_avg']:.1f}ms\n"
+                if pd.notna(stats['next_day_hrv']):
+                    report += f"    翌日の平均HRV: {stats['next_day_hrv']:.1f}ms\n"
+                if pd.notna(stats['next_day_sleep']):
+                    report += f"    その夜の平均睡眠時間: {stats['next_day_sleep'] / 60:.1f}時間\n"
+            
+            # 夜の会議・連続した会議がある日とない日の翌日のHRV
+            for column, label in (('late_meetings', '夜の会議'), ('back_to_back_meetings', '連続した会議')):
+                pair = valid_data[[column, 'next_day_hrv']].dropna()
+                with_meetings = pair[pair[column] > 0]['next_day_hrv']
+                without_meetings = pair[pair[column] == 0]['next_day_hrv']
+                if len(with_meetings) > 0 and len(without_meetings) > 0:
+                    diff = with_meetings.mean() - without_meetings.mean()
+                    report += f"  {label}がある日（{len(with_meetings)}日）の翌日のHRVは、ない日より平均{abs(diff):.1f}ms{'高い' if diff > 0 else '低い'}\n"
+        
         # 9. 気づきにくい関連性
         report += "\n" + "=" * 80 + "\n"
         report += "【9. 気づきにくい関連性と示唆】\n"
@@ -6,6 +6,7 @@ import numpy as np
 from typing import Dict, List, Optional
 from datetime import date, timedelta
 from src.database.db_setup import Database
+from src.parsers.timestamps import day_numbers_to_dates, frame_local_days
 
 
 class DailyInsights:
@@ -36,21 +37,15 @@ class DailyInsights:
         
         xml_path = Path('apple_health_export/export.xml')
         parser = AppleHealthParser(str(xml_path))
-        parser.parse()
-        
-        workouts = parser.extract_workouts()
-        df_workouts = pd.DataFrame(workouts)
+        # ワークアウト以外のレコードはパース時に読み飛ばし、2回目以降はキャッシュから読み込む
+        # （期間で絞り込むとレポートの期間ごとに別のキャッシュになるため、期間はここで絞り込む）
+        df_workouts = parser.load_dataframes(data_types=['workouts'])['workouts']
         
         if df_workouts.empty:
             return pd.DataFrame()
         
-        # 日付をパース
-        if 'start_date' in df_workouts.columns:
-            df_workouts['start_date'] = pd.to_datetime(df_workouts['start_date'])
-            df_workouts['date'] = df_workouts['start_date'].dt.date
-            df_workouts['duration'] = pd.to_numeric(df_workouts['duration'], errors='coerce')
-            df_workouts['total_distance'] = pd.to_numeric(df_workouts['total_distance'], errors='coerce')
-            df_workouts['total_energy_burned'] = pd.to_numeric(df_workouts['total_energy_burned'], errors='coerce')
+        # 日付・数値はパース時に変換済み（日付は各ワークアウトを記録した現地の日付）
+        df_workouts['date'] = day_numbers_to_dates(frame_local_days(df_workouts))
         
         # 期間でフィルタ
         df_workouts = df_workouts[
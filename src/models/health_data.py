@@ -1,9 +1,12 @@
 """
 健康データのモデル定義
 """
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import date
-from typing import Optional
+from typing import List, Optional
+
+# 集計後に計算される列（計測値ではないもの）
+COMPUTED_FIELDS = ('hrv_baseline', 'recovery_score', 'stress_score', 'sleep_score')
 
 
 @dataclass
@@ -21,6 +24,14 @@ class DailyHealth:
     hrv_deep_sleep_stddev: Optional[float] = None
     hrv_min: Optional[float] = None
     hrv_max: Optional[float] = None
+    # 拍動ごとのRR間隔から求めた夜間のHRV（RMSSDはミリ秒、pNN50は%）
+    hrv_rmssd: Optional[float] = None
+    hrv_ln_rmssd: Optional[float] = None
+    hrv_pnn50: Optional[float] = None
+    # 心電図の記録のRR間隔から求めたHRV（その日の記録の平均）
+    ecg_rmssd: Optional[float] = None
+    ecg_ln_rmssd: Optional[float] = None
+    ecg_pnn50: Optional[float] = None
     hrv_baseline: Optional[float] = None
     # 心拍数データ
     resting_heart_rate: Optional[int] = None
@@ -28,11 +39,35 @@ class DailyHealth:
     # 活動データ
     steps: Optional[int] = None
     active_energy: Optional[float] = None
+    # 夜間のバイタル・心肺機能（データタイプの登録簿で日次集計の方法を宣言したもの）
+    spo2_avg: Optional[float] = None
+    respiratory_rate_avg: Optional[float] = None
+    wrist_temperature_avg: Optional[float] = None
+    vo2max: Optional[float] = None
+    # カレンダーの予定（会議の件数・合計時間（分）・連続した会議・夜の会議・勤務時間内の最長の空き時間（分））
+    meeting_count: Optional[int] = None
+    meeting_minutes: Optional[int] = None
+    back_to_back_meetings: Optional[int] = None
+    late_meetings: Optional[int] = None
+    longest_free_block_minutes: Optional[int] = None
     # 計算されたスコア
     recovery_score: Optional[int] = None
     stress_score: Optional[int] = None
     sleep_score: Optional[int] = None
 
+    @classmethod
+    def field_names(cls) -> List[str]:
+        """すべての列名（daily_healthテーブルの列と同じ順序）"""
+        return [field.name for field in fields(cls)]
+
+    @classmethod
+    def measurement_field_names(cls) -> List[str]:
+        """日次集計で求める計測値の列名（dateとスコアなどの計算値を除く）"""
+        return [
+            name for name in cls.field_names()
+            if name != 'date' and name not in COMPUTED_FIELDS
+        ]
+
     @property
     def deep_sleep_ratio(self) -> Optional[float]:
         """深い睡眠の割合"""
@@ -1,25 +1,48 @@
 """
 Apple Health XMLデータのパーサー
 """
+import sys
+import time
 import xml.etree.ElementTree as ET
-from datetime import datetime
-from typing import Dict, List, Optional
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 import pandas as pd
 from dateutil import parser as date_parser
+from src.parsers.checkpoint import CHECKPOINT_INTERVAL_BYTES, ParseCheckpoint
+from src.parsers.columnar import RecordColumns
+from src.parsers.export_archive import HealthExport
+from src.parsers.export_index import ExportIndex, ExportIndexBuilder
+from src.parsers.hrv_beats import HRV_BEATS_TABLE
+from src.parsers.parallel import find_chunk_boundaries, parse_byte_range, parse_parallel
+from src.parsers.parse_cache import ParsedDataCache
+from src.parsers.record_collector import RecordCollector
+from src.parsers.record_filter import RecordFilter
+from src.parsers.type_registry import DEFAULT_REGISTRY, HealthTypeRegistry
+from src.parsers.workout_tables import WORKOUT_TABLES
+from src.parsers.xml_stream import resolve_backend, stream_into
+
+try:
+    import resource
+except ImportError:  # Windowsなど
+    resource = None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """プロセスのピークメモリ使用量（MB）を取得"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト単位
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
 
 
 class AppleHealthParser:
     """Apple Health XMLファイルをパースするクラス"""
     
-    # 必要なデータタイプ
-    DATA_TYPES = {
-        'sleep': 'HKCategoryTypeIdentifierSleepAnalysis',
-        'hrv': 'HKQuantityTypeIdentifierHeartRateVariabilitySDNN',
-        'heart_rate': 'HKQuantityTypeIdentifierHeartRate',
-        'resting_heart_rate': 'HKQuantityTypeIdentifierRestingHeartRate',
-        'steps': 'HKQuantityTypeIdentifierStepCount',
-        'active_energy': 'HKQuantityTypeIdentifierActiveEnergyBurned',
-    }
+    # 必要なデータタイプ（データタイプ名 → HealthKit識別子、既定の登録簿から作る）
+    DATA_TYPES = DEFAULT_REGISTRY.data_types()
     
     # ワークアウトタイプのマッピング
     WORKOUT_TYPES = {
@@ -43,102 +66,398 @@ class AppleHealthParser:
         'HKCategoryValueSleepAnalysisAwake': 'awake',
     }
     
-    def __init__(self, xml_path: str):
+    # このサイズを超えるファイルはデフォルトでストリーミングパースする
+    STREAMING_THRESHOLD_BYTES = 512 * 1024 * 1024
+    
+    def __init__(self, xml_path: str, registry: Optional[HealthTypeRegistry] = None):
         """
         パーサーを初期化
         
         パラメータ:
-        - xml_path: Apple Health XMLファイルのパス
+        - xml_path: Apple Health XMLファイル、export.zip、またはエクスポートのディレクトリのパス
+        - registry: 収集するデータタイプの登録簿（Noneの場合は既定の登録簿）
         """
         self.xml_path = xml_path
+        self.registry = registry or DEFAULT_REGISTRY
+        if registry is not None:
+            self.DATA_TYPES = registry.data_types()
+        # export.zipの場合は展開せずにメンバーを直接読み込む
+        self.export = HealthExport(xml_path)
         self.tree = None
         self.root = None
+        # ストリーミングパース時に収集したレコード
+        self.collector: Optional[RecordCollector] = None
+        # パース時に適用する期間・データタイプ・ソースの絞り込み条件
+        self.record_filter = RecordFilter()
+        # ストリーミング・並列パースで使うXMLバックエンド
+        self.backend = resolve_backend()
+        # 直近のパースで実際に読み込んだバイト数（索引で範囲を絞った場合はファイルサイズより小さい）
+        self._bytes_read: Optional[int] = None
+        # 直近のパースの処理件数・スループット・ピークメモリ
+        self.stats: Dict = {}
+        
+    def parse(self, streaming: Optional[bool] = None, workers: Optional[int] = None,
+              since: Optional[date] = None, until: Optional[date] = None,
+              data_types: Optional[Iterable[str]] = None,
+              sources: Optional[Iterable[str]] = None,
+              exclude_sources: Optional[Iterable[str]] = None,
+              backend: Optional[str] = None, use_index: bool = True,
+              checkpoint_dir: Optional[str] = None,
+              stream_since: Optional[Dict[Tuple[str, str], date]] = None):
+        """
+        XMLファイルをパース
+        
+        期間・データタイプ・ソースを指定すると、条件に合わないレコードは
+        値や日時を変換する前に読み飛ばす。
+        export.xmlのバイト位置の索引がある場合、期間・データタイプの条件に合う範囲だけを読み込む。
+        
+        パラメータ:
+        - streaming: Trueでツリーを保持しないストリーミングパース、
+          Noneの場合はファイルサイズがSTREAMING_THRESHOLD_BYTESを超えるか絞り込み条件があると自動的に選択
+        - workers: 2以上の場合、ファイルをバイト範囲に分割してこのプロセス数で並列パース
+          （ストリーミングパースとして扱う。zip内のXMLはシークできないため逐次パースする）
+        - since: この日付より前に始まるレコードを読み飛ばす（インクリメンタルインポート用）
+        - until: この日付より後に始まるレコードを読み飛ばす
+        - data_types: 読み込むデータタイプ名（DATA_TYPESのキーと'workouts'。Noneの場合はすべて）
+        - sources: 読み込むソース名（Noneの場合はすべて）
+        - exclude_sources: 読み飛ばすソース名
+        - backend: ストリーミング・並列パースで使うXMLバックエンド（'expat'、'lxml'、'etree'。
+          Noneまたは'auto'の場合は利用できる最初のもの。ツリーモードは常に標準ライブラリ）
+        - use_index: Trueの場合、ストリーミングパースで索引を使い、索引がなければファイル全体を
+          読み込むついでに作成して保存する（zip内のXMLはシークできないため使わない）
+        - checkpoint_dir: 指定した場合、ストリーミングパースでファイル全体を読む際に
+          CHECKPOINT_INTERVAL_BYTESごとの区間のパース結果をこのディレクトリに書き出し、
+          中断後に同じ条件でパースし直すと続きから再開する
+          （チェックポイントはパースが完了しても残すため、不要になったらclear_checkpoint()で削除する。
+          zip内のXMLはシークできないため使わない）
+        - stream_since: (データタイプ名, ソース名) → その日付より前に始まるレコードを読み飛ばす
+          （ソースごとの高水位標。指定のないデータタイプ・ソースはsince。データタイプ名はDATA_TYPESのキーと'workouts'）
+        """
+        self.configure(since, until, data_types, sources, exclude_sources, backend, stream_since)
+        parallel = workers is not None and workers > 1
+        if parallel and self.export.is_zip:
+            print("  zip内のXMLは並列パースできないため、ストリーミングパースします")
+            parallel = False
+            streaming = True
+        if streaming is None:
+            # 絞り込み条件がある場合、ツリーを作ると読み飛ばす要素も構築されるため逐次パースする
+            streaming = (
+                parallel or not self.record_filter.is_empty
+                or self.export.xml_size() > self.STREAMING_THRESHOLD_BYTES
+            )
         
-    def parse(self):
-        """XMLファイルをパース"""
         print(f"XMLファイルを読み込み中: {self.xml_path}")
-        self.tree = ET.parse(self.xml_path)
-        self.root = self.tree.getroot()
+        started = time.perf_counter()
+        self._bytes_read = None
+        if parallel:
+            self.tree = None
+            self.root = None
+            self.collector = parse_parallel(
+                self.export.xml_member, self.collector_args(), workers, backend=self.backend
+            )
+        elif streaming:
+            self._parse_streaming(
+                use_index and not self.export.is_zip,
+                checkpoint_dir if not self.export.is_zip else None,
+            )
+        else:
+            self.collector = None
+            with self.export.open_xml() as f:
+                self.tree = ET.parse(f)
+            self.root = self.tree.getroot()
+        self._report_stats(time.perf_counter() - started, streaming, workers if parallel else None)
         print("XMLファイルの読み込み完了")
+    
+    def configure(self, since: Optional[date] = None, until: Optional[date] = None,
+                  data_types: Optional[Iterable[str]] = None,
+                  sources: Optional[Iterable[str]] = None,
+                  exclude_sources: Optional[Iterable[str]] = None,
+                  backend: Optional[str] = None,
+                  stream_since: Optional[Dict[Tuple[str, str], date]] = None):
+        """
+        パース時の絞り込み条件とXMLバックエンドを設定（parse()を使わずにパースする場合にも使う）
         
-    def extract_records(self, data_type: str) -> List[Dict]:
+        パラメータ:
+        - since, until, data_types, sources, exclude_sources, backend, stream_since: parse()と同じ
         """
-        指定されたデータタイプのレコードを抽出
+        self.backend = resolve_backend(backend)
+        if data_types is not None:
+            unknown = set(data_types) - set(self.DATA_TYPES) - {RecordFilter.WORKOUTS}
+            if unknown:
+                raise ValueError(f"不明なデータタイプ: {', '.join(sorted(unknown))}")
+        self.record_filter = RecordFilter(since, until, data_types, sources, exclude_sources, stream_since)
+    
+    def collector_args(self) -> tuple:
+        """レコードコレクターの初期化引数（ワーカープロセスにも渡せる形）"""
+        return (self.registry, self.SLEEP_STAGES, self.WORKOUT_TYPES, self.record_filter)
+    
+    def _new_collector(self) -> RecordCollector:
+        """データタイプ定義からレコードコレクターを作成"""
+        return RecordCollector(*self.collector_args())
+    
+    def _get_collector(self) -> RecordCollector:
+        """
+        収集済みのレコードを取得
+        
+        ツリーモードでは初回呼び出し時にツリーを1回だけ走査し、
+        すべてのRecord/Workoutをtype属性でデータタイプごとに振り分ける。
+        """
+        if self.collector is not None:
+            return self.collector
+        if self.root is None:
+            raise ValueError("XMLファイルを先にパースしてください")
+        
+        collector = self._new_collector()
+        
+        def walk(elem):
+            collector.start(elem.tag, elem.attrib)
+            for child in elem:
+                walk(child)
+            collector.end(elem.tag)
+        
+        walk(self.root)
+        self.collector = collector
+        return collector
+    
+    def _parse_streaming(self, use_index: bool = False, checkpoint_dir: Optional[str] = None):
+        """
+        逐次パースし、処理済みの要素はすぐに解放する
+        
+        メモリ使用量はファイルサイズではなく抽出したレコード数にのみ比例する。
         
         パラメータ:
-        - data_type: データタイプ（'sleep', 'hrv', 'heart_rate'など）
+        - use_index: 索引で読み込む範囲を絞り、索引がなければ作成する
+        - checkpoint_dir: ファイル全体を読む場合に、区間ごとのパース結果を書き出すディレクトリ
+        """
+        self.tree = None
+        self.root = None
+        collector = self._new_collector()
+        index = ExportIndex.load(self.export.xml_member) if use_index else None
+        spans = self._index_spans(index) if index is not None else None
+        
+        with self.export.open_xml() as f:
+            if spans is not None:
+                # 条件に合う範囲だけにシークし、ルート要素で包んでパースする
+                self._bytes_read = sum(end - start for start, end in spans)
+                print(
+                    f"  索引から{len(spans)}個の範囲（{self._bytes_read / (1024 * 1024):.1f}MB）"
+                    f"だけを読み込みます"
+                )
+                for start, end in spans:
+                    f.seek(start)
+                    stream_into(collector, f, prefix=b'<HealthData>', suffix=b'</HealthData>',
+                                limit=end - start, backend=self.backend)
+            elif checkpoint_dir is not None:
+                collector = self._parse_checkpointed(checkpoint_dir)
+            else:
+                # ファイル全体を読むついでに索引を作る（索引があり、絞り込み条件がないだけの場合は作り直さない。
+                # ExportIndex.load()はexport.xmlが変わった索引にはNoneを返す）
+                builder = ExportIndexBuilder() if use_index and index is None else None
+                stream_into(collector, f, backend=self.backend,
+                            observer=builder.feed if builder is not None else None)
+                if builder is not None:
+                    self._save_index(builder.finish())
+        
+        self.collector = collector
+    
+    def _open_checkpoint(self, checkpoint_dir: str) -> ParseCheckpoint:
+        """現在のパース条件に対するチェックポイントを開く"""
+        return ParseCheckpoint(checkpoint_dir, self.export.xml_member, self._cache_options(self.record_filter))
+    
+    def _parse_checkpointed(self, checkpoint_dir: str) -> RecordCollector:
+        """
+        ファイル全体を区間ごとにパースし、区間が終わるたびにパース結果とバイト位置を書き出す
+        
+        前回のパースが途中で中断していた場合は、書き出し済みの区間を読み込んで続きからパースする。
+        区間はトップレベル要素の境界に揃えて並列パースと同じように結合するため、
+        結果は中断せずにパースした場合と同じになる。
+        
+        パラメータ:
+        - checkpoint_dir: チェックポイントのディレクトリ
         
         戻り値:
-        - レコードのリスト
+        - すべてのレコードを収集したRecordCollector
         """
-        if not self.root:
-            raise ValueError("XMLファイルを先にパースしてください")
+        xml_path = self.export.xml_member
+        checkpoint = self._open_checkpoint(checkpoint_dir)
+        collector = self._new_collector()
+        if checkpoint.load():
+            checkpoint.load_segments(collector)
+            if checkpoint.next_segment:
+                print(
+                    f"  チェックポイントから再開: {checkpoint.next_segment}/{len(checkpoint.ranges)}区間"
+                    f"（{checkpoint.resumed_offset() / (1024 * 1024):.1f}MBまで、{collector.record_count}件）"
+                )
+        else:
+            chunk_count = max(1, -(-self.export.xml_size() // CHECKPOINT_INTERVAL_BYTES))
+            checkpoint.start(find_chunk_boundaries(xml_path, chunk_count))
+        
+        # 再開した場合は実際に読み込んだバイト数だけをスループットに含める
+        if checkpoint.next_segment:
+            self._bytes_read = sum(end - start for start, end in checkpoint.ranges[checkpoint.next_segment:])
+        for start, end in checkpoint.ranges[checkpoint.next_segment:]:
+            segment = parse_byte_range(xml_path, start, end, self.collector_args(), backend=self.backend)
+            checkpoint.save_segment(segment)
+            collector.merge(segment)
+        return collector
+    
+    def clear_checkpoint(self, checkpoint_dir: str):
+        """
+        現在のパース条件に対するチェックポイントを削除
+        
+        パラメータ:
+        - checkpoint_dir: parse()に指定したチェックポイントのディレクトリ
+        """
+        if not self.export.is_zip:
+            self._open_checkpoint(checkpoint_dir).clear()
+    
+    def _index_spans(self, index: ExportIndex) -> Optional[list]:
+        """
+        期間・データタイプの条件に合うバイト範囲を索引から取得
+        
+        パラメータ:
+        - index: ExportIndex
         
+        戻り値:
+        - (開始位置, 終了位置)のリスト（期間・データタイプの条件がなく、範囲を絞れない場合はNone）
+        """
+        record_filter = self.record_filter
+        since = record_filter.earliest_since
+        if record_filter.data_types is None and since is None and record_filter.until is None:
+            return None
+        identifiers = [
+            identifier for data_type, identifier in self.DATA_TYPES.items()
+            if record_filter.includes_type(data_type)
+        ]
+        return index.spans(
+            identifiers, workouts=record_filter.includes_type(RecordFilter.WORKOUTS),
+            since=since, until=record_filter.until,
+        )
+    
+    def _save_index(self, index: ExportIndex):
+        """作成した索引をexport.xmlの隣に保存"""
+        if index.save(self.export.xml_member):
+            print(f"  export.xmlの索引を保存しました（{index.describe()}）")
+    
+    def build_index(self) -> ExportIndex:
+        """
+        export.xmlを走査して索引を作成し、export.xmlの隣に保存
+        
+        戻り値:
+        - ExportIndex
+        """
+        if self.export.is_zip:
+            raise ValueError("zip内のXMLはシークできないため索引を作れません（展開してから実行してください）")
+        index = ExportIndex.build(self.export.xml_member)
+        self._save_index(index)
+        return index
+    
+    def _report_stats(self, elapsed: float, streaming: bool, workers: Optional[int] = None):
+        """パースの処理件数・スループット・ピークメモリを記録して表示"""
+        size_mb = (self._bytes_read if self._bytes_read is not None else self.export.xml_size()) / (1024 * 1024)
+        if streaming:
+            record_count = self.collector.record_count
+        else:
+            # ツリーモードではトップレベル要素数をレコード数とみなす
+            record_count = len(self.root)
+        
+        self.stats = {
+            'mode': f'parallel({workers})' if workers else ('streaming' if streaming else 'tree'),
+            'backend': self.backend if streaming else 'etree',
+            'records': record_count,
+            'elapsed_sec': elapsed,
+            'records_per_sec': record_count / elapsed if elapsed > 0 else 0.0,
+            'mb_per_sec': size_mb / elapsed if elapsed > 0 else 0.0,
+            'peak_rss_mb': _peak_rss_mb(),
+        }
+        
+        message = (
+            f"  {self.stats['mode']}[{self.stats['backend']}]: {record_count}件 / {elapsed:.1f}秒 "
+            f"({self.stats['records_per_sec']:.0f}件/秒, {self.stats['mb_per_sec']:.1f}MB/秒)"
+        )
+        if self.stats['peak_rss_mb'] is not None:
+            message += f", ピークメモリ: {self.stats['peak_rss_mb']:.0f}MB"
+        print(message)
+        if self.record_filter.filters_attributes and self.collector is not None:
+            print(
+                f"  絞り込み条件（{self.record_filter.describe()}）に合わない"
+                f"レコード{self.collector.skipped_count}件を読み飛ばしました"
+            )
+        
+    def extract_columns(self, data_type: str) -> RecordColumns:
+        """
+        指定されたデータタイプのレコードを列バッファのまま取得
+        
+        パラメータ:
+        - data_type: データタイプ（'sleep', 'hrv', 'heart_rate'など）
+        
+        戻り値:
+        - RecordColumnsオブジェクト
+        """
         type_identifier = self.DATA_TYPES.get(data_type)
         if not type_identifier:
             raise ValueError(f"不明なデータタイプ: {data_type}")
         
-        records = []
-        for record in self.root.findall('.//Record'):
-            if record.get('type') == type_identifier:
-                record_data = {
-                    'type': data_type,
-                    'source': record.get('sourceName', ''),
-                    'value': record.get('value'),
-                    'unit': record.get('unit', ''),
-                    'start_date': record.get('startDate'),
-                    'end_date': record.get('endDate'),
-                }
-                
-                # 睡眠データの場合、ステージも取得
-                if data_type == 'sleep':
-                    record_data['stage'] = self.SLEEP_STAGES.get(
-                        record.get('value', ''), 
-                        'unknown'
-                    )
-                
-                records.append(record_data)
-        
-        print(f"{data_type}: {len(records)}件のレコードを抽出")
-        return records
+        columns = self._get_collector().records[data_type]
+        print(f"{data_type}: {len(columns)}件のレコードを抽出")
+        return columns
+    
+    def extract_records(self, data_type: str) -> List[Dict]:
+        """
+        指定されたデータタイプのレコードを抽出
+        
+        パラメータ:
+        - data_type: データタイプ（'sleep', 'hrv', 'heart_rate'など）
+        
+        戻り値:
+        - レコードのリスト（値・日時は型変換済み）
+        """
+        return self.extract_columns(data_type).to_records()
+    
+    def extract_hrv_beats(self) -> pd.DataFrame:
+        """
+        HRVレコードに含まれる拍動ごとの瞬間心拍数を抽出
+        
+        戻り値:
+        - sample_id, bpm, rr_ms列のDataFrame（sample_idはextract_columns('hrv')の行番号）
+        """
+        df = self._get_collector().hrv_beats.to_frame()
+        print(f"{HRV_BEATS_TABLE}: {len(df)}拍を抽出")
+        return df
+    
+    def extract_workout_tables(self) -> Dict[str, pd.DataFrame]:
+        """
+        ワークアウトと統計・イベント・メタデータをフラットなテーブルとして抽出
+        
+        戻り値:
+        - 'workouts', 'workout_statistics', 'workout_events', 'workout_metadata'の
+          DataFrameの辞書（workout_idで結合できる）
+        """
+        tables = self._get_collector().workouts.to_frames()
+        print(
+            f"workouts: {len(tables['workouts'])}件のレコードを抽出"
+            f"（統計{len(tables['workout_statistics'])}件, イベント{len(tables['workout_events'])}件）"
+        )
+        return tables
     
     def extract_workouts(self) -> List[Dict]:
         """
         ワークアウトデータを抽出
         
         戻り値:
-        - ワークアウトレコードのリスト
+        - ワークアウトレコードのリスト（metadataはキーと値の辞書）
         """
-        if not self.root:
-            raise ValueError("XMLファイルを先にパースしてください")
-        
-        workouts = []
-        for workout in self.root.findall('.//Workout'):
-            workout_type = workout.get('workoutActivityType', '')
-            workout_name = self.WORKOUT_TYPES.get(workout_type, workout_type)
-            
-            workout_data = {
-                'type': workout_name,
-                'type_identifier': workout_type,
-                'start_date': workout.get('startDate'),
-                'end_date': workout.get('endDate'),
-                'duration': workout.get('duration'),
-                'total_energy_burned': workout.get('totalEnergyBurned'),
-                'total_distance': workout.get('totalDistance'),
-            }
-            
-            # メタデータから追加情報を取得
-            metadata = {}
-            for metadata_entry in workout.findall('.//MetadataEntry'):
-                key = metadata_entry.get('key')
-                value = metadata_entry.get('value')
-                if key and value:
-                    metadata[key] = value
-            
-            workout_data['metadata'] = metadata
-            workouts.append(workout_data)
-        
-        print(f"workouts: {len(workouts)}件のレコードを抽出")
+        tables = self.extract_workout_tables()
+        df = tables['workouts']
+        if df.empty:
+            return []
+        workouts = df.to_dict('records')
+        for workout in workouts:
+            workout['metadata'] = {}
+        metadata = tables['workout_metadata']
+        if not metadata.empty:
+            for workout_id, key, value in metadata[['workout_id', 'key', 'value']].itertuples(index=False):
+                workouts[workout_id]['metadata'][key] = value
         return workouts
     
     def extract_all_data(self) -> Dict[str, List[Dict]]:
@@ -171,32 +490,96 @@ class AppleHealthParser:
         
         戻り値:
         - データタイプごとのDataFrameの辞書
+          （parse()の絞り込み条件で読み込まなかったデータタイプは空のDataFrame）
         """
-        all_data = self.extract_all_data()
         dataframes = {}
         
-        for data_type, records in all_data.items():
-            if records:
-                df = pd.DataFrame(records)
-                # 日付をパース
-                if 'start_date' in df.columns:
-                    df['start_date'] = pd.to_datetime(df['start_date'])
-                if 'end_date' in df.columns:
-                    df['end_date'] = pd.to_datetime(df['end_date'])
-                # 値を数値に変換
-                if 'value' in df.columns:
-                    df['value'] = pd.to_numeric(df['value'], errors='coerce')
-                # ワークアウトのdurationとtotal_energy_burnedを数値に変換
-                if 'duration' in df.columns:
-                    df['duration'] = pd.to_numeric(df['duration'], errors='coerce')
-                if 'total_energy_burned' in df.columns:
-                    df['total_energy_burned'] = pd.to_numeric(df['total_energy_burned'], errors='coerce')
-                if 'total_distance' in df.columns:
-                    df['total_distance'] = pd.to_numeric(df['total_distance'], errors='coerce')
-                
-                dataframes[data_type] = df
-            else:
+        # レコードは列バッファから直接DataFrameにする（値・日時は変換済み）
+        for data_type in self.DATA_TYPES.keys():
+            try:
+                dataframes[data_type] = self.extract_columns(data_type).to_frame()
+            except Exception as e:
+                print(f"警告: {data_type}の抽出中にエラーが発生: {e}")
                 dataframes[data_type] = pd.DataFrame()
         
+        # HRVの拍動ごとの瞬間心拍数（hrvの行番号で結合できる）
+        try:
+            dataframes[HRV_BEATS_TABLE] = self.extract_hrv_beats()
+        except Exception as e:
+            print(f"警告: {HRV_BEATS_TABLE}の抽出中にエラーが発生: {e}")
+            dataframes[HRV_BEATS_TABLE] = pd.DataFrame()
+        
+        # ワークアウトは統計・イベント・メタデータとともにフラットなテーブルにする
+        try:
+            dataframes.update(self.extract_workout_tables())
+        except Exception as e:
+            print(f"警告: workoutsの抽出中にエラーが発生: {e}")
+            for name in WORKOUT_TABLES:
+                dataframes[name] = pd.DataFrame()
+        
         return dataframes
-
+    
+    def load_dataframes(self, streaming: Optional[bool] = None, workers: Optional[int] = None,
+                        since: Optional[date] = None, until: Optional[date] = None,
+                        data_types: Optional[Iterable[str]] = None,
+                        sources: Optional[Iterable[str]] = None,
+                        exclude_sources: Optional[Iterable[str]] = None,
+                        cache_dir: Optional[str] = 'data/cache/parsed',
+                        backend: Optional[str] = None,
+                        checkpoint_dir: Optional[str] = None,
+                        stream_since: Optional[Dict[Tuple[str, str], date]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        パース済みのキャッシュがあれば読み込み、なければパースしてキャッシュに保存
+        
+        エクスポートの内容が変わるとキャッシュのキーも変わるため、自動的にパースし直す。
+        
+        パラメータ:
+        - streaming, workers, since, until, data_types, sources, exclude_sources, backend, stream_since:
+          parse()と同じ
+        - cache_dir: キャッシュのディレクトリ（Noneの場合はキャッシュを使わない）
+          （XMLバックエンドはパース結果に影響しないため、キャッシュのキーには含めない）
+        - checkpoint_dir: parse()と同じ。DataFrameへの変換とキャッシュへの保存が終わったら削除する
+        
+        戻り値:
+        - データタイプごとのDataFrameの辞書（to_dataframes()と同じ）
+        """
+        parse_options = dict(
+            streaming=streaming, workers=workers, since=since, until=until,
+            data_types=data_types, sources=sources, exclude_sources=exclude_sources,
+            backend=backend, checkpoint_dir=checkpoint_dir, stream_since=stream_since,
+        )
+        if cache_dir is None:
+            self.parse(**parse_options)
+            dataframes = self.to_dataframes()
+            if checkpoint_dir is not None:
+                self.clear_checkpoint(checkpoint_dir)
+            return dataframes
+        
+        cache = ParsedDataCache(cache_dir)
+        started = time.perf_counter()
+        fingerprint = cache.fingerprint(self.export.path if self.export.is_zip else self.export.xml_member)
+        record_filter = RecordFilter(since, until, data_types, sources, exclude_sources, stream_since)
+        key = cache.cache_key(fingerprint, self._cache_options(record_filter))
+        dataframes = cache.load(key)
+        if dataframes is not None:
+            print(f"パース済みのキャッシュを読み込みました（{time.perf_counter() - started:.2f}秒）: {self.xml_path}")
+            return dataframes
+        
+        self.parse(**parse_options)
+        dataframes = self.to_dataframes()
+        cache.save(key, fingerprint, dataframes)
+        if checkpoint_dir is not None:
+            self.clear_checkpoint(checkpoint_dir)
+        return dataframes
+    
+    def _cache_options(self, record_filter: RecordFilter) -> Dict:
+        """パース結果に影響する設定（キャッシュのキーに含める）"""
+        return {
+            'type_definitions': [
+                (health_type.name, health_type.identifier, health_type.value_dtype)
+                for health_type in self.registry
+            ],
+            'sleep_stages': self.SLEEP_STAGES,
+            'workout_types': self.WORKOUT_TYPES,
+            'filter': record_filter.cache_options(),
+        }
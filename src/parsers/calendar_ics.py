@@ -0,0 +1,554 @@
+"""
+ローカルのiCalendar（.ics）ファイルの取り込みと、日ごとの会議の負荷の集計
+
+.icsファイルを1行ずつ読みながらVEVENTを取り出し、繰り返しの予定（RRULE）は指定した期間の中だけ展開する。
+展開した予定は区間の索引（pd.IntervalIndex）に入れ、日ごとの会議時間・連続した会議の数・
+夜の会議の数・勤務時間内の最長の空き時間を配列の演算でまとめて求める。
+"""
+import io
+import os
+import re
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
+import pandas as pd
+from dateutil.rrule import rrulestr
+from src.parsers.timestamps import NAT_NS, day_from_number, day_number, to_datetime_index
+from src.parsers.wearable_import import localize, zone_offsets_at
+
+_NS_PER_MINUTE = 60 * 1_000_000_000
+_NS_PER_HOUR = 60 * _NS_PER_MINUTE
+_NS_PER_DAY = 24 * _NS_PER_HOUR
+
+# 繰り返しの予定を展開する既定の期間（最初の予定から、今日のこの日数後まで）
+EXPANSION_DAYS_AHEAD = 30
+# 1つの繰り返しの予定から展開する回数の上限（終わりのない毎日の予定など）
+MAX_OCCURRENCES = 10000
+# 前の会議の終わりからこの分数以内に始まる会議を「連続した会議」とする
+BACK_TO_BACK_GAP_MIN = 5
+# この時刻（現地）より後まで続く会議を「夜の会議」とする
+LATE_EVENING_HOUR = 19
+# 最長の空き時間を求める勤務時間（現地の時、開始・終了）
+WORKDAY_HOURS = (9, 18)
+# オンライン会議とみなす場所・説明・URLのキーワード
+ONLINE_MEETING_KEYWORDS = ('zoom.us', 'meet.google', 'teams.microsoft', 'webex')
+
+CALENDAR_EVENT_COLUMNS = [
+    'uid', 'summary', 'start_date', 'end_date', 'utc_offset', 'local_day', 'all_day', 'is_meeting', 'busy',
+]
+CALENDAR_DAILY_COLUMNS = [
+    'date', 'meeting_count', 'meeting_minutes', 'back_to_back_meetings', 'late_meetings',
+    'longest_free_block_minutes',
+]
+
+_DURATION_PATTERN = re.compile(
+    r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$'
+)
+
+
+def _unfold(stream: BinaryIO) -> Iterator[str]:
+    """
+    .icsファイルの行を、折り返し（先頭が空白の継続行）を戻しながら1行ずつ返す
+
+    パラメータ:
+    - stream: .icsファイルのバイナリストリーム
+
+    戻り値:
+    - 論理行のイテレーター
+    """
+    current = None
+    for line in io.TextIOWrapper(stream, encoding='utf-8', errors='replace', newline=''):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def _split_property(line: str) -> Tuple[str, Dict[str, str], str]:
+    """'DTSTART;TZID=Asia/Tokyo:20240101T090000'を(名前, パラメータ, 値)に分ける"""
+    # 値の区切りは、引用符の外にある最初の':'
+    in_quotes = False
+    for position, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            break
+    else:
+        return line.upper(), {}, ''
+    head, value = line[:position], line[position + 1:]
+    name, *params = head.split(';')
+    parameters = {}
+    for param in params:
+        key, _, param_value = param.partition('=')
+        parameters[key.upper()] = param_value.strip('"')
+    return name.upper(), parameters, value
+
+
+def _parse_duration(text: str) -> Optional[timedelta]:
+    """ISO 8601の期間（'PT1H30M'など）をtimedeltaにする（不正な値はNone）"""
+    match = _DURATION_PATTERN.match(text.strip())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(
+        weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+        minutes=int(minutes or 0), seconds=int(seconds or 0),
+    )
+    return -duration if sign == '-' else duration
+
+
+class _Event:
+    """VEVENTの必要なプロパティ（日時は予定のタイムゾーンの壁時計時刻）"""
+
+    __slots__ = ('uid', 'summary', 'start', 'end', 'duration', 'zone', 'all_day', 'rrule', 'rdates',
+                 'exdates', 'recurrence_id', 'attendees', 'online', 'cancelled', 'transparent')
+
+    def __init__(self):
+        self.uid = ''
+        self.summary = ''
+        self.start: Optional[datetime] = None
+        self.end: Optional[datetime] = None
+        self.duration: Optional[timedelta] = None
+        self.zone: Optional[str] = None
+        self.all_day = False
+        self.rrule: Optional[str] = None
+        self.rdates: List[datetime] = []
+        self.exdates: List[datetime] = []
+        self.recurrence_id: Optional[datetime] = None
+        self.attendees = 0
+        self.online = False
+        self.cancelled = False
+        self.transparent = False
+
+
+class CalendarReader:
+    """
+    .icsファイルを読み込み、繰り返しを展開した予定の一覧にするクラス
+
+    日時はTZIDのタイムゾーン（UTCの'Z'、タイムゾーンのない時刻はカレンダーのタイムゾーン）で解釈し、
+    繰り返しは予定のタイムゾーンの壁時計時刻で展開する（夏時間をまたいでも同じ時刻の予定になる）。
+    """
+
+    def __init__(self, time_zone: Optional[str] = None,
+                 window_start: Optional[date] = None, window_end: Optional[date] = None):
+        """
+        読み込みの設定を初期化
+
+        パラメータ:
+        - time_zone: カレンダーのタイムゾーン（日ごとの集計もこのタイムゾーンの日付で行う。
+          Noneの場合はX-WR-TIMEZONE、それもなければUTC）
+        - window_start: 繰り返しを展開する期間の初日（Noneの場合は最初の予定の日）
+        - window_end: 繰り返しを展開する期間の最終日（Noneの場合は今日のEXPANSION_DAYS_AHEAD日後）
+        """
+        self.time_zone = time_zone
+        self.window_start = window_start
+        self.window_end = window_end
+        self.events: List[_Event] = []
+
+    def read(self, stream: BinaryIO):
+        """
+        1つの.icsファイルのVEVENTを読み込む
+
+        パラメータ:
+        - stream: .icsファイルのバイナリストリーム
+        """
+        event: Optional[_Event] = None
+        nested = 0
+        for line in _unfold(stream):
+            name, params, value = _split_property(line)
+            if name == 'BEGIN':
+                if value.upper() == 'VEVENT':
+                    event = _Event()
+                elif event is not None:
+                    # VEVENT内のVALARMなどは読み飛ばす
+                    nested += 1
+                continue
+            if name == 'END':
+                if event is not None and nested:
+                    nested -= 1
+                elif value.upper() == 'VEVENT' and event is not None:
+                    if event.start is not None:
+                        self.events.append(event)
+                    event = None
+                continue
+            if event is None:
+                if name == 'X-WR-TIMEZONE' and not self.time_zone and value:
+                    self.time_zone = value.strip()
+                continue
+            if nested:
+                continue
+            self._set_property(event, name, params, value)
+
+    def read_path(self, path: str):
+        """
+        .icsファイル、または.icsファイルを含むディレクトリを読み込む
+
+        パラメータ:
+        - path: パス
+        """
+        paths = sorted(Path(path).rglob('*.ics')) if os.path.isdir(path) else [Path(path)]
+        for ics_path in paths:
+            with open(ics_path, 'rb') as stream:
+                self.read(stream)
+
+    def _parse_datetime(self, params: Dict[str, str], value: str) -> Tuple[Optional[datetime], Optional[str], bool]:
+        """
+        日時のプロパティをデコード
+
+        戻り値:
+        - (壁時計時刻のdatetime, タイムゾーン名（'UTC'・TZID、タイムゾーンのない時刻はNone）, 終日かどうか)
+        """
+        value = value.strip().split(',')[0]
+        try:
+            if params.get('VALUE') == 'DATE' or len(value) == 8:
+                return datetime.strptime(value[:8], '%Y%m%d'), params.get('TZID'), True
+            moment = datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+        except ValueError:
+            return None, None, False
+        if value.endswith('Z'):
+            return moment, 'UTC', False
+        return moment, params.get('TZID'), False
+
+    def _set_property(self, event: _Event, name: str, params: Dict[str, str], value: str):
+        """VEVENTのプロパティを1つ設定"""
+        if name == 'UID':
+            event.uid = value
+        elif name == 'SUMMARY':
+            event.summary = value
+        elif name == 'DTSTART':
+            event.start, event.zone, event.all_day = self._parse_datetime(params, value)
+        elif name == 'DTEND':
+            event.end, _, _ = self._parse_datetime(params, value)
+        elif name == 'DURATION':
+            event.duration = _parse_duration(value)
+        elif name == 'RRULE':
+            event.rrule = value
+        elif name in ('EXDATE', 'RDATE'):
+            moments = []
+            for part in value.split(','):
+                moment, _, _ = self._parse_datetime(params, part)
+                if moment is not None:
+                    moments.append(moment)
+            (event.exdates if name == 'EXDATE' else event.rdates).extend(moments)
+        elif name == 'RECURRENCE-ID':
+            event.recurrence_id, _, _ = self._parse_datetime(params, value)
+        elif name == 'ATTENDEE':
+            event.attendees += 1
+        elif name == 'STATUS':
+            event.cancelled = value.upper() == 'CANCELLED'
+        elif name == 'TRANSP':
+            event.transparent = value.upper() == 'TRANSPARENT'
+        elif name in ('LOCATION', 'DESCRIPTION', 'URL', 'X-GOOGLE-CONFERENCE', 'X-MICROSOFT-SKYPETEAMSMEETINGURL'):
+            if name.startswith('X-') or any(keyword in value.lower() for keyword in ONLINE_MEETING_KEYWORDS):
+                event.online = True
+
+    def _zone_name(self, zone: Optional[str]) -> Optional[str]:
+        """予定のタイムゾーン名（不明なTZIDやタイムゾーンのない時刻はカレンダーのタイムゾーン）"""
+        if zone:
+            try:
+                ZoneInfo(zone)
+                return zone
+            except (ZoneInfoNotFoundError, ValueError):
+                pass
+        return self.time_zone
+
+    def _occurrences(self, event: _Event, window: Tuple[datetime, datetime]) -> List[datetime]:
+        """繰り返しの予定を、期間内の開始日時（予定のタイムゾーンの壁時計時刻）に展開する"""
+        single = [event.start] if window[0] <= event.start <= window[1] else []
+        if not event.rrule:
+            return single
+        rule = event.rrule
+        until = re.search(r'UNTIL=(\d{8}(?:T\d{6}Z?)?)', rule)
+        if until and until.group(1).endswith('Z'):
+            # UTCのUNTILを予定のタイムゾーンの壁時計時刻にする（壁時計時刻のDTSTARTと比較するため）
+            # UTCの予定（DTSTARTが...Z）はDTSTARTもUTCの壁時計時刻なので、Zを外すだけでよい
+            utc = datetime.strptime(until.group(1), '%Y%m%dT%H%M%SZ')
+            zone = None if event.zone == 'UTC' else self._zone_name(event.zone)
+            local = (
+                pd.Timestamp(utc).tz_localize('UTC').tz_convert(zone).tz_localize(None).to_pydatetime()
+                if zone else utc
+            )
+            rule = rule.replace(until.group(1), local.strftime('%Y%m%dT%H%M%S'))
+        try:
+            recurrence = rrulestr(rule, dtstart=event.start, forceset=True)
+        except (ValueError, TypeError):
+            # 解釈できない繰り返しは、繰り返さない予定として扱う
+            return single
+        for moment in event.rdates:
+            recurrence.rdate(moment)
+        for moment in event.exdates:
+            recurrence.exdate(moment)
+        occurrences = []
+        for moment in recurrence.xafter(window[0], inc=True):
+            if moment > window[1] or len(occurrences) >= MAX_OCCURRENCES:
+                break
+            occurrences.append(moment)
+        return occurrences
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        読み込んだ予定を、繰り返しを展開した1回ごとの行のDataFrameにする
+
+        戻り値:
+        - uid, summary, start_date, end_date（カレンダーのタイムゾーン）, utc_offset, local_day,
+          all_day, is_meeting, busy列のDataFrame（開始日時順）
+        """
+        events = [event for event in self.events if event.start is not None]
+        if not events:
+            return pd.DataFrame(columns=CALENDAR_EVENT_COLUMNS)
+        first = self.window_start or min(event.start for event in events).date()
+        last = self.window_end or date.today() + timedelta(days=EXPANSION_DAYS_AHEAD)
+        window = (datetime.combine(first, datetime.min.time()),
+                  datetime.combine(last, datetime.max.time()))
+
+        # 個別に変更された回（RECURRENCE-ID）は、元の繰り返しから除いて変更後の予定を使う
+        overridden = {
+            (event.uid, event.recurrence_id) for event in events if event.recurrence_id is not None
+        }
+        rows: Dict[Optional[str], List[Tuple[int, int, int]]] = {}
+        for index, event in enumerate(events):
+            if event.cancelled:
+                continue
+            if event.end is not None:
+                length = event.end - event.start
+            elif event.duration is not None:
+                length = event.duration
+            else:
+                length = timedelta(days=1) if event.all_day else timedelta(0)
+            length_ns = max(int(length.total_seconds()), 0) * 1_000_000_000
+            occurrences = self._occurrences(event, window)
+            if event.rrule and overridden:
+                occurrences = [moment for moment in occurrences if (event.uid, moment) not in overridden]
+            zone = None if event.all_day else self._zone_name(event.zone)
+            starts = pd.DatetimeIndex(occurrences).as_unit('ns').asi8 if occurrences else np.empty(0, dtype=np.int64)
+            rows.setdefault(zone, []).extend((index, start, length_ns) for start in starts.tolist())
+
+        # 予定のタイムゾーンごとに壁時計時刻をUTCにし、カレンダーのタイムゾーンのオフセットを求める
+        parts = []
+        for zone, zone_rows in rows.items():
+            if not zone_rows:
+                continue
+            index, local_start, length = (np.array(column, dtype=np.int64) for column in zip(*zone_rows))
+            # 終日の予定・タイムゾーンのない予定はカレンダーのタイムゾーンの壁時計時刻
+            start_ns, _ = localize(local_start, zone or self.time_zone)
+            parts.append((index, start_ns, start_ns + length))
+        if not parts:
+            return pd.DataFrame(columns=CALENDAR_EVENT_COLUMNS)
+        index, start_ns, end_ns = (np.concatenate(column) for column in zip(*parts))
+        order = np.argsort(start_ns, kind='stable')
+        index, start_ns, end_ns = index[order], start_ns[order], end_ns[order]
+        offsets = zone_offsets_at(start_ns, self.time_zone)
+
+        source = [events[i] for i in index.tolist()]
+        return pd.DataFrame({
+            'uid': [event.uid for event in source],
+            'summary': [event.summary for event in source],
+            'start_date': to_datetime_index(start_ns, offsets),
+            'end_date': to_datetime_index(end_ns, offsets),
+            'utc_offset': offsets,
+            'local_day': ((start_ns + offsets.astype(np.int64) * _NS_PER_MINUTE) // _NS_PER_DAY).astype(np.int32),
+            'all_day': np.array([event.all_day for event in source], dtype=bool),
+            # 参加者が2人以上、またはオンライン会議のURLがある予定を会議とみなす
+            'is_meeting': np.array([event.attendees > 1 or event.online for event in source], dtype=bool),
+            'busy': np.array([not event.transparent for event in source], dtype=bool),
+        })
+
+
+class CalendarIntervals:
+    """
+    予定をカレンダーのタイムゾーンの壁時計時刻の区間として保持する索引
+
+    区間はpd.IntervalIndex（左閉・右開）に入れ、指定した時間帯と重なる予定を配列の比較でまとめて引ける。
+    日ごとの集計は、日付の境界で分けた区間を開始順に並べ、累積の最大値で重なりをまとめて求める。
+    """
+
+    def __init__(self, events: pd.DataFrame, meetings_only: bool = True):
+        """
+        索引を作成
+
+        パラメータ:
+        - events: CalendarReader.to_frame()の結果
+        - meetings_only: Trueの場合は会議だけ、Falseの場合は予定ありのすべての時間指定の予定を対象にする
+        """
+        selected = events[~events['all_day'] & events['busy']] if not events.empty else events
+        if meetings_only and not selected.empty:
+            selected = selected[selected['is_meeting']]
+        if selected.empty:
+            start = end = np.empty(0, dtype=np.int64)
+        else:
+            offsets = selected['utc_offset'].to_numpy(dtype=np.int64) * _NS_PER_MINUTE
+            start = selected['start_date'].to_numpy(dtype='datetime64[ns]').view(np.int64) + offsets
+            end = selected['end_date'].to_numpy(dtype='datetime64[ns]').view(np.int64) + offsets
+            order = np.argsort(start, kind='stable')
+            start, end = start[order], np.maximum(end[order], start[order])
+        self.start = start
+        self.end = end
+        self.index = pd.IntervalIndex.from_arrays(start, end, closed='left')
+        # 予定のある期間（会議のない日を0件として扱う範囲）
+        self.first_day = int(events['local_day'].min()) if not events.empty else None
+        self.last_day = int(events['local_day'].max()) if not events.empty else None
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def overlapping(self, start: datetime, end: datetime) -> np.ndarray:
+        """
+        時間帯（カレンダーのタイムゾーンの壁時計時刻）と重なる予定の行番号
+
+        パラメータ:
+        - start: 時間帯の開始
+        - end: 時間帯の終了
+
+        戻り値:
+        - 行番号の配列（開始日時順）
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        interval = pd.Interval(pd.Timestamp(start).value, pd.Timestamp(end).value, closed='left')
+        return np.flatnonzero(self.index.overlaps(interval))
+
+    def _day_fragments(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """日付をまたぐ予定を日ごとの区間に分ける（開始順の(日, 開始, 終了)）"""
+        first = self.start // _NS_PER_DAY
+        last = np.maximum((self.end - 1) // _NS_PER_DAY, first)
+        counts = last - first + 1
+        rows = np.repeat(np.arange(len(self)), counts)
+        # 同じ予定の中での何日目か
+        within = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        day = first[rows] + within
+        start = np.maximum(self.start[rows], day * _NS_PER_DAY)
+        end = np.minimum(self.end[rows], (day + 1) * _NS_PER_DAY)
+        order = np.lexsort((start, day))
+        return day[order], start[order], end[order]
+
+    def daily_features(self, first_day: Optional[int] = None, last_day: Optional[int] = None) -> pd.DataFrame:
+        """
+        日ごとの会議の負荷を求める
+
+        パラメータ:
+        - first_day, last_day: 集計する期間（1970-01-01からの日数。Noneの場合は予定のある期間）
+
+        戻り値:
+        - date, meeting_count, meeting_minutes, back_to_back_meetings, late_meetings,
+          longest_free_block_minutes列のDataFrame（期間内の会議のない日は0件）
+        """
+        first_day = self.first_day if first_day is None else first_day
+        last_day = self.last_day if last_day is None else last_day
+        if first_day is None or last_day is None or last_day < first_day:
+            return pd.DataFrame(columns=CALENDAR_DAILY_COLUMNS)
+        days = last_day - first_day + 1
+        meeting_count = np.zeros(days, dtype=np.int64)
+        meeting_ns = np.zeros(days, dtype=np.int64)
+        back_to_back = np.zeros(days, dtype=np.int64)
+        late = np.zeros(days, dtype=np.int64)
+        workday_ns = (WORKDAY_HOURS[1] - WORKDAY_HOURS[0]) * _NS_PER_HOUR
+        longest_free = np.full(days, workday_ns, dtype=np.int64)
+
+        if len(self):
+            start_day = self.start // _NS_PER_DAY - first_day
+            in_range = (start_day >= 0) & (start_day < days)
+            meeting_count += np.bincount(start_day[in_range], minlength=days)
+
+            day, start, end = self._day_fragments()
+            keep = (day >= first_day) & (day <= last_day)
+            day, start, end = day[keep] - first_day, start[keep], end[keep]
+
+            # 開始順に並べた区間の終了の累積最大値で、重なる予定を1つの塊にまとめる
+            running_end = np.maximum.accumulate(end) if len(end) else end
+            previous_end = np.concatenate(([NAT_NS], running_end[:-1]))
+            same_day = np.concatenate(([False], day[1:] == day[:-1]))
+            new_block = ~same_day | (start > previous_end)
+            block_index = np.flatnonzero(new_block)
+            if len(block_index):
+                block_day = day[block_index]
+                block_start = start[block_index]
+                block_end = np.maximum.reduceat(end, block_index)
+                meeting_ns += np.bincount(block_day, weights=block_end - block_start, minlength=days).astype(np.int64)
+
+                # 直前の会議の終わりからBACK_TO_BACK_GAP_MIN分以内に始まる会議（重なる会議も含む）
+                gap = start - previous_end
+                back_to_back += np.bincount(
+                    day[same_day & (gap <= BACK_TO_BACK_GAP_MIN * _NS_PER_MINUTE)], minlength=days
+                )
+
+                # LATE_EVENING_HOUR時より後まで続く会議
+                day_start = (day + first_day) * _NS_PER_DAY
+                late += np.bincount(day[end > day_start + LATE_EVENING_HOUR * _NS_PER_HOUR], minlength=days)
+
+                # 勤務時間内の空き時間（塊の間・勤務開始から最初の塊まで・最後の塊から勤務終了まで）
+                window_start = (block_day + first_day) * _NS_PER_DAY + WORKDAY_HOURS[0] * _NS_PER_HOUR
+                clipped_start = np.clip(block_start, window_start, window_start + workday_ns)
+                clipped_end = np.clip(block_end, window_start, window_start + workday_ns)
+                first_block = np.concatenate(([True], block_day[1:] != block_day[:-1]))
+                last_block = np.concatenate((block_day[1:] != block_day[:-1], [True]))
+                previous_block_end = np.where(
+                    first_block, window_start, np.concatenate(([0], np.maximum.accumulate(clipped_end)[:-1]))
+                )
+                gaps = np.concatenate((
+                    clipped_start - previous_block_end,
+                    (window_start + workday_ns - clipped_end)[last_block],
+                ))
+                gap_days = np.concatenate((block_day, block_day[last_block]))
+                has_blocks = np.bincount(block_day, minlength=days) > 0
+                longest_free[has_blocks] = 0
+                np.maximum.at(longest_free, gap_days, np.maximum(gaps, 0))
+
+        day_numbers = np.arange(first_day, last_day + 1)
+        return pd.DataFrame({
+            'date': [day_from_number(number) for number in day_numbers.tolist()],
+            'meeting_count': meeting_count,
+            'meeting_minutes': meeting_ns // _NS_PER_MINUTE,
+            'back_to_back_meetings': back_to_back,
+            'late_meetings': late,
+            'longest_free_block_minutes': longest_free // _NS_PER_MINUTE,
+        })
+
+
+class CalendarIngester:
+    """
+    ローカルの.icsファイルを読み込み、予定の一覧と日ごとの会議の負荷を求めるクラス
+    """
+
+    def __init__(self, paths: List[str], time_zone: Optional[str] = None,
+                 since: Optional[date] = None, until: Optional[date] = None,
+                 meetings_only: bool = True):
+        """
+        取り込み処理を初期化
+
+        パラメータ:
+        - paths: .icsファイル、または.icsファイルを含むディレクトリのリスト
+        - time_zone: カレンダーのタイムゾーン（Noneの場合はX-WR-TIMEZONE）
+        - since, until: 繰り返しを展開し、日ごとに集計する期間
+        - meetings_only: Falseの場合は会議以外の予定ありの予定も会議時間に含める
+        """
+        self.paths = paths
+        self.reader = CalendarReader(time_zone, since, until)
+        self.since = since
+        self.until = until
+        self.meetings_only = meetings_only
+
+    def ingest(self) -> Dict[str, pd.DataFrame]:
+        """
+        .icsファイルを読み込み、日ごとの会議の負荷を集計
+
+        戻り値:
+        - 'calendar_events'（繰り返しを展開した予定）と'calendar_daily'（日ごとの会議の負荷、
+          date列はカレンダーのタイムゾーンの日付）のDataFrameの辞書
+        """
+        for path in self.paths:
+            self.reader.read_path(path)
+        events = self.reader.to_frame()
+        intervals = CalendarIntervals(events, meetings_only=self.meetings_only)
+        daily = intervals.daily_features(
+            day_number(self.since) if self.since else None,
+            day_number(self.until) if self.until else None,
+        )
+        return {'calendar_events': events, 'calendar_daily': daily}
@@ -0,0 +1,167 @@
+"""
+大きなエクスポートのパースを途中から再開するためのチェックポイント
+
+export.xmlをトップレベル要素の境界に揃えた区間に分け、区間ごとにパースした列バッファを
+ディスクに書き出し、どこまで終わったか（バイト位置・件数）を記録する。
+中断した後に同じ条件でパースし直すと、書き出し済みの区間を読み込んで続きからパースする。
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from src.parsers.record_collector import RecordCollector
+
+# チェックポイントの保存形式を変えたら上げる
+CHECKPOINT_VERSION = 2
+# この大きさごとに区間を区切って書き出す
+CHECKPOINT_INTERVAL_BYTES = 256 * 1024 * 1024
+_MANIFEST_NAME = 'checkpoint.json'
+
+
+def _file_signature(xml_path: str) -> Dict:
+    """チェックポイントが同じファイルのものかを判定するためのパス・サイズ・更新日時"""
+    stat = os.stat(xml_path)
+    return {'path': os.path.abspath(xml_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class ParseCheckpoint:
+    """
+    1つのexport.xmlとパース条件に対するチェックポイント
+
+    区間ごとのRecordCollectorをsegment_NNNNN.pklに、区間の一覧と完了した区間数を
+    checkpoint.jsonに保存する。ファイルはすべて一時ファイルに書いてから名前を変えるため、
+    書き込み中に中断しても最後に完了した区間までは読み込める。
+    """
+
+    def __init__(self, checkpoint_dir: str, xml_path: str, options: Dict):
+        """
+        チェックポイントを開く
+
+        パラメータ:
+        - checkpoint_dir: チェックポイントを保存するディレクトリ
+        - xml_path: export.xmlのパス
+        - options: パース結果に影響する設定（条件が変わると別のチェックポイントになる）
+        """
+        self.xml_path = xml_path
+        self.source = _file_signature(xml_path)
+        payload = json.dumps(
+            {'version': CHECKPOINT_VERSION, 'source': self.source, 'options': options},
+            sort_keys=True, default=str,
+        )
+        key = hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+        self.directory = Path(checkpoint_dir) / key
+        self.ranges: List[Tuple[int, int]] = []
+        self.completed: List[Dict] = []
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / _MANIFEST_NAME
+
+    def load(self) -> bool:
+        """
+        保存済みのチェックポイントを読み込む
+
+        戻り値:
+        - チェックポイントがあればTrue
+        """
+        if not self.manifest_path.exists():
+            return False
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest['version'] != CHECKPOINT_VERSION or manifest['source'] != self.source:
+                return False
+            self.ranges = [tuple(r) for r in manifest['ranges']]
+            self.completed = manifest['completed']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"警告: チェックポイントを読み込めないため最初からパースします: {e}")
+            self.ranges = []
+            self.completed = []
+            return False
+        return True
+
+    def start(self, ranges: List[Tuple[int, int]]):
+        """
+        新しいチェックポイントを作成
+
+        パラメータ:
+        - ranges: パースする区間（(開始位置, 終了位置)のリスト）
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ranges = list(ranges)
+        self.completed = []
+        self._write_manifest()
+
+    @property
+    def next_segment(self) -> int:
+        """次にパースする区間の番号"""
+        return len(self.completed)
+
+    @property
+    def is_complete(self) -> bool:
+        """すべての区間のパースが完了しているかどうか"""
+        return bool(self.ranges) and len(self.completed) == len(self.ranges)
+
+    def save_segment(self, collector: RecordCollector):
+        """
+        次の区間のパース結果を書き出し、完了した区間として記録
+
+        パラメータ:
+        - collector: 区間をパースしたRecordCollector（デコード済み）
+        """
+        segment = self.next_segment
+        file_name = f'segment_{segment:05d}.pkl'
+        tmp_path = self.directory / f'.{file_name}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(collector, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.directory / file_name)
+
+        self.completed.append({
+            'file': file_name,
+            'end_offset': self.ranges[segment][1],
+            'record_count': collector.record_count,
+            'skipped_count': collector.skipped_count,
+        })
+        self._write_manifest()
+
+    def load_segments(self, into: RecordCollector) -> RecordCollector:
+        """
+        完了した区間のパース結果を順番に結合
+
+        パラメータ:
+        - into: 結合先のRecordCollector
+
+        戻り値:
+        - into
+        """
+        for entry in self.completed:
+            with open(self.directory / entry['file'], 'rb') as f:
+                into.merge(pickle.load(f))
+        return into
+
+    def resumed_offset(self) -> Optional[int]:
+        """完了した最後の区間の終了位置（完了した区間がない場合はNone）"""
+        return self.completed[-1]['end_offset'] if self.completed else None
+
+    def clear(self):
+        """チェックポイントを削除"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.ranges = []
+        self.completed = []
+
+    def _write_manifest(self):
+        """区間の一覧と完了した区間を書き込む"""
+        manifest = {
+            'version': CHECKPOINT_VERSION,
+            'source': self.source,
+            'ranges': self.ranges,
+            'completed': self.completed,
+        }
+        tmp_path = self.directory / f'.{_MANIFEST_NAME}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,368 @@
+"""
+レコードを型付きの列バッファに蓄積する処理
+"""
+from array import array
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from src.parsers.timestamps import (
+    decode_timestamps, fixed_width, local_day_numbers, to_datetime_index, zone_offsets,
+)
+
+# この件数ごとに未デコードのタイムスタンプをまとめてデコードする
+DECODE_BATCH_SIZE = 65536
+
+
+class CodeTable:
+    """繰り返し出現する文字列（ソース名・単位など）を整数コードに変換する表"""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def encode(self, value: str) -> int:
+        """
+        文字列のコードを取得（未登録なら追加）
+
+        パラメータ:
+        - value: 文字列
+
+        戻り値:
+        - 整数コード
+        """
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """
+        コード配列を文字列配列に戻す
+
+        パラメータ:
+        - codes: 整数コードの配列
+
+        戻り値:
+        - 文字列のobject配列
+        """
+        return np.asarray(self.values, dtype=object)[codes]
+
+    def remap(self, other: 'CodeTable') -> np.ndarray:
+        """
+        別のCodeTableのコードをこの表のコードに変換する対応表を作成
+
+        パラメータ:
+        - other: 変換元のCodeTable
+
+        戻り値:
+        - otherのコードをインデックスとする、この表のコードの配列
+        """
+        return np.array([self.encode(value) for value in other.values], dtype=np.int32)
+
+
+def _to_float(value: Optional[str]) -> float:
+    """数値文字列をfloatに変換（変換できない場合はNaN）"""
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+class TimestampColumn:
+    """
+    タイムスタンプをUTCエポックのint64ナノ秒とint16のUTCオフセット（分）で蓄積する列
+
+    文字列のまま溜めておき、DECODE_BATCH_SIZE件ごとにベクトル演算でまとめてデコードする。
+    """
+
+    def __init__(self):
+        self.ns = array('q')
+        self.offset = array('h')
+        # デコード待ちのタイムスタンプ文字列
+        self._pending: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.ns) + len(self._pending)
+
+    def append(self, text: Optional[str]):
+        """
+        タイムスタンプ文字列を1件追加
+
+        パラメータ:
+        - text: 'YYYY-MM-DD HH:MM:SS +HHMM'形式の文字列（不正な場合はNaT）
+        """
+        self._pending.append(fixed_width(text))
+        if len(self._pending) >= DECODE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """デコード待ちのタイムスタンプをまとめてデコード"""
+        if not self._pending:
+            return
+        ns, offsets = decode_timestamps(''.join(self._pending).encode('ascii', 'replace'))
+        self.ns.frombytes(ns.tobytes())
+        self.offset.frombytes(offsets.tobytes())
+        self._pending.clear()
+
+    def extend(self, other: 'TimestampColumn'):
+        """
+        別の列の値を末尾に追加
+
+        パラメータ:
+        - other: 追加するTimestampColumn
+        """
+        self.flush()
+        other.flush()
+        self.ns.extend(other.ns)
+        self.offset.extend(other.offset)
+
+    def extend_arrays(self, ns: np.ndarray, offsets: np.ndarray):
+        """
+        デコード済みの値を末尾に追加（Apple Health以外のインポーターが読み込んだ日時）
+
+        パラメータ:
+        - ns: UTCエポックからのナノ秒（int64）
+        - offsets: UTCオフセット（分）
+        """
+        # デコード待ちの文字列より後ろに並ぶよう、先にデコードしておく
+        self.flush()
+        self.ns.frombytes(np.ascontiguousarray(ns, dtype=np.int64).tobytes())
+        self.offset.frombytes(np.ascontiguousarray(offsets, dtype=np.int16).tobytes())
+
+    def ns_array(self) -> np.ndarray:
+        """UTCエポックからのナノ秒（バッファを参照するint64配列）"""
+        self.flush()
+        return np.frombuffer(self.ns, dtype=np.int64)
+
+    def offset_array(self) -> np.ndarray:
+        """UTCオフセット（分、バッファを参照するint16配列）"""
+        self.flush()
+        return np.frombuffer(self.offset, dtype=np.int16)
+
+    def to_index(self) -> pd.DatetimeIndex:
+        """タイムゾーン付きのDatetimeIndexに変換"""
+        return to_datetime_index(self.ns_array(), self.offset_array())
+
+
+def decode_codes(table: CodeTable, codes: array) -> np.ndarray:
+    """
+    コードの列を文字列のobject配列に戻す
+
+    パラメータ:
+    - table: コード表
+    - codes: 整数コードの配列（array('i')）
+
+    戻り値:
+    - 文字列のobject配列
+    """
+    return table.decode(np.frombuffer(codes, dtype=np.int32))
+
+
+def categorical_codes(table: CodeTable, codes: array, empty_as_missing: bool = False) -> pd.Categorical:
+    """
+    コードの列をそのままカテゴリ型の列にする（文字列を行ごとに複製しない）
+
+    パラメータ:
+    - table: コード表（カテゴリの一覧になる）
+    - codes: 整数コードの配列（array('i')）
+    - empty_as_missing: Trueの場合、空文字列を欠損値として扱う
+
+    戻り値:
+    - カテゴリ型の配列
+    """
+    values = np.frombuffer(codes, dtype=np.int32)
+    categories = table.values
+    if empty_as_missing and '' in table.codes:
+        empty = table.codes['']
+        # 空文字列をカテゴリから外し、後ろのコードを1つずつ詰める
+        values = np.where(values == empty, -1, values - (values > empty))
+        categories = categories[:empty] + categories[empty + 1:]
+    return pd.Categorical.from_codes(values, categories=categories)
+
+
+def extend_codes(codes: array, table: CodeTable, other_codes: array, other_table: CodeTable):
+    """
+    別のコード表のコード列を、この表のコードに付け替えて末尾に追加
+
+    パラメータ:
+    - codes: 追加先のコード列
+    - table: 追加先のコード表
+    - other_codes: 追加するコード列
+    - other_table: 追加するコード列のコード表
+    """
+    mapping = table.remap(other_table)
+    codes.frombytes(mapping[np.frombuffer(other_codes, dtype=np.int32)].tobytes())
+
+
+class RecordColumns:
+    """
+    1データタイプ分のレコードを列ごとの型付き配列に蓄積するバッファ
+
+    値はfloat64、日時はTimestampColumn、ソース名・単位・睡眠ステージはCodeTableの整数コードで保持する。
+    """
+
+    def __init__(self, data_type: str, with_stage: bool = False):
+        """
+        バッファを初期化
+
+        パラメータ:
+        - data_type: データタイプ名（'heart_rate'など）
+        - with_stage: 睡眠ステージ列を持つかどうか
+        """
+        self.data_type = data_type
+        self.value = array('d')
+        self.start = TimestampColumn()
+        self.end = TimestampColumn()
+        self.source = array('i')
+        self.unit = array('i')
+        self.sources = CodeTable()
+        self.units = CodeTable()
+        self.stage = array('i') if with_stage else None
+        self.stages = CodeTable()
+        # HKTimeZoneメタデータのタイムゾーン名（コード0はタイムゾーン名なし）
+        self.time_zone = array('i')
+        self.time_zones = CodeTable()
+        self.time_zones.encode('')
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def append(self, source: str, unit: str, value: Optional[str],
+               start_date: Optional[str], end_date: Optional[str],
+               stage: Optional[str] = None):
+        """
+        レコードを1件追加
+
+        パラメータ:
+        - source: ソース名
+        - unit: 単位
+        - value: 値（数値に変換できない場合はNaN）
+        - start_date: 開始日時の文字列
+        - end_date: 終了日時の文字列
+        - stage: 睡眠ステージ（with_stageの場合のみ）
+        """
+        self.start.append(start_date)
+        self.end.append(end_date)
+        self.value.append(_to_float(value))
+        self.source.append(self.sources.encode(source))
+        self.unit.append(self.units.encode(unit))
+        if self.stage is not None:
+            self.stage.append(self.stages.encode(stage))
+        self.time_zone.append(0)
+
+    def extend_arrays(self, source: str, unit: str, value: np.ndarray,
+                      start_ns: np.ndarray, end_ns: np.ndarray, offsets: np.ndarray,
+                      stage: Optional[np.ndarray] = None, time_zone: str = ''):
+        """
+        同じソース・単位のレコードを配列のまま末尾に追加（Apple Health以外のインポーターが使う）
+
+        パラメータ:
+        - source: ソース名
+        - unit: 単位
+        - value: 値（float64）
+        - start_ns: 開始日時のUTCエポックナノ秒（int64）
+        - end_ns: 終了日時のUTCエポックナノ秒（int64）
+        - offsets: UTCオフセット（分）
+        - stage: 睡眠ステージ名の配列（with_stageの場合のみ）
+        - time_zone: 記録した場所のタイムゾーン名（わかる場合）
+        """
+        count = len(value)
+        if count == 0:
+            return
+        self.start.extend_arrays(start_ns, offsets)
+        self.end.extend_arrays(end_ns, offsets)
+        self.value.frombytes(np.ascontiguousarray(value, dtype=np.float64).tobytes())
+        self.source.frombytes(np.full(count, self.sources.encode(source), dtype=np.int32).tobytes())
+        self.unit.frombytes(np.full(count, self.units.encode(unit), dtype=np.int32).tobytes())
+        if self.stage is not None:
+            codes, names = pd.factorize(np.asarray(stage if stage is not None else ['unknown'] * count, dtype=object))
+            mapping = np.array([self.stages.encode(name) for name in names], dtype=np.int32)
+            self.stage.frombytes(mapping[codes].tobytes())
+        self.time_zone.frombytes(np.full(count, self.time_zones.encode(time_zone), dtype=np.int32).tobytes())
+
+    def set_time_zone(self, name: str):
+        """
+        最後に追加したレコードのタイムゾーン名を設定（HKTimeZoneメタデータ）
+
+        パラメータ:
+        - name: IANAのタイムゾーン名（'Asia/Tokyo'など）
+        """
+        self.time_zone[-1] = self.time_zones.encode(name)
+
+    def flush(self):
+        """デコード待ちのタイムスタンプをまとめてデコードし、日時の列に追加"""
+        self.start.flush()
+        self.end.flush()
+
+    def extend(self, other: 'RecordColumns'):
+        """
+        別のバッファのレコードを末尾に追加
+
+        コード表は別々に作られているため、コードはこの表のものに付け替える。
+
+        パラメータ:
+        - other: 追加するRecordColumns
+        """
+        if len(other) == 0:
+            return
+        self.value.extend(other.value)
+        self.start.extend(other.start)
+        self.end.extend(other.end)
+        extend_codes(self.source, self.sources, other.source, other.sources)
+        extend_codes(self.unit, self.units, other.unit, other.units)
+        if self.stage is not None:
+            extend_codes(self.stage, self.stages, other.stage, other.stages)
+        extend_codes(self.time_zone, self.time_zones, other.time_zone, other.time_zones)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        バッファをDataFrameに変換
+
+        数値列はバッファのメモリをそのまま参照し、コピーしない。
+
+        戻り値:
+        - type, source, value, unit, start_date, end_date, utc_offset, time_zone, local_day
+          （睡眠はstageも）列のDataFrame
+        """
+        if len(self) == 0:
+            return pd.DataFrame()
+        start_ns = self.start.ns_array()
+        zone_codes = np.frombuffer(self.time_zone, dtype=np.int32)
+        offsets = zone_offsets(start_ns, self.start.offset_array(), zone_codes, self.time_zones.values)
+        # 繰り返し出現する文字列の列は、コード表をカテゴリとするカテゴリ型にする
+        columns = {
+            'type': pd.Categorical.from_codes(np.zeros(len(self), dtype=np.int8), categories=[self.data_type]),
+            'source': categorical_codes(self.sources, self.source),
+            'value': np.frombuffer(self.value, dtype=np.float64),
+            'unit': categorical_codes(self.units, self.unit),
+            'start_date': self.start.to_index(),
+            'end_date': self.end.to_index(),
+            # 各レコード自身のUTCオフセット（分）。混在していてもstart_dateと組み合わせて現地時刻を求められる
+            # （HKTimeZoneがあるレコードは、記録した場所のその時点のオフセット）
+            'utc_offset': offsets,
+            'time_zone': categorical_codes(self.time_zones, self.time_zone, empty_as_missing=True),
+            # 開始日時の現地の日付（1970-01-01からの日数）。日ごとの集計はこの整数でまとめる
+            'local_day': local_day_numbers(start_ns, offsets),
+        }
+        if self.stage is not None:
+            columns['stage'] = categorical_codes(self.stages, self.stage)
+
+        return pd.DataFrame(columns, copy=False)
+
+    def to_records(self) -> List[Dict]:
+        """
+        バッファをレコードの辞書のリストに変換（互換性のため）
+
+        戻り値:
+        - レコードのリスト
+        """
+        df = self.to_frame()
+        # カテゴリ型の列は文字列に戻す
+        return df.astype({
+            column: object for column in df.columns
+            if isinstance(df[column].dtype, pd.CategoricalDtype)
+        }).to_dict('records')
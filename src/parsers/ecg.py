@@ -0,0 +1,352 @@
+"""
+心電図（electrocardiograms/*.csv）の取り込みとR波検出・HRV指標の計算
+
+Apple Watchの心電図のCSVは、ヘッダー（'Recorded Date'・'Sample Rate'などの行）、
+空行、誘導と単位の行（'Lead,Lead I'・'Unit,µV'）、空行に続いて、
+1行に1サンプルの電位（µV）を持つ（30秒・512Hzで約15,000行）。
+"""
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePosixPath
+from typing import BinaryIO, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from src.calculators.hrv_metrics import beat_metrics
+from src.parsers.export_archive import HealthExport
+from src.parsers.timestamps import NAT_NS, parse_apple_timestamp, to_datetime_index
+
+# サンプリング周波数がヘッダーにない場合の既定値（Hz）
+DEFAULT_SAMPLE_RATE = 512.0
+# 1プロセスにまとめて渡すCSVファイル数
+FILES_PER_TASK = 32
+
+# R波検出の窓幅（秒）
+SMOOTHING_SEC = 0.025      # 高周波ノイズを除く移動平均
+BASELINE_SEC = 0.2         # 基線の揺れを除く移動平均
+INTEGRATION_SEC = 0.15     # QRS波のエネルギーを積分する移動平均
+REFRACTORY_SEC = 0.25      # 不応期（これより近い2つのピークは同じ拍動とみなす）
+REFINE_SEC = 0.075         # 積分波形のピークから実際のR波を探す範囲
+# 積分波形のこのパーセンタイルに対する比をピークの閾値にする
+THRESHOLD_PERCENTILE = 98
+THRESHOLD_RATIO = 0.3
+# 有効なRR間隔（ミリ秒）と、記録内の中央値からの許容ずれ（期外収縮・誤検出の除外）
+MIN_RR_MS = 300.0
+MAX_RR_MS = 2000.0
+MAX_RR_DEVIATION = 0.2
+
+ECG_RECORDING_COLUMNS = [
+    'recording_id', 'ecg_file', 'recorded_at', 'utc_offset', 'date', 'classification',
+    'sample_rate', 'duration_sec', 'beat_count', 'heart_rate', 'sdnn', 'rmssd', 'ln_rmssd', 'pnn50',
+]
+ECG_RR_COLUMNS = ['recording_id', 'beat', 'rr_ms', 'valid']
+
+
+def parse_ecg_csv(stream: BinaryIO) -> Tuple[Dict[str, str], np.ndarray]:
+    """
+    心電図のCSVファイルを読み込む
+
+    パラメータ:
+    - stream: CSVファイルのバイナリストリーム
+
+    戻り値:
+    - (ヘッダーのキー（小文字） → 値の辞書, 電位（µV、float64）の配列)
+    """
+    raw = stream.read().replace(b'\r\n', b'\n')
+
+    # 最初に数値として読める行までをヘッダーとする（ヘッダーは空行で区切られた複数のブロックからなる）
+    header = {}
+    position = 0
+    while position < len(raw):
+        end = raw.find(b'\n', position)
+        if end < 0:
+            end = len(raw)
+        line = raw[position:end]
+        if _is_sample(line):
+            break
+        for row in csv.reader([line.decode('utf-8-sig', 'replace')]):
+            if len(row) >= 2 and row[0]:
+                header[row[0].strip().lower()] = row[1].strip()
+        position = end + 1
+    if position >= len(raw):
+        raise ValueError("波形のサンプルがありません")
+
+    text = _decimal_points(raw[position:]).decode('ascii', 'replace')
+    return header, np.fromstring(text, dtype=np.float64, sep=' ')
+
+
+def _decimal_points(data: bytes) -> bytes:
+    """小数点がカンマのロケールの値（引用符で囲まれる）を小数点がピリオドの値にする"""
+    return data.replace(b'"', b'').replace(b',', b'.')
+
+
+def _is_sample(line: bytes) -> bool:
+    """電位のサンプルの行（数値として読める行）かどうか"""
+    try:
+        float(_decimal_points(line).strip())
+    except ValueError:
+        return False
+    return True
+
+
+def _sample_rate(header: Dict[str, str]) -> float:
+    """ヘッダーのサンプリング周波数（'512 hertz'など）"""
+    try:
+        return float(header.get('sample rate', '').split()[0])
+    except (IndexError, ValueError):
+        return DEFAULT_SAMPLE_RATE
+
+
+def _moving_average(x: np.ndarray, width: int) -> np.ndarray:
+    """中心化した移動平均（累積和で計算し、端は窓を縮める）"""
+    width = max(1, int(width))
+    cumulative = np.concatenate([[0.0], np.cumsum(x)])
+    index = np.arange(len(x))
+    lo = np.clip(index - width // 2, 0, len(x))
+    hi = np.clip(index + (width - width // 2), 0, len(x))
+    return (cumulative[hi] - cumulative[lo]) / (hi - lo)
+
+
+def _window_view(x: np.ndarray, half_width: int, fill: float) -> np.ndarray:
+    """各サンプルを中心とする幅2 * half_width + 1の窓のビュー（端はfillで埋める）"""
+    padded = np.pad(x, half_width, constant_values=fill)
+    return sliding_window_view(padded, 2 * half_width + 1)
+
+
+def detect_r_peaks(signal: np.ndarray, sample_rate: float) -> np.ndarray:
+    """
+    心電図の波形からR波の位置を検出
+
+    Pan-Tompkins法と同じく、帯域通過・微分・二乗・移動積分でQRS波を強調し、
+    不応期内で最大となる積分波形のピークを拍動とする。すべてベクトル演算で行う。
+
+    パラメータ:
+    - signal: 電位の配列
+    - sample_rate: サンプリング周波数（Hz）
+
+    戻り値:
+    - R波のサンプル位置（昇順のint64配列）
+    """
+    signal = np.nan_to_num(signal, nan=0.0)
+    if len(signal) < sample_rate:
+        return np.empty(0, dtype=np.int64)
+
+    # 移動平均の差で帯域通過（高周波ノイズと基線の揺れを除く）
+    filtered = (_moving_average(signal, sample_rate * SMOOTHING_SEC)
+                - _moving_average(signal, sample_rate * BASELINE_SEC))
+    energy = np.gradient(filtered) ** 2
+    integrated = _moving_average(energy, sample_rate * INTEGRATION_SEC)
+
+    threshold = THRESHOLD_RATIO * np.percentile(integrated, THRESHOLD_PERCENTILE)
+    if threshold <= 0:
+        return np.empty(0, dtype=np.int64)
+    refractory = int(sample_rate * REFRACTORY_SEC)
+    local_max = _window_view(integrated, refractory, -np.inf).max(axis=1)
+    peaks = np.flatnonzero((integrated == local_max) & (integrated > threshold))
+    if len(peaks) == 0:
+        return peaks.astype(np.int64)
+    # 平坦な頂点で同じ値が続く場合は最初の位置だけを残す
+    peaks = peaks[np.concatenate([[True], np.diff(peaks) > refractory])]
+
+    # 積分波形のピークの近くで振幅が最大の位置をR波とする（極性によらない）
+    refine = int(sample_rate * REFINE_SEC)
+    offsets = _window_view(np.abs(filtered), refine, -np.inf)[peaks].argmax(axis=1) - refine
+    return np.unique(np.clip(peaks + offsets, 0, len(signal) - 1)).astype(np.int64)
+
+
+def rr_intervals(peaks: np.ndarray, sample_rate: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    R波の位置からRR間隔を求め、生理的にありえないものや期外収縮を除外する
+
+    パラメータ:
+    - peaks: R波のサンプル位置
+    - sample_rate: サンプリング周波数（Hz）
+
+    戻り値:
+    - (RR間隔（ミリ秒）の配列, 有効かどうかの配列)
+    """
+    rr_ms = np.diff(peaks) / sample_rate * 1000.0
+    valid = (rr_ms >= MIN_RR_MS) & (rr_ms <= MAX_RR_MS)
+    if valid.any():
+        median = np.median(rr_ms[valid])
+        valid &= np.abs(rr_ms - median) <= MAX_RR_DEVIATION * median
+    return rr_ms, valid
+
+
+def _analyze_members(export_path: str, members: List[str]) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    複数の心電図ファイルを読み込んでR波を検出する（ワーカープロセスで実行）
+
+    親プロセスには波形ではなく、ヘッダーの値とRR間隔だけを返す。
+
+    パラメータ:
+    - export_path: エクスポートのパス（zipはプロセスごとに開き直す）
+    - members: CSVファイルのメンバー名のリスト
+
+    戻り値:
+    - (メンバー名, recorded_date, classification, sample_rate, duration_sec, rr_ms, validの辞書
+      （読み込めない場合はNone）)のリスト
+    """
+    results = []
+    with HealthExport(export_path) as export:
+        for member in members:
+            try:
+                with export.open_member(member) as f:
+                    header, signal = parse_ecg_csv(f)
+            except (OSError, ValueError):
+                results.append((member, None))
+                continue
+            sample_rate = _sample_rate(header)
+            rr_ms, valid = rr_intervals(detect_r_peaks(signal, sample_rate), sample_rate)
+            results.append((member, {
+                'recorded_date': header.get('recorded date'),
+                'classification': header.get('classification') or None,
+                'sample_rate': sample_rate,
+                'duration_sec': len(signal) / sample_rate,
+                'rr_ms': rr_ms,
+                'valid': valid,
+            }))
+    return results
+
+
+def compute_ecg_metrics(recordings: List[Dict]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    全記録のRR間隔を連結した配列に対して、記録ごとの心拍数・SDNN・RMSSD・pNN50をまとめて計算
+
+    パラメータ:
+    - recordings: _analyze_membersが返した辞書のリスト
+
+    戻り値:
+    - (記録ごとの指標のDataFrame, RR間隔のDataFrame)。いずれもrecording_id列にrecordingsのインデックスを持つ
+    """
+    count = len(recordings)
+    lengths = np.array([len(recording['rr_ms']) for recording in recordings], dtype=np.int64)
+    recording_id = np.repeat(np.arange(count), lengths)
+    rr_ms = np.concatenate([recording['rr_ms'] for recording in recordings]) if count else np.empty(0)
+    valid = np.concatenate([recording['valid'] for recording in recordings]) if count else np.empty(0, bool)
+    beat = np.arange(len(rr_ms)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    # 有効なRR間隔の数・平均・標準偏差
+    owners = recording_id[valid]
+    values = rr_ms[valid]
+    beat_count = np.bincount(owners, minlength=count)
+    total = np.bincount(owners, weights=values, minlength=count)
+    total_squared = np.bincount(owners, weights=values * values, minlength=count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_rr = total / beat_count
+        variance = (total_squared - beat_count * mean_rr ** 2) / (beat_count - 1)
+        sdnn = np.where(beat_count > 1, np.sqrt(np.clip(variance, 0.0, None)), np.nan)
+        heart_rate = np.where(beat_count > 0, 60000.0 / mean_rr, np.nan)
+
+    # RMSSD・pNN50は連続する有効なRR間隔の差から求める（HRVレコードの拍動と同じ計算）
+    masked = np.where(valid, rr_ms, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beats = pd.DataFrame({
+            'sample_id': recording_id,
+            'bpm': 60000.0 / masked,
+            'rr_ms': masked,
+        })
+    successive = beat_metrics(beats).reindex(np.arange(count))
+
+    metrics = pd.DataFrame({
+        'recording_id': np.arange(count),
+        'beat_count': beat_count,
+        'heart_rate': heart_rate,
+        'sdnn': sdnn,
+        'rmssd': successive['rmssd'].to_numpy() if 'rmssd' in successive else np.full(count, np.nan),
+        'ln_rmssd': successive['ln_rmssd'].to_numpy() if 'ln_rmssd' in successive else np.full(count, np.nan),
+        'pnn50': successive['pnn50'].to_numpy() if 'pnn50' in successive else np.full(count, np.nan),
+    })
+    rr = pd.DataFrame({'recording_id': recording_id, 'beat': beat, 'rr_ms': rr_ms, 'valid': valid})
+    return metrics, rr
+
+
+class EcgIngester:
+    """
+    エクスポート内の心電図ファイルを並列に読み込み、R波検出とHRV指標の計算を行うクラス
+    """
+
+    ECG_DIRECTORY = 'electrocardiograms'
+
+    def __init__(self, export: HealthExport, workers: Optional[int] = None):
+        """
+        取り込み処理を初期化
+
+        パラメータ:
+        - export: HealthExportオブジェクト
+        - workers: CSVファイルを処理するプロセス数（Noneの場合はCPU数）
+        """
+        self.export = export
+        self.workers = workers or os.cpu_count() or 1
+
+    def load_recordings(self) -> List[Tuple[str, Dict]]:
+        """
+        すべての心電図ファイルを読み込み、R波を検出する
+
+        戻り値:
+        - (メンバー名, _analyze_membersの辞書)のリスト（メンバー名順、読み込めなかったファイルは除く）
+        """
+        members = self.export.list_members(self.ECG_DIRECTORY, '.csv')
+        if not members:
+            return []
+        batches = [members[i:i + FILES_PER_TASK] for i in range(0, len(members), FILES_PER_TASK)]
+
+        results = []
+        if self.workers > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [
+                    executor.submit(_analyze_members, self.export.path, batch)
+                    for batch in batches
+                ]
+                for future in futures:
+                    results.extend(future.result())
+        else:
+            for batch in batches:
+                results.extend(_analyze_members(self.export.path, batch))
+
+        skipped = sum(1 for _, recording in results if recording is None)
+        if skipped:
+            print(f"警告: 読み込めなかった心電図ファイル{skipped}件をスキップしました")
+        return [(member, recording) for member, recording in results if recording is not None]
+
+    def ingest(self) -> Dict[str, pd.DataFrame]:
+        """
+        心電図ファイルを読み込み、記録ごとのHRV指標を計算
+
+        戻り値:
+        - 'ecg_recordings'（記録ごとの指標、date列は記録した現地の日付）と
+          'ecg_rr_intervals'（記録ごとのRR間隔）のDataFrameの辞書
+        """
+        recordings = self.load_recordings()
+        if not recordings:
+            return {
+                'ecg_recordings': pd.DataFrame(columns=ECG_RECORDING_COLUMNS),
+                'ecg_rr_intervals': pd.DataFrame(columns=ECG_RR_COLUMNS),
+            }
+        print(f"心電図: {len(recordings)}件のCSVファイルを解析")
+
+        details = [recording for _, recording in recordings]
+        metrics, rr = compute_ecg_metrics(details)
+
+        decoded = [parse_apple_timestamp(recording['recorded_date']) for recording in details]
+        ns = np.array([value for value, _ in decoded], dtype=np.int64)
+        offsets = np.array([offset for _, offset in decoded], dtype=np.int16)
+        local_days = (ns + offsets.astype(np.int64) * 60 * 10**9) // (24 * 60 * 60 * 10**9)
+        local_date = np.where(
+            ns != NAT_NS, local_days.astype('datetime64[D]'), np.datetime64('NaT', 'D')
+        )
+
+        metrics['ecg_file'] = [PurePosixPath(member.replace(os.sep, '/')).name for member, _ in recordings]
+        metrics['recorded_at'] = to_datetime_index(ns, offsets)
+        metrics['utc_offset'] = offsets
+        metrics['date'] = pd.to_datetime(local_date).date
+        metrics['classification'] = [recording['classification'] for recording in details]
+        metrics['sample_rate'] = [recording['sample_rate'] for recording in details]
+        metrics['duration_sec'] = [recording['duration_sec'] for recording in details]
+
+        print(f"  {int((metrics['beat_count'] > 0).sum())}件の記録からRR間隔を求めました")
+        return {
+            'ecg_recordings': metrics[ECG_RECORDING_COLUMNS],
+            'ecg_rr_intervals': rr[ECG_RR_COLUMNS],
+        }
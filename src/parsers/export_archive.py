@@ -0,0 +1,119 @@
+"""
+Apple Healthエクスポート（export.zip・展開済みディレクトリ）へのアクセス
+"""
+import os
+import zipfile
+from pathlib import PurePosixPath
+from typing import BinaryIO, List, Optional
+
+
+class HealthExport:
+    """
+    Apple Healthのエクスポートを表すクラス
+
+    export.zipは展開せずにメンバーを直接ストリームとして読み込む。
+    展開済みのディレクトリやexport.xmlのパスもそのまま扱える。
+    """
+
+    XML_NAME = 'export.xml'
+
+    def __init__(self, path: str):
+        """
+        エクスポートを開く
+
+        パラメータ:
+        - path: export.zip、エクスポートのディレクトリ、またはexport.xmlのパス
+        """
+        self.path = str(path)
+        self.is_zip = zipfile.is_zipfile(self.path) if os.path.isfile(self.path) else False
+        self._zip: Optional[zipfile.ZipFile] = None
+
+        if self.is_zip:
+            self._zip = zipfile.ZipFile(self.path)
+            self.xml_member = self._find_xml_member()
+            # メンバー名の共通の親（'apple_health_export'など）
+            self.root = str(PurePosixPath(self.xml_member).parent)
+        elif os.path.isdir(self.path):
+            self.root = self.path
+            self.xml_member = os.path.join(self.path, self.XML_NAME)
+        else:
+            self.root = os.path.dirname(self.path)
+            self.xml_member = self.path
+
+    def _find_xml_member(self) -> str:
+        """zip内のexport.xmlのメンバー名を探す（export_cda.xmlなどは除く）"""
+        candidates = [
+            name for name in self._zip.namelist()
+            if PurePosixPath(name).name == self.XML_NAME
+        ]
+        if not candidates:
+            raise FileNotFoundError(f"{self.path} に {self.XML_NAME} が含まれていません")
+        # 最も浅い階層のものを使う
+        return min(candidates, key=lambda name: name.count('/'))
+
+    def xml_size(self) -> int:
+        """export.xmlの（展開後の）バイト数"""
+        if self.is_zip:
+            return self._zip.getinfo(self.xml_member).file_size
+        return os.path.getsize(self.xml_member)
+
+    def open_xml(self) -> BinaryIO:
+        """
+        export.xmlをバイナリストリームとして開く
+
+        戻り値:
+        - 読み込み用のバイナリストリーム（zipの場合は展開しながら読み込む）
+        """
+        return self.open_member(self.xml_member)
+
+    def list_members(self, directory: str, suffix: str = '') -> List[str]:
+        """
+        エクスポート内のサブディレクトリにあるファイルを列挙
+
+        パラメータ:
+        - directory: サブディレクトリ名（'electrocardiograms'、'workout-routes'など）
+        - suffix: 拡張子での絞り込み（'.csv'など）
+
+        戻り値:
+        - open_memberに渡せるメンバー名のリスト（名前順）
+        """
+        if self.is_zip:
+            prefix = f"{self.root}/{directory}/" if self.root not in ('', '.') else f"{directory}/"
+            return sorted(
+                name for name in self._zip.namelist()
+                if name.startswith(prefix) and not name.endswith('/') and name.endswith(suffix)
+            )
+
+        dir_path = os.path.join(self.root, directory)
+        if not os.path.isdir(dir_path):
+            return []
+        return sorted(
+            os.path.join(dir_path, name) for name in os.listdir(dir_path)
+            if name.endswith(suffix)
+        )
+
+    def open_member(self, name: str) -> BinaryIO:
+        """
+        メンバーをバイナリストリームとして開く
+
+        パラメータ:
+        - name: list_membersが返したメンバー名
+
+        戻り値:
+        - 読み込み用のバイナリストリーム
+        """
+        if self.is_zip:
+            return self._zip.open(name)
+        return open(name, 'rb')
+
+    def close(self):
+        """zipファイルを閉じる"""
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
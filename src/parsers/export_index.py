@@ -0,0 +1,282 @@
+"""
+export.xmlのバイト位置の索引（サイドカーファイル）
+
+トップレベル要素を先頭から順に見て、要素名・type属性・開始月が同じ要素が続く範囲（ラン）の
+バイト位置を記録する。索引があれば「2025年3月のHRV」や「すべてのワークアウト」を読む際に、
+該当する範囲だけにシークしてパースできる。
+"""
+import json
+import os
+import re
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# 索引の保存形式を変えたら上げる
+INDEX_VERSION = 1
+# 索引ファイルの拡張子（export.xml → export.xml.index.npz）
+INDEX_SUFFIX = '.index.npz'
+# 索引を作る際に1回に読み込むバイト数
+SCAN_BLOCK_SIZE = 8 * 1024 * 1024
+
+# トップレベル要素の開始タグ（要素名、type属性、startDateの'YYYY-MM'）
+# Apple Healthのエクスポートではトップレベル要素は半角スペース1つでインデントされる
+_TOP_LEVEL_TAG = re.compile(
+    rb'\n <(\w+)(?:[^>]*?\stype="([^"]*)")?(?:[^>]*?\sstartDate="(\d{4}-\d{2}))?'
+)
+_TOP_LEVEL_PREFIX = b'\n <'
+_ROOT_END = b'</HealthData>'
+
+# Record以外でも、ネストしたRecordを含むためデータタイプの範囲と一緒に読む要素
+CORRELATION_TAG = 'Correlation'
+WORKOUT_TAG = 'Workout'
+RECORD_TAG = 'Record'
+
+
+def index_path(xml_path: str) -> str:
+    """export.xmlに対応する索引ファイルのパス"""
+    return xml_path + INDEX_SUFFIX
+
+
+def _month_number(text: Optional[bytes]) -> int:
+    """'YYYY-MM'を年 * 12 + 月 - 1に変換（startDateがない要素は-1）"""
+    if not text:
+        return -1
+    return int(text[:4]) * 12 + int(text[5:7]) - 1
+
+
+def _date_month(day: date) -> int:
+    """日付の月を_month_numberと同じ形に変換"""
+    return day.year * 12 + day.month - 1
+
+
+class ExportIndexBuilder:
+    """
+    export.xmlのバイト列を先頭から受け取り、トップレベル要素のランを記録するクラス
+
+    ストリーミングパースで読んだブロックをそのまま渡せば、パースと同じ1回の読み込みで索引を作れる。
+    """
+
+    def __init__(self):
+        # 読み込み済みのバイト数（_carryの先頭の位置）
+        self._position = 0
+        # ブロック境界にまたがる可能性がある未走査のバイト列
+        self._carry = b''
+        # ランの開始位置・要素名・type属性・開始月・要素数
+        self._starts: List[int] = []
+        self._keys: List[Tuple[str, str, int]] = []
+        self._counts: List[int] = []
+
+    def feed(self, block: bytes):
+        """
+        続きのバイト列を走査
+
+        パラメータ:
+        - block: export.xmlの続きのバイト列
+        """
+        buffer = self._carry + block
+        # 最後のトップレベルのタグより前は、開始タグがすべて読み込み済み
+        cut = buffer.rfind(_TOP_LEVEL_PREFIX)
+        if cut <= 0:
+            self._carry = buffer
+            return
+        self._scan(buffer, cut)
+        self._position += cut
+        self._carry = buffer[cut:]
+
+    def _scan(self, buffer: bytes, limit: int):
+        """buffer[:limit]の範囲にあるトップレベルの開始タグを記録"""
+        starts = self._starts
+        keys = self._keys
+        counts = self._counts
+        last_key = keys[-1] if keys else None
+        for match in _TOP_LEVEL_TAG.finditer(buffer, 0, limit):
+            tag, type_name, month = match.groups()
+            key = (tag.decode('ascii'), (type_name or b'').decode('utf-8', 'replace'), _month_number(month))
+            if key == last_key:
+                counts[-1] += 1
+                continue
+            # '\n 'を除いた'<'の位置から範囲を始める
+            starts.append(self._position + match.start() + 2)
+            keys.append(key)
+            counts.append(1)
+            last_key = key
+
+    def finish(self) -> 'ExportIndex':
+        """
+        残りのバイト列を走査して索引を作成
+
+        戻り値:
+        - ExportIndex
+        """
+        buffer = self._carry
+        self._scan(buffer, len(buffer))
+        root_end = buffer.rfind(_ROOT_END)
+        body_end = self._position + (root_end if root_end >= 0 else len(buffer))
+        self._carry = b''
+        return ExportIndex.from_runs(self._starts, self._keys, self._counts, body_end)
+
+
+class ExportIndex:
+    """
+    トップレベル要素のランのバイト位置の索引
+
+    各ランは[start, end)のバイト範囲で、同じ要素名・type属性・開始月の要素だけを含む。
+    """
+
+    def __init__(self, start: np.ndarray, end: np.ndarray, tag: np.ndarray, type_name: np.ndarray,
+                 month: np.ndarray, count: np.ndarray, source: Optional[Dict] = None):
+        self.start = start
+        self.end = end
+        self.tag = tag
+        self.type_name = type_name
+        self.month = month
+        self.count = count
+        # 索引を作ったexport.xmlのサイズ・更新日時
+        self.source = source or {}
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @classmethod
+    def from_runs(cls, starts: List[int], keys: List[Tuple[str, str, int]], counts: List[int],
+                  body_end: int) -> 'ExportIndex':
+        """ExportIndexBuilderが記録したランから索引を作成"""
+        start = np.array(starts, dtype=np.int64)
+        end = np.append(start[1:], body_end).astype(np.int64)
+        return cls(
+            start=start,
+            end=end,
+            tag=np.array([key[0] for key in keys], dtype=str),
+            type_name=np.array([key[1] for key in keys], dtype=str),
+            month=np.array([key[2] for key in keys], dtype=np.int32),
+            count=np.array(counts, dtype=np.int64),
+        )
+
+    @classmethod
+    def build(cls, xml_path: str) -> 'ExportIndex':
+        """
+        export.xmlを先頭から走査して索引を作成（XMLとしてはパースしない）
+
+        パラメータ:
+        - xml_path: export.xmlのパス
+
+        戻り値:
+        - ExportIndex
+        """
+        builder = ExportIndexBuilder()
+        with open(xml_path, 'rb') as f:
+            while True:
+                block = f.read(SCAN_BLOCK_SIZE)
+                if not block:
+                    break
+                builder.feed(block)
+        index = builder.finish()
+        index.source = _file_signature(xml_path)
+        return index
+
+    @classmethod
+    def load(cls, xml_path: str) -> Optional['ExportIndex']:
+        """
+        export.xmlの索引ファイルを読み込む
+
+        パラメータ:
+        - xml_path: export.xmlのパス
+
+        戻り値:
+        - ExportIndex（索引がない場合や、export.xmlが索引を作った後に変わった場合はNone）
+        """
+        path = index_path(xml_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                source = json.loads(str(arrays['source']))
+                if source.get('version') != INDEX_VERSION or source.get('file') != _file_signature(xml_path):
+                    return None
+                return cls(
+                    start=arrays['start'], end=arrays['end'], tag=arrays['tag'],
+                    type_name=arrays['type_name'], month=arrays['month'], count=arrays['count'],
+                    source=source['file'],
+                )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"警告: 索引ファイルを読み込めないため使いません: {e}")
+            return None
+
+    def save(self, xml_path: str) -> bool:
+        """
+        索引をexport.xmlの隣に保存
+
+        パラメータ:
+        - xml_path: export.xmlのパス
+
+        戻り値:
+        - 保存できた場合はTrue（書き込めないディレクトリの場合はFalse）
+        """
+        source = json.dumps({'version': INDEX_VERSION, 'file': self.source or _file_signature(xml_path)})
+        path = index_path(xml_path)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f, start=self.start, end=self.end, tag=self.tag, type_name=self.type_name,
+                    month=self.month, count=self.count, source=np.array(source),
+                )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"警告: 索引ファイルを保存できませんでした: {e}")
+            return False
+        return True
+
+    def spans(self, type_identifiers: Optional[Iterable[str]] = None, workouts: bool = False,
+              since: Optional[date] = None, until: Optional[date] = None) -> List[Tuple[int, int]]:
+        """
+        条件に合う要素を含むバイト範囲を取得
+
+        ネストしたRecordを含む可能性があるため、Recordを読む場合はCorrelationも含める。
+        開始月で絞り込むため、範囲には期間外の日のレコードも含まれる（日付はパース時に絞り込む）。
+
+        パラメータ:
+        - type_identifiers: 読み込むRecordのHealthKit識別子（Noneの場合はすべてのRecord）
+        - workouts: Workoutを含めるかどうか
+        - since: この日付を含む月より前に始まる要素を除く
+        - until: この日付を含む月より後に始まる要素を除く
+
+        戻り値:
+        - 隣接するものを結合した(開始位置, 終了位置)のリスト（ファイル内の順序どおり）
+        """
+        if type_identifiers is None:
+            selected = (self.tag == RECORD_TAG) | (self.tag == CORRELATION_TAG)
+        else:
+            type_identifiers = list(type_identifiers)
+            selected = (self.tag == RECORD_TAG) & np.isin(self.type_name, type_identifiers)
+            if type_identifiers:
+                selected |= self.tag == CORRELATION_TAG
+        if workouts:
+            selected |= self.tag == WORKOUT_TAG
+        # 開始月のない要素は期間では除かない
+        if since is not None:
+            selected &= (self.month < 0) | (self.month >= _date_month(since))
+        if until is not None:
+            selected &= self.month <= _date_month(until)
+
+        start = self.start[selected]
+        end = self.end[selected]
+        if len(start) == 0:
+            return []
+        # 前の範囲の終了位置から始まる範囲は1つにまとめる
+        new_span = np.concatenate([[True], start[1:] != end[:-1]])
+        span_start = start[new_span]
+        span_end = end[np.append(np.flatnonzero(new_span)[1:] - 1, len(end) - 1)]
+        return list(zip(span_start.tolist(), span_end.tolist()))
+
+    def describe(self) -> str:
+        """索引の概要（ログ表示用）"""
+        return f"{len(self)}個の範囲, {int(self.count.sum())}要素"
+
+
+def _file_signature(xml_path: str) -> Dict:
+    """索引が古くなっていないかを判定するためのサイズ・更新日時"""
+    stat = os.stat(xml_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
@@ -0,0 +1,190 @@
+"""
+Garmin FIT（Flexible and Interoperable Data Transfer）ファイルのデコード
+
+アクティビティ・モニタリングのファイルから、必要なメッセージ・フィールドだけを列として取り出す。
+定義メッセージごとにstruct.Structを組み立て、データメッセージは1回のunpackで読む
+（不要なフィールドはパディングとして読み飛ばす）。
+"""
+import struct
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# FITのタイムスタンプの起点（1989-12-31 00:00:00 UTC）のUNIX時刻（秒）
+FIT_EPOCH_SEC = 631065600
+# すべてのメッセージに共通のタイムスタンプのフィールド番号
+TIMESTAMP_FIELD = 253
+
+# 読み込むメッセージ（グローバルメッセージ番号 → 名前, {フィールド番号: 列名}）
+MESSAGES: Dict[int, Tuple[str, Dict[int, str]]] = {
+    0: ('file_id', {0: 'type', 1: 'manufacturer', 4: 'time_created'}),
+    18: ('session', {
+        TIMESTAMP_FIELD: 'timestamp', 2: 'start_time', 5: 'sport', 7: 'total_elapsed_time',
+        9: 'total_distance', 11: 'total_calories', 16: 'avg_heart_rate', 17: 'max_heart_rate',
+    }),
+    20: ('record', {TIMESTAMP_FIELD: 'timestamp', 3: 'heart_rate'}),
+    34: ('activity', {TIMESTAMP_FIELD: 'timestamp', 5: 'local_timestamp'}),
+    55: ('monitoring', {
+        TIMESTAMP_FIELD: 'timestamp', 26: 'timestamp_16', 27: 'heart_rate', 3: 'cycles',
+        5: 'activity_type', 19: 'active_calories',
+    }),
+    103: ('monitoring_info', {TIMESTAMP_FIELD: 'timestamp', 0: 'local_timestamp'}),
+    211: ('monitoring_hr_data', {TIMESTAMP_FIELD: 'timestamp', 0: 'resting_heart_rate'}),
+}
+
+# 基本型の番号（下位5ビット） → (structの型, 無効値)
+_BASE_TYPES: Dict[int, Tuple[str, Optional[int]]] = {
+    0x00: ('B', 0xFF),                  # enum
+    0x01: ('b', 0x7F),                  # sint8
+    0x02: ('B', 0xFF),                  # uint8
+    0x03: ('h', 0x7FFF),                # sint16
+    0x04: ('H', 0xFFFF),                # uint16
+    0x05: ('i', 0x7FFFFFFF),            # sint32
+    0x06: ('I', 0xFFFFFFFF),            # uint32
+    0x08: ('f', None),                  # float32（無効値はNaNとして読める）
+    0x09: ('d', None),                  # float64
+    0x0A: ('B', 0x00),                  # uint8z
+    0x0B: ('H', 0x0000),                # uint16z
+    0x0C: ('I', 0x00000000),            # uint32z
+    0x0E: ('q', 0x7FFFFFFFFFFFFFFF),    # sint64
+    0x0F: ('Q', 0xFFFFFFFFFFFFFFFF),    # uint64
+    0x10: ('Q', 0x0000000000000000),    # uint64z
+}
+
+
+class _Definition:
+    """定義メッセージ（ローカルメッセージ番号に割り当てられたデータメッセージの形）"""
+
+    __slots__ = ('name', 'layout', 'columns', 'invalid', 'size', 'timestamp_position')
+
+    def __init__(self, name: Optional[str], layout: struct.Struct,
+                 columns: List[str], invalid: List[Optional[int]]):
+        self.name = name
+        self.layout = layout
+        # unpackした値の順番の列名・無効値
+        self.columns = columns
+        self.invalid = invalid
+        self.size = layout.size
+        self.timestamp_position = columns.index('timestamp') if 'timestamp' in columns else None
+
+
+def _read_definition(data: bytes, position: int, has_developer_fields: bool) -> Tuple[_Definition, int]:
+    """定義メッセージを読み込み、(定義, 次の位置)を返す"""
+    architecture = data[position + 1]
+    endian = '>' if architecture == 1 else '<'
+    (global_number,) = struct.unpack_from(endian + 'H', data, position + 2)
+    field_count = data[position + 4]
+    position += 5
+
+    name, wanted = MESSAGES.get(global_number, (None, {}))
+    formats = [endian]
+    columns: List[str] = []
+    invalid: List[Optional[int]] = []
+    for _ in range(field_count):
+        number, size, base_type = data[position], data[position + 1], data[position + 2]
+        position += 3
+        type_code, invalid_value = _BASE_TYPES.get(base_type & 0x1F, (None, None))
+        column = wanted.get(number)
+        if column is not None and type_code is not None and struct.calcsize(type_code) == size:
+            formats.append(type_code)
+            columns.append(column)
+            invalid.append(invalid_value)
+        else:
+            # 不要なフィールド・配列・文字列は読み飛ばす
+            formats.append(f'{size}x')
+    if has_developer_fields:
+        developer_count = data[position]
+        position += 1
+        for _ in range(developer_count):
+            formats.append(f'{data[position + 1]}x')
+            position += 3
+    return _Definition(name, struct.Struct(''.join(formats)), columns, invalid), position
+
+
+def read_fit(data: bytes) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    FITファイルを読み込み、MESSAGESのメッセージをフィールドごとの配列にする
+
+    タイムスタンプはFITの起点からの秒のまま返す（圧縮タイムスタンプ・timestamp_16は補完する）。
+
+    パラメータ:
+    - data: FITファイルの内容（複数のFITファイルを連結したものでもよい）
+
+    戻り値:
+    - メッセージ名 → {列名: float64の配列（無効値・そのメッセージにないフィールドはNaN）}の辞書
+    """
+    rows: Dict[str, Dict[str, List[float]]] = {
+        name: {column: [] for column in fields.values()} for name, fields in MESSAGES.values()
+    }
+    counts = {name: 0 for name, _ in MESSAGES.values()}
+    position = 0
+    while position + 12 <= len(data):
+        header_size = data[position]
+        if data[position + 8:position + 12] != b'.FIT':
+            raise ValueError('FITファイルのヘッダーがありません')
+        (data_size,) = struct.unpack_from('<I', data, position + 4)
+        end = position + header_size + data_size
+        if end > len(data):
+            raise ValueError('FITファイルが途中で終わっています')
+        position = _read_records(data, position + header_size, end, rows, counts)
+        # ファイル末尾のCRC（2バイト）
+        position = end + 2
+
+    result = {}
+    for name, columns in rows.items():
+        count = counts[name]
+        if count:
+            result[name] = {column: np.asarray(values, dtype=np.float64) for column, values in columns.items()}
+    return result
+
+
+def _read_records(data: bytes, position: int, end: int,
+                  rows: Dict[str, Dict[str, List[float]]], counts: Dict[str, int]) -> int:
+    """データレコードをendまで読み込み、rowsに追加する"""
+    definitions: Dict[int, _Definition] = {}
+    last_timestamp = 0
+    nan = float('nan')
+    while position < end:
+        header = data[position]
+        position += 1
+        if header & 0x80:
+            # 圧縮タイムスタンプのヘッダー（下位5ビットが直前のタイムスタンプからの差）
+            local_number = (header >> 5) & 0x03
+            time_offset = header & 0x1F
+            timestamp = (last_timestamp & ~0x1F) + time_offset
+            if time_offset < (last_timestamp & 0x1F):
+                timestamp += 0x20
+        elif header & 0x40:
+            definition, position = _read_definition(data, position, bool(header & 0x20))
+            definitions[header & 0x0F] = definition
+            continue
+        else:
+            local_number = header & 0x0F
+            timestamp = None
+
+        definition = definitions.get(local_number)
+        if definition is None:
+            raise ValueError(f'未定義のローカルメッセージ番号: {local_number}')
+        values = definition.layout.unpack_from(data, position)
+        position += definition.size
+        if definition.name is None:
+            continue
+
+        message = dict(zip(definition.columns, values))
+        for column, invalid in zip(definition.columns, definition.invalid):
+            if invalid is not None and message[column] == invalid:
+                message[column] = nan
+        if definition.timestamp_position is not None and message['timestamp'] == message['timestamp']:
+            last_timestamp = int(message['timestamp'])
+        elif timestamp is not None:
+            message['timestamp'] = timestamp
+            last_timestamp = timestamp
+        elif message.get('timestamp_16', nan) == message.get('timestamp_16', nan):
+            # モニタリングのtimestamp_16は直前のタイムスタンプの下位16ビットの続き
+            last_timestamp += (int(message['timestamp_16']) - (last_timestamp & 0xFFFF)) & 0xFFFF
+            message['timestamp'] = last_timestamp
+
+        columns = rows[definition.name]
+        for column, values_list in columns.items():
+            values_list.append(message.get(column, nan))
+        counts[definition.name] += 1
+    return position
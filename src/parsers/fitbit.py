@@ -0,0 +1,208 @@
+"""
+Fitbitのデータエクスポート（Global Export DataのJSONファイル）の取り込み
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from src.parsers.record_batch import RecordBatch
+from src.parsers.record_collector import RecordCollector
+from src.parsers.record_filter import RecordFilter
+from src.parsers.timestamps import NAT_NS
+from src.parsers.type_registry import HealthTypeRegistry
+from src.parsers.wearable_import import (
+    OTHER_WORKOUT_TYPE, WearableImporter, localize, workout_events, zone_offsets_at,
+)
+
+_NS_PER_SEC = 1_000_000_000
+_NS_PER_MINUTE = 60 * _NS_PER_SEC
+
+# 'MM/DD/YY HH:MM:SS'形式の日時（heart_rateはUTC、それ以外は現地時刻）
+DATE_TIME_FORMAT = '%m/%d/%y %H:%M:%S'
+# タイムゾーンを書いたプロフィールのファイル名
+PROFILE_FILE_NAME = 'profile.csv'
+
+# 睡眠ログのlevel → 睡眠ステージ名（stagesとclassicの両方の形式）
+SLEEP_LEVELS = {
+    'deep': 'deep',
+    'light': 'light',
+    'rem': 'rem',
+    'wake': 'awake',
+    'awake': 'awake',
+    'restless': 'awake',
+    'asleep': 'unspecified',
+}
+# 運動ログのactivityName → HealthKitのワークアウト識別子
+ACTIVITY_TYPES = {
+    'Run': 'HKWorkoutActivityTypeRunning',
+    'Treadmill': 'HKWorkoutActivityTypeRunning',
+    'Walk': 'HKWorkoutActivityTypeWalking',
+    'Hike': 'HKWorkoutActivityTypeHiking',
+    'Bike': 'HKWorkoutActivityTypeCycling',
+    'Outdoor Bike': 'HKWorkoutActivityTypeCycling',
+    'Swim': 'HKWorkoutActivityTypeSwimming',
+    'Elliptical': 'HKWorkoutActivityTypeElliptical',
+    'Weights': 'HKWorkoutActivityTypeTraditionalStrengthTraining',
+    'Yoga': 'HKWorkoutActivityTypeYoga',
+}
+# 運動ログの距離の単位 → kmへの係数
+DISTANCE_UNITS = {'Kilometer': 1.0, 'Mile': 1.609344}
+
+
+def _parse_times(texts: List[str], time_format: str = DATE_TIME_FORMAT) -> np.ndarray:
+    """日時文字列の配列をタイムゾーンなしのナノ秒にする（不正な値はNAT_NS）"""
+    index = pd.to_datetime(pd.Series(texts, dtype=object), format=time_format, errors='coerce')
+    return index.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+class FitbitImporter(WearableImporter):
+    """
+    Fitbitのデータエクスポートを読み込むインポーター
+
+    Global Export Dataのheart_rate・steps・resting_heart_rate・sleep・exercise-*.jsonを読み込む。
+    心拍数はUTC、それ以外は現地時刻で書かれているため、プロフィール（Profile.csv）のタイムゾーンで
+    UTCに揃える。
+    """
+
+    SOURCE_NAME = 'Fitbit'
+    FILE_SUFFIXES = ('.json',)
+    # 読み込むファイル名の接頭辞
+    FILE_PREFIXES = ('heart_rate-', 'steps-', 'resting_heart_rate-', 'sleep-', 'exercise-')
+
+    def __init__(self, path: str, registry: Optional[HealthTypeRegistry] = None,
+                 record_filter: Optional[RecordFilter] = None, workers: Optional[int] = None,
+                 time_zone: Optional[str] = None):
+        """
+        インポーターを初期化
+
+        パラメータ:
+        - path: エクスポートのディレクトリまたはzip
+        - registry: 収集するデータタイプの登録簿
+        - record_filter: 期間・データタイプ・ソースの絞り込み条件
+        - workers: ファイルを読み込むプロセス数
+        - time_zone: 現地時刻のタイムゾーン（Noneの場合はProfile.csvのもの、それもなければUTC）
+        """
+        super().__init__(path, registry, record_filter, workers)
+        self.time_zone = time_zone or self._profile_time_zone()
+
+    def _profile_time_zone(self) -> Optional[str]:
+        """Profile.csvのtimezone列（見つからない場合はNone）"""
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as archive:
+                for name in archive.namelist():
+                    if PurePosixPath(name).name.lower() == PROFILE_FILE_NAME:
+                        return self._read_profile(archive.read(name))
+        elif os.path.isdir(self.path):
+            for path in Path(self.path).rglob('*'):
+                if path.name.lower() == PROFILE_FILE_NAME:
+                    return self._read_profile(path.read_bytes())
+        return None
+
+    @staticmethod
+    def _read_profile(data: bytes) -> Optional[str]:
+        for row in csv.DictReader(io.StringIO(data.decode('utf-8-sig'))):
+            return row.get('timezone') or None
+        return None
+
+    def accepts_file(self, name: str) -> bool:
+        file_name = PurePosixPath(name.replace('\\', '/')).name
+        return super().accepts_file(name) and file_name.startswith(self.FILE_PREFIXES)
+
+    def read_file(self, name: str, stream: BinaryIO, collector: RecordCollector):
+        """
+        1つのJSONファイルを読み込み、レコードとワークアウトをコレクターに渡す
+
+        パラメータ:
+        - name: ファイルのパスまたはメンバー名
+        - stream: ファイルのバイナリストリーム
+        - collector: RecordCollector
+        """
+        entries = json.load(stream)
+        if not entries:
+            return
+        file_name = PurePosixPath(name.replace('\\', '/')).name
+        if file_name.startswith('heart_rate-'):
+            self._read_heart_rate(entries, collector)
+        elif file_name.startswith('steps-'):
+            self._read_steps(entries, collector)
+        elif file_name.startswith('resting_heart_rate-'):
+            self._read_resting_heart_rate(entries, collector)
+        elif file_name.startswith('sleep-'):
+            self._read_sleep(entries, collector)
+        elif file_name.startswith('exercise-'):
+            self._read_exercise(entries, collector)
+
+    def _read_heart_rate(self, entries: List[Dict], collector: RecordCollector):
+        """heart_rate-*.json（UTCの時点ごとの心拍数）"""
+        ns = _parse_times([entry.get('dateTime') for entry in entries])
+        bpm = np.array([(entry.get('value') or {}).get('bpm', np.nan) for entry in entries], dtype=np.float64)
+        valid = (ns != NAT_NS) & ~np.isnan(bpm)
+        ns = ns[valid]
+        collector.add_batch(RecordBatch(
+            'heart_rate', self.SOURCE_NAME, 'count/min', bpm[valid], ns, ns,
+            zone_offsets_at(ns, self.time_zone), time_zone=self.time_zone or '',
+        ))
+
+    def _read_steps(self, entries: List[Dict], collector: RecordCollector):
+        """steps-*.json（現地時刻の1分ごとの歩数。0の分は読み飛ばす）"""
+        local_ns = _parse_times([entry.get('dateTime') for entry in entries])
+        steps = pd.to_numeric(pd.Series([entry.get('value') for entry in entries]), errors='coerce').to_numpy()
+        valid = (local_ns != NAT_NS) & (steps > 0)
+        ns, offsets = localize(local_ns[valid], self.time_zone)
+        collector.add_batch(RecordBatch(
+            'steps', self.SOURCE_NAME, 'count', steps[valid], ns, ns + _NS_PER_MINUTE, offsets,
+            time_zone=self.time_zone or '',
+        ))
+
+    def _read_resting_heart_rate(self, entries: List[Dict], collector: RecordCollector):
+        """resting_heart_rate-*.json（現地の日付ごとの安静時心拍数）"""
+        values = [entry.get('value') or {} for entry in entries]
+        local_ns = _parse_times([value.get('date') for value in values], '%m/%d/%y')
+        rate = np.array([value.get('value') or np.nan for value in values], dtype=np.float64)
+        valid = (local_ns != NAT_NS) & (rate > 0)
+        ns, offsets = localize(local_ns[valid], self.time_zone)
+        collector.add_batch(RecordBatch(
+            'resting_heart_rate', self.SOURCE_NAME, 'count/min', rate[valid], ns, ns, offsets,
+            time_zone=self.time_zone or '',
+        ))
+
+    def _read_sleep(self, entries: List[Dict], collector: RecordCollector):
+        """sleep-*.json（睡眠ログごとの現地時刻のステージの区間）"""
+        levels = [item for entry in entries for item in ((entry.get('levels') or {}).get('data') or [])]
+        if not levels:
+            return
+        local_ns = _parse_times([item.get('dateTime') for item in levels], 'ISO8601')
+        seconds = np.array([item.get('seconds') or 0 for item in levels], dtype=np.int64)
+        stage = np.array([SLEEP_LEVELS.get(item.get('level'), 'unknown') for item in levels], dtype=object)
+        valid = local_ns != NAT_NS
+        ns, offsets = localize(local_ns[valid], self.time_zone)
+        collector.add_batch(RecordBatch(
+            'sleep', self.SOURCE_NAME, '', np.full(int(valid.sum()), np.nan),
+            ns, ns + seconds[valid] * _NS_PER_SEC, offsets, stage=stage[valid],
+            time_zone=self.time_zone or '',
+        ))
+
+    def _read_exercise(self, entries: List[Dict], collector: RecordCollector):
+        """exercise-*.json（運動ログ。ワークアウトにする）"""
+        local_ns = _parse_times([entry.get('startTime') for entry in entries])
+        ns, offsets = localize(local_ns, self.time_zone)
+        for entry, start_ns, offset in zip(entries, ns.tolist(), offsets.tolist()):
+            duration_ms = entry.get('duration') or entry.get('activeDuration')
+            if start_ns == NAT_NS or not duration_ms:
+                continue
+            distance = entry.get('distance')
+            factor = DISTANCE_UNITS.get(entry.get('distanceUnit'), np.nan)
+            workout_events(
+                collector,
+                ACTIVITY_TYPES.get(entry.get('activityName'), OTHER_WORKOUT_TYPE),
+                self.SOURCE_NAME, start_ns, start_ns + int(duration_ms) * 1_000_000, offset,
+                energy_kcal=float(entry['calories']) if entry.get('calories') is not None else np.nan,
+                distance_km=float(distance) * factor if distance is not None else np.nan,
+                average_heart_rate=float(entry.get('averageHeartRate') or np.nan),
+                time_zone=self.time_zone or '',
+            )
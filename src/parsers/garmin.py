@@ -0,0 +1,165 @@
+"""
+Garmin Connectのエクスポート（アクティビティ・モニタリングの.fitファイル）の取り込み
+"""
+from typing import BinaryIO, Dict, Optional
+import numpy as np
+from src.parsers.fit_file import FIT_EPOCH_SEC, read_fit
+from src.parsers.record_batch import RecordBatch
+from src.parsers.record_collector import RecordCollector
+from src.parsers.wearable_import import OTHER_WORKOUT_TYPE, WearableImporter, workout_events
+
+_NS_PER_SEC = 1_000_000_000
+
+# FITのsport → HealthKitのワークアウト識別子
+SPORT_TYPES = {
+    1: 'HKWorkoutActivityTypeRunning',
+    2: 'HKWorkoutActivityTypeCycling',
+    4: 'HKWorkoutActivityTypeElliptical',       # fitness_equipment
+    5: 'HKWorkoutActivityTypeSwimming',
+    10: 'HKWorkoutActivityTypeTraditionalStrengthTraining',  # training
+    11: 'HKWorkoutActivityTypeWalking',
+    17: 'HKWorkoutActivityTypeHiking',
+}
+# モニタリングのactivity_typeのうち、cyclesが歩数になるもの（running, walking）
+STEP_ACTIVITY_TYPES = (1, 6)
+
+
+def _to_ns(fit_seconds: np.ndarray) -> np.ndarray:
+    """FITのタイムスタンプ（起点からの秒）をUTCエポックナノ秒にする"""
+    return ((fit_seconds + FIT_EPOCH_SEC) * _NS_PER_SEC).astype(np.int64)
+
+
+def _utc_offset(messages: Dict[str, Dict[str, np.ndarray]]) -> int:
+    """
+    ファイルのUTCオフセット（分）
+
+    activity・monitoring_infoメッセージのlocal_timestamp（現地時刻）とtimestampの差を15分単位に丸める。
+    どちらもない場合は0（UTC）。
+    """
+    for name in ('activity', 'monitoring_info'):
+        message = messages.get(name)
+        if message is None:
+            continue
+        difference = message['local_timestamp'] - message['timestamp']
+        difference = difference[~np.isnan(difference)]
+        if len(difference):
+            return int(round(difference[0] / 900.0)) * 15
+    return 0
+
+
+def _increments(timestamps: np.ndarray, totals: np.ndarray, groups: np.ndarray):
+    """
+    モニタリングの累積値（1日の始めからの合計）を、直前のサンプルからの増分にする
+
+    パラメータ:
+    - timestamps: サンプルのタイムスタンプ（秒）
+    - totals: 累積値
+    - groups: 累積値を数える単位（activity_type）
+
+    戻り値:
+    - (増分, 区間の開始のタイムスタンプ)。累積値が減った（日が変わってリセットされた）サンプルは累積値そのもの
+    """
+    order = np.lexsort((timestamps, groups))
+    timestamps, totals, groups = timestamps[order], totals[order], groups[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = groups[1:] != groups[:-1]
+    previous_total = np.concatenate(([0.0], totals[:-1]))
+    previous_time = np.concatenate((timestamps[:1], timestamps[:-1]))
+    increment = totals - previous_total
+    reset = first | (increment < 0)
+    increment = np.where(reset, totals, increment)
+    start = np.where(reset, timestamps, previous_time)
+    # 元のサンプルの順番に戻す
+    result_increment = np.empty_like(increment)
+    result_start = np.empty_like(start)
+    result_increment[order] = increment
+    result_start[order] = start
+    return result_increment, result_start
+
+
+class GarminImporter(WearableImporter):
+    """
+    Garmin Connectのエクスポートの.fitファイルを読み込むインポーター
+
+    - アクティビティファイル: sessionをワークアウト、recordの心拍数をheart_rateにする
+    - モニタリングファイル: 心拍数・歩数・アクティブエネルギー・安静時心拍数を読み込む
+      （歩数・アクティブエネルギーは1日の始めからの累積値のため、サンプル間の増分にする）
+    """
+
+    SOURCE_NAME = 'Garmin'
+    FILE_SUFFIXES = ('.fit',)
+
+    def read_file(self, name: str, stream: BinaryIO, collector: RecordCollector):
+        """
+        1つの.fitファイルを読み込み、レコードとワークアウトをコレクターに渡す
+
+        パラメータ:
+        - name: ファイルのパスまたはメンバー名
+        - stream: ファイルのバイナリストリーム
+        - collector: RecordCollector
+        """
+        messages = read_fit(stream.read())
+        offset = _utc_offset(messages)
+
+        record = messages.get('record')
+        if record is not None:
+            self._add_samples(collector, 'heart_rate', 'count/min',
+                              record['timestamp'], record['heart_rate'], offset)
+
+        monitoring = messages.get('monitoring')
+        if monitoring is not None:
+            self._add_monitoring(collector, monitoring, offset)
+
+        hr_data = messages.get('monitoring_hr_data')
+        if hr_data is not None:
+            self._add_samples(collector, 'resting_heart_rate', 'count/min',
+                              hr_data['timestamp'], hr_data['resting_heart_rate'], offset)
+
+        session = messages.get('session')
+        if session is not None:
+            for row in range(len(session['start_time'])):
+                start = session['start_time'][row]
+                elapsed = session['total_elapsed_time'][row]
+                if np.isnan(start) or np.isnan(elapsed):
+                    continue
+                start_ns = int((start + FIT_EPOCH_SEC) * _NS_PER_SEC)
+                sport = session['sport'][row]
+                workout_events(
+                    collector,
+                    SPORT_TYPES.get(int(sport), OTHER_WORKOUT_TYPE) if not np.isnan(sport) else OTHER_WORKOUT_TYPE,
+                    self.SOURCE_NAME, start_ns, start_ns + int(elapsed / 1000.0 * _NS_PER_SEC), offset,
+                    energy_kcal=session['total_calories'][row],
+                    # total_distanceは1/100メートル単位
+                    distance_km=session['total_distance'][row] / 100000.0,
+                    average_heart_rate=session['avg_heart_rate'][row],
+                    maximum_heart_rate=session['max_heart_rate'][row],
+                )
+
+    def _add_samples(self, collector: RecordCollector, data_type: str, unit: str,
+                     timestamps: np.ndarray, values: np.ndarray, offset: int,
+                     starts: Optional[np.ndarray] = None):
+        """時点の測定値（またはstartsからtimestampsまでの区間の値）をRecordBatchにして追加"""
+        valid = ~np.isnan(timestamps) & ~np.isnan(values) & (values > 0)
+        if not valid.any():
+            return
+        end_ns = _to_ns(timestamps[valid])
+        start_ns = _to_ns(starts[valid]) if starts is not None else end_ns
+        collector.add_batch(RecordBatch(
+            data_type, self.SOURCE_NAME, unit, values[valid], start_ns, end_ns, offset,
+        ))
+
+    def _add_monitoring(self, collector: RecordCollector, monitoring: Dict[str, np.ndarray], offset: int):
+        """モニタリングの心拍数・歩数・アクティブエネルギーを追加"""
+        timestamps = monitoring['timestamp']
+        self._add_samples(collector, 'heart_rate', 'count/min', timestamps, monitoring['heart_rate'], offset)
+
+        activity_type = np.nan_to_num(monitoring['activity_type'], nan=-1.0)
+        for data_type, unit, column, mask in (
+            ('steps', 'count', 'cycles', np.isin(activity_type, STEP_ACTIVITY_TYPES)),
+            ('active_energy', 'kcal', 'active_calories', np.ones(len(timestamps), dtype=bool)),
+        ):
+            rows = mask & ~np.isnan(monitoring[column]) & ~np.isnan(timestamps)
+            if not rows.any():
+                continue
+            increment, start = _increments(timestamps[rows], monitoring[column][rows], activity_type[rows])
+            self._add_samples(collector, data_type, unit, timestamps[rows], increment, offset, starts=start)
@@ -0,0 +1,79 @@
+"""
+HRVレコードに含まれる拍動ごとの瞬間心拍数を型付きの列バッファに蓄積する処理
+
+HRV（SDNN）のRecordは、計測中の各拍動の瞬間心拍数を次の形で子要素に持つ。
+
+    <HeartRateVariabilityMetadataList>
+     <InstantaneousBeatsPerMinute bpm="62" time="10:23:45.12 PM"/>
+     ...
+    </HeartRateVariabilityMetadataList>
+"""
+from array import array
+from typing import Optional
+import numpy as np
+import pandas as pd
+from src.parsers.columnar import _to_float
+
+# 拍動の要素名
+BEAT_ELEMENT = 'InstantaneousBeatsPerMinute'
+# to_dataframes()でのテーブル名
+HRV_BEATS_TABLE = 'hrv_beats'
+
+
+class HeartbeatSeries:
+    """
+    拍動ごとの瞬間心拍数をsample_id（hrvのDataFrameの行番号）とともに蓄積するバッファ
+
+    time属性は端末のロケールに依存した時刻の文字列のため保持せず、
+    RR間隔は瞬間心拍数から求める（60000 / bpm）。
+    """
+
+    def __init__(self):
+        self.sample_id = array('i')
+        self.bpm = array('d')
+
+    def __len__(self) -> int:
+        return len(self.sample_id)
+
+    def append(self, sample_id: int, bpm: Optional[str]):
+        """
+        拍動を1件追加
+
+        パラメータ:
+        - sample_id: 親のHRVレコードの行番号
+        - bpm: 瞬間心拍数の文字列（数値に変換できない場合はNaN）
+        """
+        self.sample_id.append(sample_id)
+        self.bpm.append(_to_float(bpm))
+
+    def extend(self, other: 'HeartbeatSeries', offset: int):
+        """
+        別のバッファの拍動を末尾に追加（sample_idは通し番号に付け替える）
+
+        パラメータ:
+        - other: 追加するHeartbeatSeries
+        - offset: otherのsample_idに足す値（追加前のHRVレコード数）
+        """
+        if len(other) == 0:
+            return
+        ids = np.frombuffer(other.sample_id, dtype=np.int32) + offset
+        self.sample_id.frombytes(ids.astype(np.int32).tobytes())
+        self.bpm.extend(other.bpm)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        バッファをDataFrameに変換
+
+        戻り値:
+        - sample_id, bpm, rr_ms列のDataFrame（拍動の順序はファイル内の順序）
+        """
+        if len(self) == 0:
+            return pd.DataFrame()
+        bpm = np.frombuffer(self.bpm, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rr_ms = np.where(bpm > 0, 60000.0 / bpm, np.nan)
+        return pd.DataFrame({
+            'sample_id': np.frombuffer(self.sample_id, dtype=np.int32),
+            'bpm': bpm,
+            'rr_ms': rr_ms,
+        }, copy=False)
@@ -0,0 +1,147 @@
+"""
+Oura Ringのデータエクスポート（JSON）の取り込み
+"""
+import json
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional, Tuple
+import numpy as np
+from src.parsers.record_batch import RecordBatch
+from src.parsers.record_collector import RecordCollector
+from src.parsers.timestamps import NAT_NS
+from src.parsers.wearable_import import WearableImporter
+
+_NS_PER_SEC = 1_000_000_000
+_NS_PER_DAY = 86400 * _NS_PER_SEC
+
+# ヒプノグラム（5分ごとの睡眠ステージの文字列）の1文字の長さ
+HYPNOGRAM_INTERVAL_SEC = 300
+# ヒプノグラムの文字 → 睡眠ステージ名
+HYPNOGRAM_STAGES = {'1': 'deep', '2': 'light', '3': 'rem', '4': 'awake'}
+
+
+def _parse_time(text: Optional[str]) -> Tuple[int, int]:
+    """
+    ISO 8601形式の日時（'2024-03-01T23:12:45+09:00'）をデコード
+
+    戻り値:
+    - (UTCエポックからのナノ秒, UTCオフセット（分）)。欠損・不正な値は(NAT_NS, 0)
+    """
+    if not text:
+        return NAT_NS, 0
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        return NAT_NS, 0
+    offset = moment.utcoffset()
+    if offset is None:
+        return NAT_NS, 0
+    return int(moment.timestamp()) * _NS_PER_SEC, int(offset.total_seconds()) // 60
+
+
+def _series(entry: Dict, key_v1: str, key_v2: str, start_ns: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    睡眠中の一定間隔の測定値（v1はbedtime_startからの5分ごとのリスト、v2はinterval・items・timestampの辞書）
+
+    戻り値:
+    - (各測定値のUTCエポックナノ秒, 値（0・欠損はNaN）)
+    """
+    interval = HYPNOGRAM_INTERVAL_SEC
+    items = entry.get(key_v1)
+    if items is None and isinstance(entry.get(key_v2), dict):
+        series = entry[key_v2]
+        items = series.get('items')
+        interval = series.get('interval') or interval
+        start_ns, _ = _parse_time(series.get('timestamp'))
+    if not items or start_ns == NAT_NS:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    values = np.array([np.nan if item is None else item for item in items], dtype=np.float64)
+    values[values <= 0] = np.nan
+    ns = start_ns + np.arange(len(values), dtype=np.int64) * int(interval * _NS_PER_SEC)
+    return ns, values
+
+
+class OuraImporter(WearableImporter):
+    """
+    Oura Ringのデータエクスポートを読み込むインポーター
+
+    アカウントのデータエクスポート（v1: sleep・activity、v2: sleep・daily_activity）のJSONから、
+    睡眠ステージ（5分ごとのヒプノグラム）・睡眠中の心拍数・最低心拍数（安静時心拍数）・
+    1日の歩数・アクティブエネルギーを読み込む。
+    """
+
+    SOURCE_NAME = 'Oura'
+    FILE_SUFFIXES = ('.json',)
+
+    def read_file(self, name: str, stream: BinaryIO, collector: RecordCollector):
+        """
+        1つのJSONファイルを読み込み、レコードをコレクターに渡す
+
+        パラメータ:
+        - name: ファイルのパスまたはメンバー名
+        - stream: ファイルのバイナリストリーム
+        - collector: RecordCollector
+        """
+        export = json.load(stream)
+        if not isinstance(export, dict):
+            return
+        for entry in export.get('sleep') or []:
+            self._read_sleep(entry, collector)
+        self._read_activity(export.get('activity') or export.get('daily_activity') or [], collector)
+
+    def _read_sleep(self, entry: Dict, collector: RecordCollector):
+        """1回の睡眠のステージ・心拍数・最低心拍数"""
+        start_ns, offset = _parse_time(entry.get('bedtime_start'))
+        end_ns, _ = _parse_time(entry.get('bedtime_end'))
+        if start_ns == NAT_NS:
+            return
+
+        hypnogram = entry.get('hypnogram_5min') or entry.get('sleep_phase_5_min') or ''
+        if hypnogram:
+            # 同じ文字が続く区間を1つのステージのレコードにまとめる
+            codes = np.frombuffer(hypnogram.encode('ascii', 'replace'), dtype=np.uint8)
+            boundaries = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1, [len(codes)]))
+            step = HYPNOGRAM_INTERVAL_SEC * _NS_PER_SEC
+            stage = np.array([HYPNOGRAM_STAGES.get(chr(code), 'unknown') for code in codes[boundaries[:-1]]],
+                             dtype=object)
+            collector.add_batch(RecordBatch(
+                'sleep', self.SOURCE_NAME, '', np.full(len(stage), np.nan),
+                start_ns + boundaries[:-1] * step, start_ns + boundaries[1:] * step, offset, stage=stage,
+            ))
+
+        ns, bpm = _series(entry, 'hr_5min', 'heart_rate', start_ns)
+        valid = ~np.isnan(bpm)
+        if valid.any():
+            collector.add_batch(RecordBatch(
+                'heart_rate', self.SOURCE_NAME, 'count/min', bpm[valid], ns[valid], ns[valid], offset,
+            ))
+
+        lowest = entry.get('hr_lowest') or entry.get('lowest_heart_rate')
+        if lowest and end_ns != NAT_NS:
+            # 起床した日の安静時心拍数として扱う
+            collector.add_batch(RecordBatch(
+                'resting_heart_rate', self.SOURCE_NAME, 'count/min', [float(lowest)], [end_ns], [end_ns], offset,
+            ))
+
+    def _read_activity(self, entries: List[Dict], collector: RecordCollector):
+        """1日ごとの歩数・アクティブエネルギー（1日の始めから終わりまでの1件のレコード）"""
+        days: List[Tuple[int, int, int]] = []
+        steps: List[float] = []
+        calories: List[float] = []
+        for entry in entries:
+            start_ns, offset = _parse_time(entry.get('day_start') or entry.get('timestamp'))
+            if start_ns == NAT_NS:
+                continue
+            end_ns, _ = _parse_time(entry.get('day_end'))
+            days.append((start_ns, end_ns if end_ns != NAT_NS else start_ns + _NS_PER_DAY, offset))
+            steps.append(entry.get('steps') or np.nan)
+            calories.append(entry.get('cal_active', entry.get('active_calories')) or np.nan)
+        if not days:
+            return
+        start_ns, end_ns, offsets = (np.array(column) for column in zip(*days))
+        for data_type, unit, values in (('steps', 'count', steps), ('active_energy', 'kcal', calories)):
+            values = np.array(values, dtype=np.float64)
+            valid = ~np.isnan(values)
+            collector.add_batch(RecordBatch(
+                data_type, self.SOURCE_NAME, unit, values[valid],
+                start_ns[valid], end_ns[valid], offsets[valid],
+            ))
@@ -0,0 +1,165 @@
+"""
+export.xmlをバイト範囲に分割して複数プロセスで並列パースする処理
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from src.parsers.record_collector import RecordCollector
+from src.parsers.xml_stream import stream_into
+
+# トップレベルのRecord/Workoutの開始位置
+# （Apple Healthのエクスポートではトップレベル要素は半角スペース1つでインデントされ、
+# Correlation配下などのネストした要素はそれより深くインデントされる）
+_TOP_LEVEL_ELEMENT = re.compile(rb'\n <(?:Record|Workout)[\s/>]')
+_ROOT_START = b'<HealthData'
+_ROOT_END = b'</HealthData>'
+_SCAN_BLOCK_SIZE = 1024 * 1024
+
+
+def _find_body_range(f, file_size: int) -> Tuple[int, int]:
+    """
+    ルート要素の開始タグ直後から終了タグ直前までのバイト範囲を取得
+
+    パラメータ:
+    - f: バイナリモードで開いたファイル
+    - file_size: ファイルサイズ
+
+    戻り値:
+    - (本体の開始位置, 本体の終了位置)
+    """
+    f.seek(0)
+    head = b''
+    while _ROOT_START not in head:
+        block = f.read(_SCAN_BLOCK_SIZE)
+        if not block:
+            raise ValueError("HealthData要素が見つかりません")
+        head += block
+    root_start = head.index(_ROOT_START)
+    while head.find(b'>', root_start) < 0:
+        block = f.read(_SCAN_BLOCK_SIZE)
+        if not block:
+            raise ValueError("HealthData要素の開始タグが不正です")
+        head += block
+    body_start = head.index(b'>', root_start) + 1
+
+    tail_start = max(body_start, file_size - _SCAN_BLOCK_SIZE)
+    f.seek(tail_start)
+    tail = f.read()
+    root_end = tail.rfind(_ROOT_END)
+    if root_end < 0:
+        raise ValueError("HealthData要素の終了タグが見つかりません")
+    return body_start, tail_start + root_end
+
+
+def _next_element_start(f, position: int, limit: int) -> int:
+    """
+    指定位置以降で最初のトップレベルRecord/Workoutの開始位置を探す
+
+    パラメータ:
+    - f: バイナリモードで開いたファイル
+    - position: 探索開始位置
+    - limit: 探索終了位置
+
+    戻り値:
+    - 要素の'<'の位置（見つからない場合はlimit）
+    """
+    # 探索開始位置が改行の直後だった場合にも一致させるため1バイト戻る
+    position = max(0, position - 1)
+    carry = b''
+    while position < limit:
+        f.seek(position)
+        block = carry + f.read(min(_SCAN_BLOCK_SIZE, limit - position))
+        match = _TOP_LEVEL_ELEMENT.search(block)
+        if match:
+            return position - len(carry) + match.start() + 2
+        position += len(block) - len(carry)
+        # ブロック境界にまたがるパターンに備えて末尾を持ち越す
+        carry = block[-16:]
+    return limit
+
+
+def find_chunk_boundaries(xml_path: str, chunk_count: int) -> List[Tuple[int, int]]:
+    """
+    export.xmlの本体をトップレベル要素の境界に揃えたバイト範囲に分割
+
+    パラメータ:
+    - xml_path: XMLファイルのパス
+    - chunk_count: 分割数の目安
+
+    戻り値:
+    - (開始位置, 終了位置)のリスト（ファイル内の順序どおり）
+    """
+    file_size = os.path.getsize(xml_path)
+    with open(xml_path, 'rb') as f:
+        body_start, body_end = _find_body_range(f, file_size)
+        step = max(1, (body_end - body_start) // max(1, chunk_count))
+
+        boundaries = [body_start]
+        for i in range(1, chunk_count):
+            target = max(body_start + i * step, boundaries[-1] + 1)
+            if target >= body_end:
+                break
+            boundary = _next_element_start(f, target, body_end)
+            if boundary >= body_end:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+        boundaries.append(body_end)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_byte_range(xml_path: str, start: int, end: int,
+                     collector_args: tuple, backend: Optional[str] = None) -> RecordCollector:
+    """
+    バイト範囲をルート要素で包んでパースする（ワーカープロセスで実行）
+
+    パラメータ:
+    - xml_path: XMLファイルのパス
+    - start: 範囲の開始位置
+    - end: 範囲の終了位置
+    - collector_args: RecordCollectorの初期化引数
+    - backend: XMLバックエンド名
+
+    戻り値:
+    - 範囲内のレコードを収集したRecordCollector
+    """
+    collector = RecordCollector(*collector_args)
+    with open(xml_path, 'rb') as f:
+        f.seek(start)
+        stream_into(collector, f, prefix=b'<HealthData>', suffix=_ROOT_END, limit=end - start,
+                    backend=backend)
+    # デコードはワーカー側で済ませ、親プロセスには数値の列だけを返す
+    collector.flush()
+    return collector
+
+
+def parse_parallel(xml_path: str, collector_args: tuple, workers: int,
+                   chunks_per_worker: int = 4, backend: Optional[str] = None) -> RecordCollector:
+    """
+    export.xmlをプロセスプールで並列パースし、結果をファイル内の順序どおりに結合
+
+    パラメータ:
+    - xml_path: XMLファイルのパス
+    - collector_args: RecordCollectorの初期化引数
+    - workers: ワーカープロセス数
+    - chunks_per_worker: ワーカーあたりの分割数（負荷の偏りを減らすため複数に分ける）
+    - backend: XMLバックエンド名
+
+    戻り値:
+    - すべてのレコードを収集したRecordCollector
+    """
+    ranges = find_chunk_boundaries(xml_path, workers * chunks_per_worker)
+    print(f"  {len(ranges)}個の範囲に分割し、{workers}プロセスでパース")
+
+    collector = RecordCollector(*collector_args)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(parse_byte_range, xml_path, start, end, collector_args, backend)
+            for start, end in ranges
+        ]
+        # 結果は提出順（ファイル内の順序）に結合する
+        for future in futures:
+            collector.merge(future.result())
+    return collector
@@ -0,0 +1,278 @@
+"""
+パース済みデータのディスクキャッシュ
+
+エクスポートのファイルサイズ・更新日時・内容のハッシュをキーに、
+to_dataframes()の結果をデータタイプごとの列形式（npz）で保存する。
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+
+# キャッシュの保存形式やパース結果の列構成を変えたら上げる
+CACHE_VERSION = 6
+# 内容のハッシュを計算する際に1回に読み込むバイト数
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def _frame_to_arrays(df: pd.DataFrame) -> tuple:
+    """
+    DataFrameを列ごとのnumpy配列と列の型情報に分解
+
+    パラメータ:
+    - df: 保存するDataFrame
+
+    戻り値:
+    - (配列名 → 配列の辞書, 列の型情報のリスト)
+    """
+    arrays = {}
+    columns = []
+    for i, name in enumerate(df.columns):
+        series = df[name]
+        key = f'c{i}'
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            # UTCエポックのナノ秒とタイムゾーン名で保存する
+            utc = series.dt.tz_convert('UTC').dt.tz_localize(None)
+            arrays[key] = utc.to_numpy(dtype='datetime64[ns]').view(np.int64)
+            columns.append({'name': name, 'kind': 'datetime', 'tz': str(series.dt.tz)})
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            # カテゴリ型はコードとカテゴリの一覧をそのまま保存し、読み込み時もカテゴリ型に戻す
+            arrays[key] = series.cat.codes.to_numpy()
+            arrays[f'{key}_categories'] = np.asarray(series.cat.categories, dtype=str)
+            columns.append({'name': name, 'kind': 'category'})
+        elif pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+            arrays[key] = series.to_numpy()
+            columns.append({'name': name, 'kind': 'numeric'})
+        elif series.map(lambda v: v is None or isinstance(v, str)).all():
+            # 文字列はカテゴリのコードとカテゴリの一覧で保存する
+            categorical = pd.Categorical(series)
+            arrays[key] = categorical.codes
+            arrays[f'{key}_categories'] = np.asarray(categorical.categories, dtype=str)
+            columns.append({'name': name, 'kind': 'categorical'})
+        else:
+            # メタデータの辞書などはJSON文字列で保存する
+            arrays[key] = np.asarray(
+                [json.dumps(v, ensure_ascii=False) for v in series], dtype=str
+            )
+            columns.append({'name': name, 'kind': 'json'})
+    return arrays, columns
+
+
+def _arrays_to_frame(arrays, columns: list, row_count: int) -> pd.DataFrame:
+    """
+    列ごとのnumpy配列と列の型情報からDataFrameを復元
+
+    パラメータ:
+    - arrays: 配列名 → 配列（np.loadの結果）
+    - columns: 列の型情報のリスト
+    - row_count: 行数
+
+    戻り値:
+    - 復元したDataFrame
+    """
+    if not columns:
+        return pd.DataFrame()
+    data = {}
+    for i, column in enumerate(columns):
+        key = f'c{i}'
+        kind = column['kind']
+        if kind == 'datetime':
+            values = pd.DatetimeIndex(arrays[key].view('datetime64[ns]'), tz='UTC')
+            data[column['name']] = values.tz_convert(column['tz'])
+        elif kind == 'numeric':
+            data[column['name']] = arrays[key]
+        elif kind == 'category':
+            data[column['name']] = pd.Categorical.from_codes(
+                arrays[key], categories=arrays[f'{key}_categories'].astype(object)
+            )
+        elif kind == 'categorical':
+            categories = arrays[f'{key}_categories'].astype(object)
+            codes = arrays[key]
+            values = np.empty(row_count, dtype=object)
+            valid = codes >= 0
+            values[valid] = categories[codes[valid]]
+            values[~valid] = None
+            data[column['name']] = values
+        else:
+            data[column['name']] = [json.loads(v) for v in arrays[key].tolist()]
+    return pd.DataFrame(data)
+
+
+class ParsedDataCache:
+    """
+    パース済みDataFrameのキャッシュを管理するクラス
+
+    エクスポートのサイズ・更新日時が前回と同じ場合は内容のハッシュを再計算せずに使う。
+    エクスポートが変わると別のキーになり、古いエントリは保存時に削除される。
+    """
+
+    def __init__(self, cache_dir: str = 'data/cache/parsed'):
+        """
+        キャッシュを初期化
+
+        パラメータ:
+        - cache_dir: キャッシュを保存するディレクトリ
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # (パス, サイズ, 更新日時) → 内容のハッシュ
+        self._hash_index_path = self.cache_dir / 'content_hashes.json'
+
+    def fingerprint(self, path: str) -> Dict:
+        """
+        ファイルのサイズ・更新日時・内容のハッシュを取得
+
+        パラメータ:
+        - path: エクスポートのファイルのパス（export.zipまたはexport.xml）
+
+        戻り値:
+        - path, size, mtime_ns, content_hashの辞書
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        index = self._load_hash_index()
+        entry = index.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            content_hash = entry['content_hash']
+        else:
+            print(f"  エクスポートのハッシュを計算中: {path}")
+            content_hash = self._hash_file(path)
+            index[path] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'content_hash': content_hash,
+            }
+            self._save_hash_index(index)
+        return {
+            'path': path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'content_hash': content_hash,
+        }
+
+    def cache_key(self, fingerprint: Dict, options: Dict) -> str:
+        """
+        キャッシュのキーを作成
+
+        パラメータ:
+        - fingerprint: fingerprint()の結果
+        - options: パース結果に影響する設定（データタイプ定義・読み込み開始日など）
+
+        戻り値:
+        - キー（16進文字列）
+        """
+        payload = json.dumps(
+            {'version': CACHE_VERSION, 'content_hash': fingerprint['content_hash'], 'options': options},
+            sort_keys=True, default=str,
+        )
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def load(self, key: str) -> Optional[Dict[str, pd.DataFrame]]:
+        """
+        キャッシュからDataFrameを読み込む
+
+        パラメータ:
+        - key: cache_key()の結果
+
+        戻り値:
+        - データタイプごとのDataFrameの辞書（キャッシュがない場合はNone）
+        """
+        entry_dir = self.cache_dir / key
+        manifest_path = entry_dir / 'manifest.json'
+        if not manifest_path.exists():
+            return None
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            dataframes = {}
+            for data_type, table in manifest['tables'].items():
+                with np.load(entry_dir / table['file'], allow_pickle=False) as arrays:
+                    dataframes[data_type] = _arrays_to_frame(arrays, table['columns'], table['rows'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"警告: キャッシュの読み込みに失敗したため破棄します: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        return dataframes
+
+    def save(self, key: str, fingerprint: Dict, dataframes: Dict[str, pd.DataFrame]):
+        """
+        DataFrameをキャッシュに保存し、同じエクスポートの古いエントリを削除
+
+        パラメータ:
+        - key: cache_key()の結果
+        - fingerprint: fingerprint()の結果
+        - dataframes: データタイプごとのDataFrameの辞書
+        """
+        # 書き込み途中のエントリを読まないよう、一時ディレクトリに書いてから名前を変える
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-'))
+        try:
+            tables = {}
+            for data_type, df in dataframes.items():
+                arrays, columns = _frame_to_arrays(df)
+                file_name = f'{data_type}.npz'
+                np.savez(tmp_dir / file_name, **arrays)
+                tables[data_type] = {'file': file_name, 'columns': columns, 'rows': len(df)}
+            manifest = {
+                'version': CACHE_VERSION,
+                'source': fingerprint,
+                'created_at': time.time(),
+                'tables': tables,
+            }
+            with open(tmp_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+            entry_dir = self.cache_dir / key
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self._prune(fingerprint, keep=key)
+
+    def _prune(self, fingerprint: Dict, keep: str):
+        """同じパスのエクスポートの、内容が変わる前のエントリを削除"""
+        for manifest_path in self.cache_dir.glob('*/manifest.json'):
+            entry_dir = manifest_path.parent
+            if entry_dir.name == keep:
+                continue
+            try:
+                with open(manifest_path, encoding='utf-8') as f:
+                    source = json.load(f)['source']
+            except (OSError, ValueError, KeyError):
+                continue
+            if source['path'] == fingerprint['path'] and source['content_hash'] != fingerprint['content_hash']:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def _hash_file(self, path: str) -> str:
+        """ファイル全体の内容のハッシュ（blake2b）を計算"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _load_hash_index(self) -> Dict:
+        """計算済みのハッシュの一覧を読み込む"""
+        if not self._hash_index_path.exists():
+            return {}
+        try:
+            with open(self._hash_index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_hash_index(self, index: Dict):
+        """計算済みのハッシュの一覧を保存"""
+        tmp_path = self._hash_index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._hash_index_path)
@@ -0,0 +1,64 @@
+"""
+Apple Health以外のインポーターが読み込んだレコードを配列のまままとめたもの
+"""
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+
+@dataclass
+class RecordBatch:
+    """
+    1つのデータタイプ・ソース・単位のレコードの配列
+
+    インポーターはファイルの値をHealthKitのデータタイプ・単位に揃えてこの形にし、
+    RecordCollector.add_batch()で列バッファに配列のまま追加する（文字列を経由しない）。
+    """
+    # データタイプ名（登録簿の名前。'heart_rate'など）
+    data_type: str
+    # ソース名（sourceName）
+    source: str
+    # 単位（HealthKitの単位。'count/min'など）
+    unit: str
+    # 値（float64。カテゴリ値のデータタイプではNaN）
+    value: np.ndarray
+    # 開始・終了日時のUTCエポックナノ秒（int64）
+    start_ns: np.ndarray
+    end_ns: np.ndarray
+    # 各レコードのUTCオフセット（分）
+    utc_offset: np.ndarray
+    # 睡眠ステージ名（'deep'など、カテゴリ値のデータタイプのみ）
+    stage: Optional[np.ndarray] = None
+    # 記録した場所のタイムゾーン名（わかる場合。夏時間の切り替わりを反映するのに使う）
+    time_zone: str = ''
+
+    def __post_init__(self):
+        self.value = np.asarray(self.value, dtype=np.float64)
+        self.start_ns = np.asarray(self.start_ns, dtype=np.int64)
+        self.end_ns = np.asarray(self.end_ns, dtype=np.int64)
+        # UTCオフセットは全レコード共通の1つの値でもよい
+        self.utc_offset = np.broadcast_to(
+            np.asarray(self.utc_offset, dtype=np.int16), self.value.shape
+        ).copy()
+        if self.stage is not None:
+            self.stage = np.asarray(self.stage, dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def take(self, rows: np.ndarray) -> 'RecordBatch':
+        """
+        指定した行だけのバッチ
+
+        パラメータ:
+        - rows: 行番号またはブール値の配列
+
+        戻り値:
+        - RecordBatch
+        """
+        return RecordBatch(
+            self.data_type, self.source, self.unit,
+            self.value[rows], self.start_ns[rows], self.end_ns[rows], self.utc_offset[rows],
+            stage=self.stage[rows] if self.stage is not None else None,
+            time_zone=self.time_zone,
+        )
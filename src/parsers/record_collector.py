@@ -0,0 +1,214 @@
+"""
+Apple Health XMLの要素イベントからレコードを収集する処理
+"""
+from typing import Dict, Optional
+from src.parsers.columnar import RecordColumns
+from src.parsers.hrv_beats import BEAT_ELEMENT, HeartbeatSeries
+from src.parsers.record_batch import RecordBatch
+from src.parsers.record_filter import RecordFilter
+from src.parsers.timestamps import TIME_ZONE_METADATA_KEY, local_day_numbers
+from src.parsers.type_registry import HealthTypeRegistry
+from src.parsers.workout_tables import WorkoutTables
+
+
+class RecordCollector:
+    """
+    XMLの開始・終了イベントを受け取り、データタイプごとのバッファに振り分けるクラス
+
+    ツリーを保持せずに逐次パースできるよう、要素の属性だけを使って処理する。
+    """
+
+    def __init__(self, registry: HealthTypeRegistry, sleep_stages: Dict[str, str],
+                 workout_types: Dict[str, str], record_filter: Optional[RecordFilter] = None):
+        """
+        コレクターを初期化
+
+        パラメータ:
+        - registry: 収集するデータタイプの登録簿
+        - sleep_stages: 睡眠ステージ識別子から名前への辞書
+        - workout_types: ワークアウト識別子から名前への辞書
+        - record_filter: 期間・データタイプ・ソースの絞り込み条件
+        """
+        self.record_filter = record_filter or RecordFilter()
+        # HealthKit識別子 → データタイプ名（typeの属性で直接振り分けるため逆引きにする）
+        # 読み込まないデータタイプは表に入れず、typeの属性を引いた時点で読み飛ばす
+        self.type_lookup = {
+            health_type.identifier: health_type.name for health_type in registry
+            if self.record_filter.includes_type(health_type.name)
+        }
+        self.include_workouts = self.record_filter.includes_type(RecordFilter.WORKOUTS)
+        self.workout_types = workout_types
+        # カテゴリ値のデータタイプ → カテゴリ識別子から名前への辞書（睡眠のみ名前に変換する）
+        self.category_labels: Dict[str, Dict[str, str]] = {
+            health_type.name: sleep_stages if health_type.name == 'sleep' else {}
+            for health_type in registry if health_type.value_dtype == 'category'
+        }
+
+        self.records: Dict[str, RecordColumns] = {
+            health_type.name: RecordColumns(
+                health_type.name, with_stage=(health_type.value_dtype == 'category')
+            )
+            for health_type in registry
+        }
+        self.workouts = WorkoutTables(workout_types)
+        # HRVレコードの拍動ごとの瞬間心拍数（sample_idはhrvの行番号）
+        self.hrv_beats = HeartbeatSeries()
+        self.record_count = 0
+        # 期間・ソースの条件で読み飛ばした件数
+        self.skipped_count = 0
+        self._filters_attributes = self.record_filter.filters_attributes
+
+        # 処理中のワークアウトのworkout_id（読み飛ばした場合や範囲外ではNone）
+        self._current_workout: Optional[int] = None
+        self._in_route = False
+        # 処理中のHRVレコードの行番号（HRV以外のレコードや範囲外ではNone）
+        self._current_hrv: Optional[int] = None
+        # 処理中のレコードを追加したバッファ（読み飛ばしたレコードや範囲外ではNone）
+        self._current_record: Optional[RecordColumns] = None
+
+    def start(self, tag: str, attrib: Dict[str, str]):
+        """
+        要素の開始イベントを処理
+
+        パラメータ:
+        - tag: 要素名
+        - attrib: 要素の属性
+        """
+        if tag == 'Record':
+            self.record_count += 1
+            data_type = self.type_lookup.get(attrib.get('type'))
+            if data_type is None:
+                return
+            if self._filters_attributes and not self.record_filter.accepts(attrib, data_type=data_type):
+                self.skipped_count += 1
+                return
+
+            value = attrib.get('value')
+            labels = self.category_labels.get(data_type)
+            columns = self.records[data_type]
+            self._current_record = columns
+            if labels is not None:
+                # カテゴリ値（睡眠ステージなど）は数値ではないため、ステージとして保持する
+                columns.append(
+                    attrib.get('sourceName', ''),
+                    attrib.get('unit', ''),
+                    None,
+                    attrib.get('startDate'),
+                    attrib.get('endDate'),
+                    stage=labels.get(value or '', 'unknown') if labels else (value or 'unknown'),
+                )
+            else:
+                columns.append(
+                    attrib.get('sourceName', ''),
+                    attrib.get('unit', ''),
+                    value,
+                    attrib.get('startDate'),
+                    attrib.get('endDate'),
+                )
+                if data_type == 'hrv':
+                    self._current_hrv = len(columns) - 1
+
+        elif tag == 'Workout':
+            self.record_count += 1
+            if not self.include_workouts:
+                return
+            if self._filters_attributes and not self.record_filter.accepts(
+                attrib, data_type=RecordFilter.WORKOUTS
+            ):
+                self.skipped_count += 1
+                return
+            self._current_workout = self.workouts.add_workout(attrib)
+
+        elif tag == BEAT_ELEMENT:
+            # HRVレコード配下の拍動ごとの瞬間心拍数
+            if self._current_hrv is not None:
+                self.hrv_beats.append(self._current_hrv, attrib.get('bpm'))
+
+        elif self._current_record is not None:
+            # レコード配下のメタデータは、記録した場所のタイムゾーン名だけを保持する
+            if tag == 'MetadataEntry' and attrib.get('key') == TIME_ZONE_METADATA_KEY and attrib.get('value'):
+                self._current_record.set_time_zone(attrib['value'])
+
+        elif self._current_workout is None:
+            return
+
+        # 以下はワークアウトの子要素
+        elif tag == 'WorkoutStatistics':
+            self.workouts.add_statistics(self._current_workout, attrib)
+
+        elif tag == 'WorkoutEvent':
+            self.workouts.add_event(self._current_workout, attrib)
+
+        elif tag == 'MetadataEntry':
+            # ワークアウト配下のメタデータ（イベント等の子要素のものも含む）
+            key = attrib.get('key')
+            value = attrib.get('value')
+            if key and value:
+                self.workouts.add_metadata(self._current_workout, key, value)
+
+        elif tag == 'WorkoutRoute':
+            self._in_route = True
+
+        elif tag == 'FileReference' and self._in_route:
+            path = attrib.get('path')
+            if path:
+                self.workouts.set_route(self._current_workout, path)
+
+    def add_batch(self, batch: RecordBatch):
+        """
+        インポーターが読み込んだレコードの配列を追加（Record要素のstart()と同じ絞り込みを配列でまとめて行う）
+
+        パラメータ:
+        - batch: RecordBatch
+        """
+        self.record_count += len(batch)
+        if batch.data_type not in self.records or not self.record_filter.includes_type(batch.data_type):
+            return
+        if self._filters_attributes:
+            keep = self.record_filter.accepts_days(
+                batch.source, local_day_numbers(batch.start_ns, batch.utc_offset), batch.data_type
+            )
+            self.skipped_count += int(len(keep) - keep.sum())
+            if not keep.all():
+                batch = batch.take(keep)
+        self.records[batch.data_type].extend_arrays(
+            batch.source, batch.unit, batch.value, batch.start_ns, batch.end_ns, batch.utc_offset,
+            stage=batch.stage, time_zone=batch.time_zone,
+        )
+
+    def flush(self):
+        """デコード待ちのタイムスタンプをすべてデコード（ワーカープロセスから返す前などに呼ぶ）"""
+        for columns in self.records.values():
+            columns.flush()
+        self.workouts.flush()
+
+    def merge(self, other: 'RecordCollector'):
+        """
+        別のコレクターの収集結果を末尾に追加（並列パースの結果を順番に結合する）
+
+        パラメータ:
+        - other: 追加するRecordCollector
+        """
+        # 拍動のsample_idは、追加前のHRVレコード数だけずらす
+        hrv_offset = len(self.records['hrv']) if 'hrv' in self.records else 0
+        for data_type, columns in other.records.items():
+            self.records[data_type].extend(columns)
+        self.hrv_beats.extend(other.hrv_beats, hrv_offset)
+        self.workouts.extend(other.workouts)
+        self.record_count += other.record_count
+        self.skipped_count += other.skipped_count
+
+    def end(self, tag: str):
+        """
+        要素の終了イベントを処理
+
+        パラメータ:
+        - tag: 要素名
+        """
+        if tag == 'Record':
+            self._current_hrv = None
+            self._current_record = None
+        elif tag == 'Workout':
+            self._current_workout = None
+        elif tag == 'WorkoutRoute':
+            self._in_route = False
@@ -0,0 +1,161 @@
+"""
+パース時に適用するレコードの絞り込み条件
+"""
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+from src.parsers.timestamps import day_number
+
+
+class RecordFilter:
+    """
+    期間・データタイプ・ソースでレコードを絞り込む条件
+
+    条件に合わないレコードは、属性の文字列比較だけで値の変換やバッファへの追加の前に読み飛ばす。
+    """
+
+    # データタイプの絞り込みでワークアウトを指定する名前
+    WORKOUTS = 'workouts'
+
+    def __init__(self, since: Optional[date] = None, until: Optional[date] = None,
+                 data_types: Optional[Iterable[str]] = None,
+                 sources: Optional[Iterable[str]] = None,
+                 exclude_sources: Optional[Iterable[str]] = None,
+                 stream_since: Optional[Dict[Tuple[str, str], date]] = None):
+        """
+        絞り込み条件を初期化
+
+        パラメータ:
+        - since: この日付より前に始まるレコードを読み飛ばす
+        - until: この日付より後に始まるレコードを読み飛ばす（当日は含む）
+        - data_types: 読み込むデータタイプ名（'heart_rate'、'workouts'など。Noneの場合はすべて）
+        - sources: 読み込むソース名（Noneの場合はすべて）
+        - exclude_sources: 読み飛ばすソース名
+        - stream_since: (データタイプ名, ソース名) → その日付より前に始まるレコードを読み飛ばす
+          （ソースごとの高水位標。指定のないデータタイプ・ソースはsince）
+        """
+        self.since = since
+        self.until = until
+        self.data_types = frozenset(data_types) if data_types is not None else None
+        self.sources = frozenset(sources) if sources is not None else None
+        self.exclude_sources = frozenset(exclude_sources or ())
+        self.stream_since = dict(stream_since or {})
+        # startDateの先頭'YYYY-MM-DD'と文字列のまま比較する
+        self._since_text = since.isoformat() if since else None
+        self._until_text = until.isoformat() if until else None
+        self._stream_since_text = {key: day.isoformat() for key, day in self.stream_since.items()}
+
+    @property
+    def is_empty(self) -> bool:
+        """条件が何も指定されていないかどうか"""
+        return (
+            self.since is None and self.until is None and self.data_types is None
+            and self.sources is None and not self.exclude_sources and not self.stream_since
+        )
+
+    @property
+    def filters_attributes(self) -> bool:
+        """期間・ソースの条件があるかどうか（要素ごとに属性を確認する必要があるか）"""
+        return (
+            self.since is not None or self.until is not None
+            or self.sources is not None or bool(self.exclude_sources) or bool(self.stream_since)
+        )
+
+    @property
+    def earliest_since(self) -> Optional[date]:
+        """どのデータタイプ・ソースでも読み込む最初の日付（索引で読み込む範囲を絞る際に使う）"""
+        if self.since is None:
+            return None
+        return min([self.since, *self.stream_since.values()])
+
+    def includes_type(self, data_type: str) -> bool:
+        """
+        データタイプを読み込むかどうか
+
+        パラメータ:
+        - data_type: データタイプ名
+
+        戻り値:
+        - 読み込む場合はTrue
+        """
+        return self.data_types is None or data_type in self.data_types
+
+    def accepts(self, attrib: Dict[str, str], date_key: str = 'startDate',
+                data_type: Optional[str] = None) -> bool:
+        """
+        要素の属性が期間・ソースの条件に合うかどうか
+
+        パラメータ:
+        - attrib: Record/Workout要素の属性
+        - date_key: 期間の判定に使う属性名
+        - data_type: データタイプ名（ソースごとの高水位標の判定に使う）
+
+        戻り値:
+        - 条件に合う場合はTrue
+        """
+        since_text = self._since_text
+        if self._stream_since_text and data_type is not None:
+            since_text = self._stream_since_text.get((data_type, attrib.get('sourceName', '')), since_text)
+        if since_text or self._until_text:
+            day = (attrib.get(date_key) or '')[:10]
+            if since_text and day < since_text:
+                return False
+            if self._until_text and day > self._until_text:
+                return False
+        if self.sources is not None or self.exclude_sources:
+            source = attrib.get('sourceName', '')
+            if self.sources is not None and source not in self.sources:
+                return False
+            if source in self.exclude_sources:
+                return False
+        return True
+
+    def accepts_days(self, source: str, local_days: np.ndarray, data_type: Optional[str] = None) -> np.ndarray:
+        """
+        同じソースのレコードの配列が期間・ソースの条件に合うかどうか（RecordBatch用）
+
+        パラメータ:
+        - source: ソース名
+        - local_days: 各レコードの開始日時の現地の日付（1970-01-01からの日数）
+        - data_type: データタイプ名（ソースごとの高水位標の判定に使う）
+
+        戻り値:
+        - 条件に合うレコードがTrueのブール値の配列
+        """
+        keep = np.ones(len(local_days), dtype=bool)
+        if (self.sources is not None and source not in self.sources) or source in self.exclude_sources:
+            return ~keep
+        since = self.stream_since.get((data_type, source), self.since)
+        if since is not None:
+            keep &= local_days >= day_number(since)
+        if self.until is not None:
+            keep &= local_days <= day_number(self.until)
+        return keep
+
+    def describe(self) -> str:
+        """条件の説明（ログ表示用）"""
+        parts = []
+        if self.since or self.until:
+            parts.append(f"期間 {self.since or ''}～{self.until or ''}")
+        if self.data_types is not None:
+            parts.append(f"データタイプ {', '.join(sorted(self.data_types))}")
+        if self.sources is not None:
+            parts.append(f"ソース {', '.join(sorted(self.sources))}")
+        if self.exclude_sources:
+            parts.append(f"除外ソース {', '.join(sorted(self.exclude_sources))}")
+        if self.stream_since:
+            parts.append(f"高水位標以降のみ {len(self.stream_since)}ソース")
+        return ' / '.join(parts)
+
+    def cache_options(self) -> Dict:
+        """パース済みキャッシュのキーに含める形"""
+        return {
+            'since': self._since_text,
+            'until': self._until_text,
+            'data_types': sorted(self.data_types) if self.data_types is not None else None,
+            'sources': sorted(self.sources) if self.sources is not None else None,
+            'exclude_sources': sorted(self.exclude_sources),
+            'stream_since': sorted(
+                [data_type, source, text] for (data_type, source), text in self._stream_since_text.items()
+            ),
+        }
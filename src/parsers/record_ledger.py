@@ -0,0 +1,365 @@
+"""
+取り込み済みのレコードの指紋の台帳
+
+各レコードを(データタイプ, ソース, 開始日時, 終了日時, 値)の64ビットの指紋にし
+（ワークアウトは種類・時間・消費エネルギー・距離）、
+取り込み済みかどうかをブルームフィルターとディスク上の正確な索引で判定する。
+全期間のエクスポートを何度取り込み直しても、新しいレコードだけを見分けられる。
+"""
+import hashlib
+import json
+import math
+import os
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from src.parsers.timestamps import day_from_number, day_number
+
+# 台帳の保存形式や指紋の計算方法を変えたら上げる
+LEDGER_VERSION = 1
+# 指紋に含める列（DataFrameにあるものだけを使う）
+FINGERPRINT_COLUMNS = ('source', 'start_date', 'end_date', 'value', 'stage')
+# ワークアウト（workoutsテーブル）の指紋に含める列
+WORKOUT_FINGERPRINT_COLUMNS = (
+    'source', 'type_identifier', 'start_date', 'end_date', 'duration', 'total_energy_burned', 'total_distance',
+)
+# ワークアウトのデータタイプ名（RecordFilter.WORKOUTSと同じ）
+WORKOUTS = 'workouts'
+# ブルームフィルターの偽陽性率の目標
+FALSE_POSITIVE_RATE = 0.01
+# ブルームフィルターの最小の容量（レコード数）
+MIN_CAPACITY = 1 << 16
+# 正確な索引のソート済みの断片がこの数を超えたら1つにまとめる
+MAX_RUNS = 8
+# ブルームフィルターのビット位置を一度に計算する指紋の数（メモリ使用量を抑えるため）
+CHUNK_SIZE = 1 << 20
+
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_SALT = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """64ビットの値をかき混ぜる（splitmix64の最終段）"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * _MIX_1
+    x = x ^ (x >> np.uint64(27))
+    x = x * _MIX_2
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash_text(text: str) -> int:
+    """文字列の64ビットのハッシュ（実行ごとに変わらない）"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _column_words(series: pd.Series) -> np.ndarray:
+    """列の値を、指紋に混ぜる64ビットの値にする"""
+    if isinstance(series.dtype, pd.DatetimeTZDtype) or pd.api.types.is_datetime64_any_dtype(series.dtype):
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        return series.to_numpy(dtype='datetime64[ns]').view(np.uint64)
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        values = series.to_numpy(dtype=np.float64)
+        # 欠損値のビット列を1つに揃える
+        values = np.where(np.isnan(values), np.nan, values)
+        return values.view(np.uint64)
+    # 文字列・カテゴリ型は、種類ごとに1回だけハッシュを計算する
+    categorical = pd.Categorical(series)
+    hashes = np.array([_hash_text(str(value)) for value in categorical.categories] + [0], dtype=np.uint64)
+    return hashes[categorical.codes]
+
+
+def record_fingerprints(df: pd.DataFrame, data_type: str) -> np.ndarray:
+    """
+    レコードごとの指紋を計算
+
+    パラメータ:
+    - df: データタイプのDataFrame
+    - data_type: データタイプ名
+
+    戻り値:
+    - 指紋（uint64）
+    """
+    fingerprints = np.full(len(df), _hash_text(data_type), dtype=np.uint64)
+    columns = WORKOUT_FINGERPRINT_COLUMNS if data_type == WORKOUTS else FINGERPRINT_COLUMNS
+    for column in columns:
+        if column in df.columns:
+            fingerprints = _mix(fingerprints ^ _column_words(df[column]))
+    return fingerprints
+
+
+def fingerprint_frames(dataframes: Dict[str, pd.DataFrame]) -> Dict[str, np.ndarray]:
+    """
+    データタイプごとのDataFrameの指紋をまとめて計算
+
+    パラメータ:
+    - dataframes: データタイプごとのDataFrameの辞書
+
+    戻り値:
+    - データタイプ → 指紋の辞書（空のDataFrameは除く）
+    """
+    return {
+        data_type: record_fingerprints(df, data_type)
+        for data_type, df in dataframes.items() if not df.empty
+    }
+
+
+class BloomFilter:
+    """
+    指紋の集合に含まれるかどうかを判定するブルームフィルター
+
+    含まれない指紋は確実に判定でき、含まれると判定した指紋だけを正確な索引で確かめる。
+    ビット位置は指紋から2つのハッシュを作り、その線形結合（二重ハッシュ法）で求める。
+    """
+
+    def __init__(self, bits: np.ndarray, hash_count: int):
+        """
+        フィルターを初期化
+
+        パラメータ:
+        - bits: ビット配列（uint8、長さは2のべき乗）
+        - hash_count: 1つの指紋で立てるビットの数
+        """
+        self.bits = bits
+        self.hash_count = hash_count
+        self._mask = np.uint64(len(bits) * 8 - 1)
+
+    @classmethod
+    def with_capacity(cls, capacity: int) -> 'BloomFilter':
+        """
+        容量に合わせた大きさの空のフィルターを作成
+
+        パラメータ:
+        - capacity: 偽陽性率がFALSE_POSITIVE_RATEに収まるレコード数
+
+        戻り値:
+        - BloomFilter
+        """
+        bit_count = -capacity * math.log(FALSE_POSITIVE_RATE) / math.log(2) ** 2
+        bit_count = 1 << max(int(math.ceil(math.log2(bit_count))), 3)
+        hash_count = max(1, round(bit_count / capacity * math.log(2)))
+        return cls(np.zeros(bit_count // 8, dtype=np.uint8), hash_count)
+
+    def _positions(self, fingerprints: np.ndarray) -> np.ndarray:
+        """指紋ごとのビット位置（hash_count × 指紋数）"""
+        first = _mix(fingerprints)
+        second = _mix(fingerprints ^ _SALT) | np.uint64(1)
+        steps = np.arange(self.hash_count, dtype=np.uint64)[:, None]
+        return (first[None, :] + steps * second[None, :]) & self._mask
+
+    def add(self, fingerprints: np.ndarray):
+        """指紋を追加"""
+        for start in range(0, len(fingerprints), CHUNK_SIZE):
+            positions = self._positions(fingerprints[start:start + CHUNK_SIZE]).ravel()
+            offsets = positions & np.uint64(7)
+            # バイト内のビットごとに立てる（同じバイトが重複しても同じ値を書くだけになる）
+            for bit in range(8):
+                index = positions[offsets == bit] >> np.uint64(3)
+                self.bits[index] = self.bits[index] | np.uint8(1 << bit)
+
+    def might_contain(self, fingerprints: np.ndarray) -> np.ndarray:
+        """
+        指紋が含まれる可能性があるかどうか
+
+        戻り値:
+        - bool配列（Falseの指紋は確実に含まれない）
+        """
+        result = np.empty(len(fingerprints), dtype=bool)
+        for start in range(0, len(fingerprints), CHUNK_SIZE):
+            positions = self._positions(fingerprints[start:start + CHUNK_SIZE])
+            flags = self.bits[positions >> np.uint64(3)] & (1 << (positions & np.uint64(7))).astype(np.uint8)
+            result[start:start + CHUNK_SIZE] = (flags != 0).all(axis=0)
+        return result
+
+
+class RecordLedger:
+    """
+    取り込み済みのレコードの指紋を保存する台帳
+
+    正確な索引はソート済みの指紋の断片（.npy）の集まりで、取り込みごとに新しい指紋だけの断片を追加する。
+    判定はブルームフィルターで候補を絞り、候補だけをメモリマップした断片の二分探索で確かめるため、
+    取り込み済みの全レコードを読み込まずに済む。断片がMAX_RUNSを超えたら1つにまとめる。
+    """
+
+    def __init__(self, ledger_dir: str = 'data/db/record_ledger'):
+        """
+        台帳を開く（存在しない場合は空の台帳）
+
+        パラメータ:
+        - ledger_dir: 台帳を保存するディレクトリ
+        """
+        self.ledger_dir = Path(ledger_dir)
+        self.ledger_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.ledger_dir / 'manifest.json'
+        self.runs: List[str] = []
+        self.count = 0
+        self.capacity = MIN_CAPACITY
+        self._next_run = 0
+        manifest = self._load_manifest()
+        if manifest is not None:
+            self.runs = manifest['runs']
+            self.count = manifest['count']
+            self.capacity = manifest['capacity']
+            self._next_run = manifest['next_run']
+            self.bloom = BloomFilter(np.load(self.ledger_dir / 'bloom.npy'), manifest['hash_count'])
+        else:
+            self.bloom = BloomFilter.with_capacity(self.capacity)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _load_manifest(self):
+        """保存形式が同じ台帳のマニフェスト（ない場合・形式が違う場合はNone）"""
+        if not self.manifest_path.exists():
+            return None
+        with open(self.manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != LEDGER_VERSION:
+            return None
+        return manifest
+
+    def _run(self, name: str) -> np.ndarray:
+        """ソート済みの指紋の断片（メモリマップ）"""
+        return np.load(self.ledger_dir / name, mmap_mode='r')
+
+    def contains(self, fingerprints: np.ndarray) -> np.ndarray:
+        """
+        指紋が台帳にあるかどうか
+
+        パラメータ:
+        - fingerprints: 指紋（uint64）
+
+        戻り値:
+        - bool配列
+        """
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        found = np.zeros(len(fingerprints), dtype=bool)
+        if not self.count or not len(fingerprints):
+            return found
+        candidates = np.flatnonzero(self.bloom.might_contain(fingerprints))
+        # 候補を指紋の順に並べ、断片を先頭から順に読むようにする
+        candidates = candidates[np.argsort(fingerprints[candidates], kind='stable')]
+        for name in self.runs:
+            if not len(candidates):
+                break
+            run = self._run(name)
+            values = fingerprints[candidates]
+            positions = np.minimum(np.searchsorted(run, values), len(run) - 1)
+            hit = run[positions] == values
+            found[candidates[hit]] = True
+            candidates = candidates[~hit]
+        return found
+
+    def add(self, fingerprints: np.ndarray) -> int:
+        """
+        指紋を台帳に追加して保存
+
+        パラメータ:
+        - fingerprints: 指紋（uint64、台帳にあるものは無視する）
+
+        戻り値:
+        - 追加した指紋の数
+        """
+        fingerprints = np.sort(np.asarray(fingerprints, dtype=np.uint64))
+        if len(fingerprints):
+            fingerprints = fingerprints[np.concatenate(([True], fingerprints[1:] != fingerprints[:-1]))]
+            fingerprints = fingerprints[~self.contains(fingerprints)]
+        if not len(fingerprints):
+            return 0
+
+        name = f'run-{self._next_run:06d}.npy'
+        self._next_run += 1
+        self._write_array(name, fingerprints)
+        self.runs.append(name)
+        self.count += len(fingerprints)
+
+        if self.count > self.capacity:
+            # 容量を超えたら大きなフィルターを作り直す（偽陽性率を保つため）
+            self.capacity = max(self.capacity * 2, self.count)
+            self.bloom = BloomFilter.with_capacity(self.capacity)
+            for run_name in self.runs:
+                self.bloom.add(np.asarray(self._run(run_name)))
+        else:
+            self.bloom.add(fingerprints)
+        self._write_array('bloom.npy', self.bloom.bits)
+
+        obsolete = []
+        if len(self.runs) > MAX_RUNS:
+            obsolete = self.runs
+            merged = np.sort(np.concatenate([np.asarray(self._run(run_name)) for run_name in self.runs]))
+            name = f'run-{self._next_run:06d}.npy'
+            self._next_run += 1
+            self._write_array(name, merged)
+            self.runs = [name]
+        self._write_manifest()
+        # マニフェストを書き換えてから古い断片を消す（途中で中断しても台帳は壊れない）
+        for run_name in obsolete:
+            (self.ledger_dir / run_name).unlink(missing_ok=True)
+        return len(fingerprints)
+
+    def _write_array(self, name: str, array: np.ndarray):
+        """配列を一時ファイルに書いてから名前を変える"""
+        tmp_path = self.ledger_dir / f'.tmp-{name}'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, self.ledger_dir / name)
+
+    def _write_manifest(self):
+        manifest = {
+            'version': LEDGER_VERSION,
+            'runs': self.runs,
+            'count': self.count,
+            'capacity': self.capacity,
+            'hash_count': self.bloom.hash_count,
+            'next_run': self._next_run,
+        }
+        tmp_path = self.ledger_dir / '.tmp-manifest.json'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def new_record_masks(self, fingerprints: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        データタイプごとに、台帳にない（新しい）レコードを求める
+
+        パラメータ:
+        - fingerprints: fingerprint_frames()の結果
+
+        戻り値:
+        - データタイプ → 新しいレコードのbool配列の辞書
+        """
+        return {data_type: ~self.contains(values) for data_type, values in fingerprints.items()}
+
+
+def affected_date_ranges(new_days: np.ndarray, start_date: date, end_date: date,
+                         lookback_days: int = 1) -> List[Tuple[date, date]]:
+    """
+    新しいレコードがある日から、再集計する日付の範囲を求める
+
+    パラメータ:
+    - new_days: 新しいレコードの現地の日付（1970-01-01からの日数）
+    - start_date, end_date: 集計できる期間
+    - lookback_days: 各日の集計が参照する前日の日数（前日の夜のレコードは翌日の睡眠の集計に使う）
+
+    戻り値:
+    - 連続する日付ごとの(初日, 最終日)のリスト
+    """
+    first_day, last_day = day_number(start_date), day_number(end_date)
+    new_days = np.asarray(new_days, dtype=np.int64)
+    new_days = new_days[(new_days >= first_day - lookback_days) & (new_days <= last_day)]
+    if not len(new_days) or last_day < first_day:
+        return []
+    # 期間内の日ごとに、その日かlookback_days日前までに新しいレコードがあるか
+    day_count = last_day - first_day + 1
+    has_new = np.bincount(new_days - (first_day - lookback_days), minlength=day_count + lookback_days) > 0
+    affected = np.convolve(has_new, np.ones(lookback_days + 1, dtype=bool))[lookback_days:lookback_days + day_count]
+    days = np.flatnonzero(affected) + first_day
+    if not len(days):
+        return []
+    breaks = np.flatnonzero(np.diff(days) > 1)
+    firsts = np.concatenate(([days[0]], days[breaks + 1]))
+    lasts = np.concatenate((days[breaks], [days[-1]]))
+    return [(day_from_number(int(first)), day_from_number(int(last))) for first, last in zip(firsts, lasts)]
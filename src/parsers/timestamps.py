@@ -0,0 +1,314 @@
+"""
+Apple Healthのタイムスタンプのデコード
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+# 欠損値を表すint64（numpyのdatetime64ではNaTとして扱われる）
+NAT_NS = -(2 ** 63)
+
+_NS_PER_SEC = 1_000_000_000
+_NS_PER_MINUTE = 60 * _NS_PER_SEC
+_NS_PER_DAY = 86400 * _NS_PER_SEC
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# 記録した場所のタイムゾーン名（IANA）を持つメタデータのキー
+TIME_ZONE_METADATA_KEY = 'HKTimeZone'
+# 現地の日付キー（1970-01-01からの日数）の欠損値（日時が欠損したレコード）
+NO_LOCAL_DAY = np.iinfo(np.int32).min
+
+# UTCオフセット文字列（'+0900'など）→ 分
+_OFFSET_CACHE: Dict[str, int] = {}
+
+# 'YYYY-MM-DD HH:MM:SS +ZZZZ'形式の固定長
+TIMESTAMP_WIDTH = 25
+# 欠損・不正な値の代わりに入れる空白（デコード時にNaTになる）
+BLANK_TIMESTAMP = ' ' * TIMESTAMP_WIDTH
+
+# 区切り文字の位置と期待する文字
+_SEPARATORS = ((4, ord('-')), (7, ord('-')), (10, ord(' ')), (13, ord(':')), (16, ord(':')), (19, ord(' ')))
+_DIGIT_POSITIONS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18, 21, 22, 23, 24]
+# 月ごとの日数（平年。添字は月、うるう年の2月は別に判定する）
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype=np.int64)
+
+
+def parse_offset(text: str) -> int:
+    """
+    '+0900'形式のUTCオフセットを分に変換（結果はキャッシュする）
+
+    パラメータ:
+    - text: UTCオフセット文字列
+
+    戻り値:
+    - UTCオフセット（分）
+    """
+    minutes = _OFFSET_CACHE.get(text)
+    if minutes is None:
+        sign = -1 if text[0] == '-' else 1
+        minutes = sign * (int(text[1:3]) * 60 + int(text[3:5]))
+        _OFFSET_CACHE[text] = minutes
+    return minutes
+
+
+def parse_apple_timestamp(text: Optional[str]) -> Tuple[int, int]:
+    """
+    '2024-03-01 23:12:45 +0900'形式のタイムスタンプをデコード
+
+    パラメータ:
+    - text: タイムスタンプ文字列
+
+    戻り値:
+    - (UTCエポックからのナノ秒, UTCオフセット（分）)。欠損・不正な値は(NAT_NS, 0)
+    """
+    if not text:
+        return NAT_NS, 0
+    try:
+        days = date(int(text[0:4]), int(text[5:7]), int(text[8:10])).toordinal() - _EPOCH_ORDINAL
+        seconds = days * 86400 + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+        offset = parse_offset(text[20:25])
+    except (ValueError, IndexError):
+        return NAT_NS, 0
+    return (seconds - offset * 60) * _NS_PER_SEC, offset
+
+
+def format_timestamp(ns: int, offset: int) -> str:
+    """
+    UTCエポックナノ秒を'2024-03-01 23:12:45 +0900'形式のタイムスタンプにする（parse_apple_timestampの逆）
+
+    パラメータ:
+    - ns: UTCエポックからのナノ秒
+    - offset: UTCオフセット（分）
+
+    戻り値:
+    - タイムスタンプ文字列（欠損値は空文字列）
+    """
+    if ns == NAT_NS:
+        return ''
+    local = datetime(1970, 1, 1) + timedelta(seconds=ns // _NS_PER_SEC + offset * 60)
+    sign = '-' if offset < 0 else '+'
+    hours, minutes = divmod(abs(offset), 60)
+    return f"{local:%Y-%m-%d %H:%M:%S} {sign}{hours:02d}{minutes:02d}"
+
+
+def fixed_width(text: Optional[str]) -> str:
+    """
+    タイムスタンプ文字列をdecode_timestampsに渡せる固定長に揃える
+
+    パラメータ:
+    - text: タイムスタンプ文字列
+
+    戻り値:
+    - そのままの文字列、形式が異なる場合はBLANK_TIMESTAMP
+    """
+    if text and len(text) == TIMESTAMP_WIDTH:
+        return text
+    return BLANK_TIMESTAMP
+
+
+def decode_timestamps(raw: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    固定長のタイムスタンプを連結したバイト列をまとめてデコード
+
+    文字をuint8の行列として扱い、数字の抽出から日付の計算まですべてベクトル演算で行う。
+
+    パラメータ:
+    - raw: 'YYYY-MM-DD HH:MM:SS +ZZZZ'（TIMESTAMP_WIDTHバイト）を連結したバイト列
+
+    戻り値:
+    - (UTCエポックからのナノ秒（int64）, UTCオフセット（分、int16）)。不正な値はNAT_NSとオフセット0
+    """
+    chars = np.frombuffer(raw, dtype=np.uint8).reshape(-1, TIMESTAMP_WIDTH)
+    digits = chars.astype(np.int64) - ord('0')
+
+    valid = np.all((digits[:, _DIGIT_POSITIONS] >= 0) & (digits[:, _DIGIT_POSITIONS] <= 9), axis=1)
+    for position, expected in _SEPARATORS:
+        valid &= chars[:, position] == expected
+    valid &= (chars[:, 20] == ord('+')) | (chars[:, 20] == ord('-'))
+
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 5] * 10 + digits[:, 6]
+    day = digits[:, 8] * 10 + digits[:, 9]
+    valid &= (year >= 1) & (month >= 1) & (month <= 12)
+    # 日付は月の日数で判定する（parse_apple_timestampと同じく2024-02-31などは不正な値）
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = _DAYS_IN_MONTH[np.clip(month, 0, 12)] + (leap & (month == 2))
+    valid &= (day >= 1) & (day <= month_days)
+    seconds_of_day = (
+        (digits[:, 11] * 10 + digits[:, 12]) * 3600
+        + (digits[:, 14] * 10 + digits[:, 15]) * 60
+        + digits[:, 17] * 10 + digits[:, 18]
+    )
+
+    # 暦日からエポック日数への変換（Howard Hinnantのdays_from_civil）
+    y = year - (month <= 2)
+    era = y // 400
+    year_of_era = y - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = era * 146097 + day_of_era - 719468
+
+    sign = np.where(chars[:, 20] == ord('-'), -1, 1)
+    offsets = sign * ((digits[:, 21] * 10 + digits[:, 22]) * 60 + digits[:, 23] * 10 + digits[:, 24])
+
+    ns = (days * 86400 + seconds_of_day - offsets * 60) * _NS_PER_SEC
+    ns = np.where(valid, ns, NAT_NS)
+    offsets = np.where(valid, offsets, 0).astype(np.int16)
+    return ns, offsets
+
+
+def decode_timestamp_strings(texts) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    タイムスタンプ文字列のリストをまとめてデコード
+
+    パラメータ:
+    - texts: タイムスタンプ文字列（Noneを含んでよい）のリスト
+
+    戻り値:
+    - (UTCエポックからのナノ秒（int64）, UTCオフセット（分、int16）)
+    """
+    if not texts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int16)
+    raw = ''.join(fixed_width(text) for text in texts).encode('ascii', 'replace')
+    return decode_timestamps(raw)
+
+
+def to_datetime_index(ns: np.ndarray, offsets: np.ndarray) -> pd.DatetimeIndex:
+    """
+    UTCエポックナノ秒の配列をタイムゾーン付きのDatetimeIndexに変換
+
+    すべてのレコードのUTCオフセットが同じ場合はそのオフセット、
+    混在している場合（旅行・夏時間など）はUTCで表現する。
+
+    パラメータ:
+    - ns: UTCエポックからのナノ秒（int64）
+    - offsets: UTCオフセット（分）
+
+    戻り値:
+    - タイムゾーン付きのDatetimeIndex
+    """
+    index = pd.DatetimeIndex(ns.view('datetime64[ns]')).tz_localize('UTC')
+    valid_offsets = offsets[ns != NAT_NS]
+    if len(valid_offsets) and (valid_offsets == valid_offsets[0]).all():
+        index = index.tz_convert(timezone(timedelta(minutes=int(valid_offsets[0]))))
+    return index
+
+
+def zone_offsets(ns: np.ndarray, offsets: np.ndarray, zone_codes: np.ndarray, zone_names) -> np.ndarray:
+    """
+    タイムゾーン名（HKTimeZoneメタデータ）があるレコードのUTCオフセットを、その時点のタイムゾーンのものにする
+
+    エクスポートの日時文字列のオフセットはエクスポートした端末のタイムゾーンで書かれるため、
+    旅行先で記録したレコードでは記録した場所の現地時刻と一致しない。
+    タイムゾーン名ごとにまとめて変換するため、夏時間の切り替わりも各レコードの時点で反映される。
+
+    パラメータ:
+    - ns: UTCエポックからのナノ秒（int64）
+    - offsets: 日時文字列のUTCオフセット（分）
+    - zone_codes: タイムゾーン名のコード（zone_namesのインデックス）
+    - zone_names: コード → タイムゾーン名（空文字列はタイムゾーン名なし）
+
+    戻り値:
+    - 各レコードのUTCオフセット（分、int16）。タイムゾーン名がない・不明なレコードはoffsetsのまま
+    """
+    result = np.array(offsets, dtype=np.int16)
+    valid = ns != NAT_NS
+    for code, name in enumerate(zone_names):
+        if not name:
+            continue
+        rows = np.flatnonzero((zone_codes == code) & valid)
+        if len(rows) == 0:
+            continue
+        utc = pd.DatetimeIndex(ns[rows].view('datetime64[ns]')).tz_localize('UTC')
+        try:
+            local = utc.tz_convert(name).tz_localize(None)
+        except Exception:
+            # 不明なタイムゾーン名は日時文字列のオフセットを使う
+            continue
+        result[rows] = (local.asi8 - ns[rows]) // _NS_PER_MINUTE
+    return result
+
+
+def local_day_numbers(ns: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    各レコードの現地の日付を1970-01-01からの日数にする
+
+    パラメータ:
+    - ns: UTCエポックからのナノ秒（int64）
+    - offsets: 各レコードのUTCオフセット（分）
+
+    戻り値:
+    - 日数（int32、日時が欠損したレコードはNO_LOCAL_DAY）
+    """
+    local_ns = ns + offsets.astype(np.int64) * _NS_PER_MINUTE
+    return np.where(ns != NAT_NS, local_ns // _NS_PER_DAY, NO_LOCAL_DAY).astype(np.int32)
+
+
+def frame_local_ns(df: pd.DataFrame, column: str = 'start_date') -> np.ndarray:
+    """
+    DataFrameの日時の列を、各レコードの現地の壁時計時刻のナノ秒にする
+
+    utc_offset列（各レコードのUTCオフセット）があればそれを使い、
+    ない場合（CSVから読み込んだものなど）は列のタイムゾーンの壁時計時刻にする。
+
+    パラメータ:
+    - df: DataFrame
+    - column: 日時の列名
+
+    戻り値:
+    - 壁時計時刻のナノ秒（int64、欠損値はNAT_NS）
+    """
+    series = df[column]
+    if 'utc_offset' in df.columns and series.dt.tz is not None:
+        ns = series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        offsets = df['utc_offset'].to_numpy(dtype=np.int64)
+        return np.where(ns != NAT_NS, ns + offsets * _NS_PER_MINUTE, NAT_NS)
+    if series.dt.tz is not None:
+        series = series.dt.tz_localize(None)
+    return series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def frame_local_days(df: pd.DataFrame) -> np.ndarray:
+    """
+    DataFrameの各レコードが属する現地の日付（1970-01-01からの日数）
+
+    パーサーが出力したlocal_day列があればそのまま使う。
+
+    パラメータ:
+    - df: start_date列を持つDataFrame
+
+    戻り値:
+    - 日数（int32、欠損値はNO_LOCAL_DAY）
+    """
+    if 'local_day' in df.columns:
+        return df['local_day'].to_numpy(dtype=np.int32)
+    local_ns = frame_local_ns(df)
+    return np.where(local_ns != NAT_NS, local_ns // _NS_PER_DAY, NO_LOCAL_DAY).astype(np.int32)
+
+
+def day_number(day: date) -> int:
+    """日付を1970-01-01からの日数にする"""
+    return day.toordinal() - _EPOCH_ORDINAL
+
+
+def day_from_number(number: int) -> date:
+    """1970-01-01からの日数を日付に戻す"""
+    return date.fromordinal(int(number) + _EPOCH_ORDINAL)
+
+
+def day_numbers_to_dates(numbers: np.ndarray) -> np.ndarray:
+    """
+    1970-01-01からの日数の配列を日付の配列に戻す
+
+    パラメータ:
+    - numbers: 日数の配列（NO_LOCAL_DAYは欠損値）
+
+    戻り値:
+    - dateのobject配列（欠損値はNone）
+    """
+    result = np.full(len(numbers), None, dtype=object)
+    valid = numbers != NO_LOCAL_DAY
+    days = numbers[valid].astype('datetime64[D]').astype(object)
+    result[valid] = days
+    return result
@@ -0,0 +1,140 @@
+"""
+HealthKitのデータタイプの登録簿
+
+データタイプごとに識別子・値の型・日次集計の方法を宣言しておくと、
+パーサーは登録されたすべてのタイプを1回の走査で収集し、
+DailyAggregatorは日次集計の方法が宣言されたタイプをまとめて集計する。
+ソースの統合方法を宣言したタイプは、集計の前にSourceMergerが複数のソースの重複を除く。
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+# 日次集計の方法
+# - night_mean / night_min: 前日22:00～当日10:00に始まるレコードの平均・最小（HRVの夜間の範囲と同じ）
+# - day_mean / day_sum / day_max / day_last: 当日0:00～24:00に始まるレコードの平均・合計・最大・最後の値
+REDUCTIONS = ('night_mean', 'night_min', 'day_mean', 'day_sum', 'day_max', 'day_last')
+
+# 複数のソース（iPhone・Apple Watch・他のアプリ）のレコードが重なる場合の統合方法
+# - cumulative: 合計する量（歩数など）。優先度の低いソースの値は、重なっていない時間の割合だけ残す
+# - discrete: その時点の測定値（心拍数など）。優先度の高いソースの記録の前後merge_tolerance秒以内のものを除く
+# - interval: 期間の状態（睡眠ステージなど）。優先度の低いソースの期間は重なっていない部分だけ残す
+MERGE_METHODS = ('cumulative', 'discrete', 'interval')
+
+
+@dataclass(frozen=True)
+class HealthType:
+    """HealthKitのデータタイプの定義"""
+    # データタイプ名（to_dataframes()のキー）
+    name: str
+    # HealthKitの識別子（Record要素のtype属性）
+    identifier: str
+    # 値の型（'float64'、カテゴリ値の場合は'category'）
+    value_dtype: str = 'float64'
+    # 日次集計の方法（Noneの場合はDailyAggregatorの個別の集計処理で扱う）
+    reduction: Optional[str] = None
+    # 日次集計の結果を入れるDailyHealth/daily_healthの列名
+    daily_column: Optional[str] = None
+    # 日次集計の結果に掛ける係数（割合をパーセントにするなど）
+    scale: float = 1.0
+    # 複数のソースのレコードの統合方法（Noneの場合は統合しない）
+    merge: Optional[str] = None
+    # discreteの統合で、優先度の高いソースの記録とみなす前後の幅（秒）
+    merge_tolerance: float = 0.0
+
+    def __post_init__(self):
+        if self.reduction is not None:
+            if self.reduction not in REDUCTIONS:
+                raise ValueError(f"不明な日次集計の方法: {self.reduction}")
+            if not self.daily_column:
+                raise ValueError(f"{self.name}: 日次集計にはdaily_columnが必要です")
+        if self.merge is not None and self.merge not in MERGE_METHODS:
+            raise ValueError(f"不明なソースの統合方法: {self.merge}")
+
+
+class HealthTypeRegistry:
+    """HealthTypeの登録簿"""
+
+    def __init__(self, types: Iterable[HealthType] = ()):
+        """
+        登録簿を初期化
+
+        パラメータ:
+        - types: 最初に登録するHealthTypeのリスト
+        """
+        self._types: Dict[str, HealthType] = {}
+        for health_type in types:
+            self.register(health_type)
+
+    def register(self, health_type: HealthType):
+        """
+        データタイプを登録（同じ名前のものは置き換える）
+
+        パラメータ:
+        - health_type: 登録するHealthType
+        """
+        for existing in self._types.values():
+            if existing.identifier == health_type.identifier and existing.name != health_type.name:
+                raise ValueError(
+                    f"{health_type.identifier}は既に{existing.name}として登録されています"
+                )
+        self._types[health_type.name] = health_type
+
+    def get(self, name: str) -> HealthType:
+        """
+        データタイプを取得
+
+        パラメータ:
+        - name: データタイプ名
+
+        戻り値:
+        - HealthType
+        """
+        if name not in self._types:
+            raise ValueError(f"不明なデータタイプ: {name}")
+        return self._types[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._types
+
+    def __iter__(self):
+        return iter(self._types.values())
+
+    def data_types(self) -> Dict[str, str]:
+        """データタイプ名からHealthKit識別子への辞書（AppleHealthParser.DATA_TYPESの形）"""
+        return {health_type.name: health_type.identifier for health_type in self._types.values()}
+
+    def reduced_types(self) -> List[HealthType]:
+        """日次集計の方法が宣言されたデータタイプ"""
+        return [health_type for health_type in self._types.values() if health_type.reduction]
+
+    def merged_types(self) -> List[HealthType]:
+        """複数のソースの統合方法が宣言されたデータタイプ"""
+        return [health_type for health_type in self._types.values() if health_type.merge]
+
+    def copy(self) -> 'HealthTypeRegistry':
+        """登録簿の複製（既定の登録簿を変更せずにタイプを追加する場合に使う）"""
+        return HealthTypeRegistry(self._types.values())
+
+
+# 既定の登録簿
+DEFAULT_REGISTRY = HealthTypeRegistry([
+    # DailyAggregatorの個別の集計処理で扱うタイプ
+    HealthType('sleep', 'HKCategoryTypeIdentifierSleepAnalysis', value_dtype='category', merge='interval'),
+    HealthType('hrv', 'HKQuantityTypeIdentifierHeartRateVariabilitySDNN',
+               merge='discrete', merge_tolerance=300.0),
+    HealthType('heart_rate', 'HKQuantityTypeIdentifierHeartRate', merge='discrete', merge_tolerance=300.0),
+    HealthType('resting_heart_rate', 'HKQuantityTypeIdentifierRestingHeartRate', merge='discrete'),
+    HealthType('steps', 'HKQuantityTypeIdentifierStepCount', merge='cumulative'),
+    HealthType('active_energy', 'HKQuantityTypeIdentifierActiveEnergyBurned', merge='cumulative'),
+    # 夜間のバイタル（登録簿の宣言だけで日次集計する）
+    HealthType('oxygen_saturation', 'HKQuantityTypeIdentifierOxygenSaturation',
+               reduction='night_mean', daily_column='spo2_avg', scale=100.0,
+               merge='discrete', merge_tolerance=300.0),
+    HealthType('respiratory_rate', 'HKQuantityTypeIdentifierRespiratoryRate',
+               reduction='night_mean', daily_column='respiratory_rate_avg',
+               merge='discrete', merge_tolerance=300.0),
+    HealthType('wrist_temperature', 'HKQuantityTypeIdentifierAppleSleepingWristTemperature',
+               reduction='night_mean', daily_column='wrist_temperature_avg', merge='discrete'),
+    HealthType('vo2max', 'HKQuantityTypeIdentifierVO2Max',
+               reduction='day_last', daily_column='vo2max', merge='discrete'),
+])
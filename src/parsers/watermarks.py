@@ -0,0 +1,180 @@
+"""
+インクリメンタルインポートのための高水位標（データタイプ・ソースごとの最新開始日時）
+"""
+import json
+from datetime import date, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import pandas as pd
+from src.parsers.timestamps import NO_LOCAL_DAY, day_from_number, frame_local_days
+
+# (データタイプ, ソース名) → 取り込み済みの最新の開始日時
+Watermarks = Dict[Tuple[str, str], pd.Timestamp]
+
+# 日次集計は前日18:00からのデータを参照するため、再集計の初日より1日前から読み込む
+LOOKBACK_DAYS = 1
+# 最新の高水位標よりこの日数以上古いソース（使わなくなった端末など）は再開位置の計算から外す
+STALE_SOURCE_DAYS = 30
+
+
+def compute_watermarks(dataframes: Dict[str, pd.DataFrame]) -> Watermarks:
+    """
+    パースしたデータからデータタイプ・ソースごとの最新開始日時を求める
+
+    utc_offset列があれば、最新のレコード自身のUTCオフセットで表す（オフセットが混在する列はUTCのため、
+    そのままでは日付が現地の日付とずれる）。
+
+    パラメータ:
+    - dataframes: データタイプごとのDataFrameの辞書
+
+    戻り値:
+    - (データタイプ, ソース名)ごとの最新開始日時
+    """
+    watermarks = {}
+    for data_type, df in dataframes.items():
+        if df.empty or 'source' not in df.columns or 'start_date' not in df.columns:
+            continue
+        latest = df.groupby('source', observed=True)['start_date'].max()
+        offsets = {}
+        if 'utc_offset' in df.columns:
+            is_latest = df['start_date'] == df.groupby('source', observed=True)['start_date'].transform('max')
+            at_latest = df.loc[is_latest, ['source', 'utc_offset']].drop_duplicates('source')
+            offsets = dict(zip(at_latest['source'].tolist(), at_latest['utc_offset'].tolist()))
+        for source, start in latest.items():
+            if pd.notna(start):
+                if source in offsets and start.tzinfo is not None:
+                    start = start.tz_convert(timezone(timedelta(minutes=int(offsets[source]))))
+                watermarks[(data_type, source)] = start
+    return watermarks
+
+
+def merge_watermarks(old: Watermarks, new: Watermarks) -> Watermarks:
+    """
+    高水位標を結合（同じキーは新しい方を残す）
+
+    パラメータ:
+    - old: 既存の高水位標
+    - new: 追加する高水位標
+
+    戻り値:
+    - 結合した高水位標
+    """
+    merged = dict(old)
+    for key, start in new.items():
+        if key not in merged or start > merged[key]:
+            merged[key] = start
+    return merged
+
+
+def resume_date(watermarks: Watermarks) -> Optional[date]:
+    """
+    再集計を始める日付を求める
+
+    新しいレコードは各ソースの高水位標より後にしか現れないため、
+    現役のソースのうち最も古い高水位標の日付から再集計すれば十分。
+    日付は高水位標のレコードの現地の日付（compute_watermarks()が各レコードのオフセットで表したもの）。
+
+    パラメータ:
+    - watermarks: 取り込み済みの高水位標
+
+    戻り値:
+    - 再集計の初日（高水位標がない場合はNone＝全期間）
+    """
+    if not watermarks:
+        return None
+    stale = stale_watermarks(watermarks)
+    return min(start for key, start in watermarks.items() if key not in stale).date()
+
+
+def stale_watermarks(watermarks: Watermarks) -> Watermarks:
+    """
+    再開位置の計算から外す古いソースの高水位標
+
+    最新の高水位標よりSTALE_SOURCE_DAYS日以上古いソース。これらのソースは再集計の初日ではなく
+    自身の高水位標より後のレコードだけを読み込む（RecordFilterのstream_since）。
+
+    パラメータ:
+    - watermarks: 取り込み済みの高水位標
+
+    戻り値:
+    - 古いソースの高水位標
+    """
+    if not watermarks:
+        return {}
+    threshold = max(watermarks.values()) - pd.Timedelta(days=STALE_SOURCE_DAYS)
+    return {key: start for key, start in watermarks.items() if start < threshold}
+
+
+def backfill_date(dataframes: Dict[str, pd.DataFrame], stale: Watermarks, resume: date) -> Optional[date]:
+    """
+    古いソースが再集計の初日より前の日付のレコードを新たに送ってきた場合、その最初の日付
+
+    使わなくなった端末が後から同期した場合など。その日付から再集計し直さないと取りこぼす。
+
+    パラメータ:
+    - dataframes: パースしたデータ（データタイプごとのDataFrameの辞書）
+    - stale: 古いソースの高水位標（stale_watermarks()）
+    - resume: 再集計の初日
+
+    戻り値:
+    - 再集計の初日より前の、新しいレコードの最初の現地の日付（なければNone）
+    """
+    earliest = None
+    for (data_type, source), start in stale.items():
+        df = dataframes.get(data_type)
+        if df is None or df.empty or 'source' not in df.columns or 'start_date' not in df.columns:
+            continue
+        days = frame_local_days(df[(df['source'] == source) & (df['start_date'] > start)])
+        days = days[days != NO_LOCAL_DAY]
+        if len(days) and (earliest is None or int(days.min()) < earliest):
+            earliest = int(days.min())
+    if earliest is None or day_from_number(earliest) >= resume:
+        return None
+    return day_from_number(earliest)
+
+
+def parse_start_date(resume: date) -> date:
+    """
+    再集計に必要なレコードの読み込み開始日
+
+    パラメータ:
+    - resume: 再集計の初日
+
+    戻り値:
+    - これより前に始まるレコードはパース時に読み飛ばしてよい日付
+    """
+    return resume - timedelta(days=LOOKBACK_DAYS)
+
+
+def save_watermarks(watermarks: Watermarks, path: Path):
+    """
+    高水位標をJSONファイルに保存（DBへの反映はインポート完了後に行う）
+
+    パラメータ:
+    - watermarks: 高水位標
+    - path: 保存先のパス
+    """
+    entries = [
+        {'data_type': data_type, 'source': source, 'last_start_date': start.isoformat()}
+        for (data_type, source), start in sorted(watermarks.items())
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+
+
+def load_watermarks(path: Path) -> Watermarks:
+    """
+    JSONファイルから高水位標を読み込む
+
+    パラメータ:
+    - path: 保存先のパス
+
+    戻り値:
+    - 高水位標
+    """
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    return {
+        (entry['data_type'], entry['source']): pd.Timestamp(entry['last_start_date'])
+        for entry in entries
+    }
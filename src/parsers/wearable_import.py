@@ -0,0 +1,328 @@
+"""
+Apple Health以外のウェアラブル（Garmin・Fitbit・Oura）のエクスポートを取り込む共通の処理
+
+各インポーターはファイルを1つずつ読み、値をHealthKitのデータタイプ・単位に揃えたRecordBatchと、
+Workout要素と同じ形の属性のイベントをRecordCollectorに渡す。
+ファイルはプロセスプールで並列に読み込み、ファイルの順番にRecordCollector.merge()で結合するため、
+結果はAppleHealthParser.to_dataframes()と同じ列・型のDataFrameになり、DailyAggregatorでそのまま集計できる。
+"""
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from src.parsers.apple_health import AppleHealthParser
+from src.parsers.hrv_beats import HRV_BEATS_TABLE
+from src.parsers.record_collector import RecordCollector
+from src.parsers.record_filter import RecordFilter
+from src.parsers.timestamps import NAT_NS, TIME_ZONE_METADATA_KEY, format_timestamp
+from src.parsers.type_registry import DEFAULT_REGISTRY, HealthTypeRegistry
+from src.parsers.workout_tables import WORKOUT_TABLES
+
+# 1プロセスにまとめて渡すファイル数（小さなファイルが数千あるアーカイブを想定）
+FILES_PER_TASK = 64
+
+_NS_PER_SEC = 1_000_000_000
+_NS_PER_MINUTE = 60 * _NS_PER_SEC
+
+# ワークアウトの統計に使うHealthKitの識別子
+HEART_RATE_STATISTIC_TYPE = 'HKQuantityTypeIdentifierHeartRate'
+# 対応するHealthKitのワークアウト識別子がない種目
+OTHER_WORKOUT_TYPE = 'HKWorkoutActivityTypeOther'
+
+
+def localize(local_ns: np.ndarray, time_zone: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    タイムゾーンのない現地時刻をUTCエポックナノ秒とUTCオフセットにする
+
+    パラメータ:
+    - local_ns: 現地の壁時計時刻のナノ秒（int64、欠損値はNAT_NS）
+    - time_zone: IANAのタイムゾーン名（Noneの場合はUTCとして扱う）
+
+    戻り値:
+    - (UTCエポックからのナノ秒（int64）, UTCオフセット（分、int16）)
+    """
+    local_ns = np.asarray(local_ns, dtype=np.int64)
+    if not time_zone:
+        return local_ns, np.zeros(len(local_ns), dtype=np.int16)
+    # 夏時間の切り替わりで存在しない時刻は後ろにずらし、重複する時刻は夏時間として扱う
+    index = pd.DatetimeIndex(local_ns.view('datetime64[ns]')).tz_localize(
+        time_zone, ambiguous=np.ones(len(local_ns), dtype=bool), nonexistent='shift_forward'
+    )
+    ns = index.asi8
+    valid = local_ns != NAT_NS
+    offsets = np.where(valid, (local_ns - ns) // _NS_PER_MINUTE, 0).astype(np.int16)
+    return np.where(valid, ns, NAT_NS), offsets
+
+
+def zone_offsets_at(ns: np.ndarray, time_zone: Optional[str]) -> np.ndarray:
+    """
+    UTCの日時におけるタイムゾーンのUTCオフセット
+
+    パラメータ:
+    - ns: UTCエポックからのナノ秒（int64）
+    - time_zone: IANAのタイムゾーン名（Noneの場合はUTC）
+
+    戻り値:
+    - UTCオフセット（分、int16）
+    """
+    ns = np.asarray(ns, dtype=np.int64)
+    if not time_zone:
+        return np.zeros(len(ns), dtype=np.int16)
+    local = pd.DatetimeIndex(ns.view('datetime64[ns]')).tz_localize('UTC').tz_convert(time_zone)
+    offsets = (local.tz_localize(None).asi8 - ns) // _NS_PER_MINUTE
+    return np.where(ns != NAT_NS, offsets, 0).astype(np.int16)
+
+
+def workout_events(collector: RecordCollector, activity_type: str, source: str,
+                   start_ns: int, end_ns: int, offset: int,
+                   energy_kcal: float = np.nan, distance_km: float = np.nan,
+                   average_heart_rate: float = np.nan, maximum_heart_rate: float = np.nan,
+                   time_zone: str = ''):
+    """
+    ワークアウトを、export.xmlのWorkout要素と同じ形の属性のイベントとしてコレクターに渡す
+
+    パラメータ:
+    - collector: RecordCollector
+    - activity_type: HealthKitのワークアウト識別子（'HKWorkoutActivityTypeRunning'など）
+    - source: ソース名
+    - start_ns, end_ns: 開始・終了日時のUTCエポックナノ秒
+    - offset: UTCオフセット（分）
+    - energy_kcal: 消費エネルギー（kcal、不明な場合はNaN）
+    - distance_km: 距離（km、不明な場合はNaN）
+    - average_heart_rate, maximum_heart_rate: 平均・最大心拍数（不明な場合はNaN）
+    - time_zone: 記録した場所のタイムゾーン名（わかる場合）
+    """
+    start_date = format_timestamp(start_ns, offset)
+    end_date = format_timestamp(end_ns, offset)
+    attrib = {
+        'workoutActivityType': activity_type,
+        'sourceName': source,
+        'startDate': start_date,
+        'endDate': end_date,
+        'duration': repr((end_ns - start_ns) / _NS_PER_MINUTE),
+        'durationUnit': 'min',
+    }
+    if not np.isnan(energy_kcal):
+        attrib['totalEnergyBurned'] = repr(float(energy_kcal))
+        attrib['totalEnergyBurnedUnit'] = 'kcal'
+    if not np.isnan(distance_km):
+        attrib['totalDistance'] = repr(float(distance_km))
+        attrib['totalDistanceUnit'] = 'km'
+    collector.start('Workout', attrib)
+    if not (np.isnan(average_heart_rate) and np.isnan(maximum_heart_rate)):
+        statistics = {'type': HEART_RATE_STATISTIC_TYPE, 'startDate': start_date,
+                      'endDate': end_date, 'unit': 'count/min'}
+        if not np.isnan(average_heart_rate):
+            statistics['average'] = repr(float(average_heart_rate))
+        if not np.isnan(maximum_heart_rate):
+            statistics['maximum'] = repr(float(maximum_heart_rate))
+        collector.start('WorkoutStatistics', statistics)
+    if time_zone:
+        collector.start('MetadataEntry', {'key': TIME_ZONE_METADATA_KEY, 'value': time_zone})
+    collector.end('Workout')
+
+
+class WearableImporter:
+    """
+    ウェアラブルのエクスポート（ディレクトリまたはzip）のファイルを並列に読み込むインポーターの基底クラス
+
+    サブクラスはSOURCE_NAME・FILE_SUFFIXESとread_file()を定義する。
+    """
+
+    # レコードのソース名（sourceName）
+    SOURCE_NAME = ''
+    # 読み込むファイルの拡張子（小文字）
+    FILE_SUFFIXES: Tuple[str, ...] = ('.json',)
+
+    def __init__(self, path: str, registry: Optional[HealthTypeRegistry] = None,
+                 record_filter: Optional[RecordFilter] = None, workers: Optional[int] = None):
+        """
+        インポーターを初期化
+
+        パラメータ:
+        - path: エクスポートのディレクトリ、zip、または単独のファイル
+        - registry: 収集するデータタイプの登録簿（省略時はDEFAULT_REGISTRY）
+        - record_filter: 期間・データタイプ・ソースの絞り込み条件
+        - workers: ファイルを読み込むプロセス数（Noneの場合はCPU数）
+        """
+        self.path = str(path)
+        self.registry = registry or DEFAULT_REGISTRY
+        self.record_filter = record_filter or RecordFilter()
+        self.workers = workers or os.cpu_count() or 1
+        self.is_zip = zipfile.is_zipfile(self.path) if os.path.isfile(self.path) else False
+
+    def list_files(self) -> List[str]:
+        """
+        読み込むファイルの一覧
+
+        戻り値:
+        - ファイルのパス（zipの場合はメンバー名）の名前順のリスト
+        """
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as archive:
+                names = [name for name in archive.namelist() if not name.endswith('/')]
+        elif os.path.isfile(self.path):
+            names = [self.path]
+        else:
+            names = [str(path) for path in Path(self.path).rglob('*') if path.is_file()]
+        return sorted(name for name in names if self.accepts_file(name))
+
+    def accepts_file(self, name: str) -> bool:
+        """
+        ファイルを読み込むかどうか（サブクラスでファイル名の条件を加える）
+
+        パラメータ:
+        - name: ファイルのパスまたはメンバー名
+
+        戻り値:
+        - 読み込む場合はTrue
+        """
+        return name.lower().endswith(self.FILE_SUFFIXES)
+
+    def read_file(self, name: str, stream: BinaryIO, collector: RecordCollector):
+        """
+        1つのファイルを読み込み、レコードとワークアウトをコレクターに渡す（サブクラスで実装）
+
+        パラメータ:
+        - name: ファイルのパスまたはメンバー名
+        - stream: ファイルのバイナリストリーム
+        - collector: RecordCollector
+        """
+        raise NotImplementedError
+
+    def new_collector(self) -> RecordCollector:
+        """Apple Healthのパースと同じ設定のRecordCollector"""
+        return RecordCollector(
+            self.registry, AppleHealthParser.SLEEP_STAGES, AppleHealthParser.WORKOUT_TYPES,
+            self.record_filter,
+        )
+
+    def read_files(self, names: List[str]) -> Tuple[RecordCollector, int]:
+        """
+        複数のファイルを読み込む（ワーカープロセスで実行）
+
+        パラメータ:
+        - names: ファイルのパスまたはメンバー名のリスト
+
+        戻り値:
+        - (デコード済みのRecordCollector, 読み込めなかったファイル数)
+        """
+        collector = self.new_collector()
+        failed = 0
+        archive = zipfile.ZipFile(self.path) if self.is_zip else None
+        try:
+            for name in names:
+                try:
+                    with (archive.open(name) if archive else open(name, 'rb')) as stream:
+                        self.read_file(name, stream, collector)
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    print(f"警告: {name}を読み込めません: {e}")
+                    failed += 1
+        finally:
+            if archive is not None:
+                archive.close()
+        collector.flush()
+        return collector, failed
+
+    def collect(self) -> RecordCollector:
+        """
+        すべてのファイルを並列に読み込み、ファイルの順番に結合
+
+        戻り値:
+        - RecordCollector
+        """
+        names = self.list_files()
+        batches = [names[i:i + FILES_PER_TASK] for i in range(0, len(names), FILES_PER_TASK)]
+        if self.workers > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self.read_files, batches))
+        else:
+            results = [self.read_files(batch) for batch in batches]
+
+        collector = self.new_collector()
+        failed = 0
+        for partial, partial_failed in results:
+            collector.merge(partial)
+            failed += partial_failed
+        print(f"{self.SOURCE_NAME}: {len(names)}ファイル、{collector.record_count}件を読み込みました"
+              + (f"（読み込めなかったファイル: {failed}件）" if failed else ''))
+        return collector
+
+    def ingest(self) -> Dict[str, pd.DataFrame]:
+        """
+        エクスポートを読み込み、AppleHealthParser.to_dataframes()と同じ形のDataFrameにする
+
+        戻り値:
+        - データタイプごとのDataFrame・hrv_beats・ワークアウトのテーブルの辞書
+        """
+        collector = self.collect()
+        dataframes = {
+            data_type: columns.to_frame() for data_type, columns in collector.records.items()
+        }
+        dataframes[HRV_BEATS_TABLE] = collector.hrv_beats.to_frame()
+        dataframes.update(collector.workouts.to_frames())
+        return dataframes
+
+
+def _concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """DataFrameを縦に結合（カテゴリ型の列はカテゴリを合わせてカテゴリ型のまま結合する）"""
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    for column in frames[0].columns:
+        zones = {
+            str(df[column].dt.tz) for df in frames
+            if column in df.columns and isinstance(df[column].dtype, pd.DatetimeTZDtype)
+        }
+        if len(zones) > 1:
+            # UTCオフセットが異なる日時の列はobject型にならないよう、to_datetime_index()と同じくUTCで表現する
+            frames = [
+                df.assign(**{column: df[column].dt.tz_convert('UTC')})
+                if isinstance(df[column].dtype, pd.DatetimeTZDtype) else df
+                for df in frames
+            ]
+    combined = pd.concat(frames, ignore_index=True)
+    for column in frames[0].columns:
+        if all(column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype) for df in frames):
+            # 空のカテゴリと文字列のカテゴリでは型が異なるため、カテゴリをobject型に揃える
+            combined[column] = union_categoricals([
+                df[column].cat.set_categories(df[column].cat.categories.astype(object)) for df in frames
+            ])
+    return combined
+
+
+def combine_dataframes(sources: Iterable[Dict[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """
+    複数のエクスポートのDataFrameを結合（Apple Healthと他のウェアラブルを合わせて集計する）
+
+    hrv_beatsのsample_idとワークアウトの子テーブルのworkout_idは、前のエクスポートの行数だけずらす。
+    ソースが重なる時間帯の重複は、DailyAggregatorのSourceMergerが優先度に従って除く。
+
+    パラメータ:
+    - sources: to_dataframes()・ingest()の結果の辞書のリスト（先頭のものの行番号がそのまま残る）
+
+    戻り値:
+    - 結合したDataFrameの辞書
+    """
+    collected: Dict[str, List[pd.DataFrame]] = {}
+    hrv_rows = 0
+    workout_rows = 0
+    for dataframes in sources:
+        for name, df in dataframes.items():
+            if df.empty:
+                collected.setdefault(name, [])
+                continue
+            if name == HRV_BEATS_TABLE and hrv_rows:
+                df = df.assign(sample_id=df['sample_id'] + hrv_rows)
+            elif name in WORKOUT_TABLES and workout_rows:
+                df = df.assign(workout_id=df['workout_id'] + workout_rows)
+            collected.setdefault(name, []).append(df)
+        hrv_rows += len(dataframes.get('hrv', ()))
+        workout_rows += len(dataframes.get('workouts', ()))
+    return {name: _concat_frames(frames) for name, frames in collected.items()}
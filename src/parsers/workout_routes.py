@@ -0,0 +1,401 @@
+"""
+ワークアウトルート（workout-routes/*.gpx）の取り込みとルート指標の計算
+"""
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePosixPath
+from typing import BinaryIO, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from src.parsers.export_archive import HealthExport
+
+# 地球の平均半径（メートル）
+EARTH_RADIUS_M = 6371008.8
+# 1区間（スプリット）の距離（メートル）
+SPLIT_DISTANCE_M = 1000.0
+# 1プロセスにまとめて渡すGPXファイル数
+FILES_PER_TASK = 64
+
+ROUTE_COLUMNS = [
+    'workout_id', 'route_file', 'point_count', 'start_time', 'end_time', 'duration_sec',
+    'distance_m', 'elevation_gain_m', 'avg_pace_sec_per_km', 'pace_variability',
+]
+SPLIT_COLUMNS = ['workout_id', 'route_file', 'km', 'split_sec', 'distance_m']
+
+
+def _local_name(tag: str) -> str:
+    """名前空間を除いた要素名（'{http://www.topografix.com/GPX/1/1}trkpt' → 'trkpt'）"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_gpx(stream: BinaryIO) -> Dict[str, np.ndarray]:
+    """
+    GPXファイルのトラックポイントを配列として読み込む
+
+    パラメータ:
+    - stream: GPXファイルのバイナリストリーム
+
+    戻り値:
+    - lat, lon, ele（float64）, time（UTCエポックのint64ナノ秒）の辞書
+    """
+    lats: List[float] = []
+    lons: List[float] = []
+    eles: List[float] = []
+    times: List[str] = []
+    ele = np.nan
+    time = ''
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        name = _local_name(elem.tag)
+        if event == 'start':
+            if name == 'trkpt':
+                ele = np.nan
+                time = ''
+            continue
+        if name == 'ele':
+            ele = float(elem.text) if elem.text else np.nan
+        elif name == 'time':
+            time = (elem.text or '').strip()
+        elif name == 'trkpt':
+            lats.append(float(elem.get('lat')))
+            lons.append(float(elem.get('lon')))
+            eles.append(ele)
+            times.append(time.rstrip('Z'))
+            elem.clear()
+
+    # ISO 8601のUTC時刻（'2024-03-01T07:00:00Z'）はnumpyでまとめて変換できる
+    time_values = np.array([t or 'NaT' for t in times], dtype='datetime64[ns]')
+    return {
+        'lat': np.array(lats, dtype=np.float64),
+        'lon': np.array(lons, dtype=np.float64),
+        'ele': np.array(eles, dtype=np.float64),
+        'time': time_values.view(np.int64),
+    }
+
+
+def _parse_members(export_path: str, members: List[str]) -> List[Tuple[str, Optional[Dict[str, np.ndarray]]]]:
+    """
+    複数のGPXファイルを読み込む（ワーカープロセスで実行）
+
+    パラメータ:
+    - export_path: エクスポートのパス（zipはプロセスごとに開き直す）
+    - members: GPXファイルのメンバー名のリスト
+
+    戻り値:
+    - (メンバー名, parse_gpxの結果（読み込めない場合はNone）)のリスト
+    """
+    results = []
+    with HealthExport(export_path) as export:
+        for member in members:
+            try:
+                with export.open_member(member) as f:
+                    results.append((member, parse_gpx(f)))
+            except (ET.ParseError, ValueError, TypeError):
+                results.append((member, None))
+    return results
+
+
+def haversine_m(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """
+    2点間の大円距離（メートル）をまとめて計算
+
+    パラメータ:
+    - lat1, lon1: 始点の緯度・経度（度）
+    - lat2, lon2: 終点の緯度・経度（度）
+
+    戻り値:
+    - 距離（メートル）の配列
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def compute_route_metrics(routes: List[Dict[str, np.ndarray]]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    複数ルートの指標を、全ルートの点を連結した配列に対してまとめて計算
+
+    パラメータ:
+    - routes: parse_gpxの結果のリスト
+
+    戻り値:
+    - (ルートごとの指標のDataFrame, 1kmごとのスプリットのDataFrame)
+      いずれもroute列にroutesのインデックスを持つ
+    """
+    counts = np.array([len(route['lat']) for route in routes], dtype=np.int64)
+    route_count = len(routes)
+    empty_splits = pd.DataFrame({
+        'route': np.empty(0, dtype=np.int64), 'km': np.empty(0, dtype=np.int64),
+        'split_sec': np.empty(0), 'distance_m': np.empty(0),
+    })
+    if counts.sum() == 0:
+        metrics = pd.DataFrame({'route': np.arange(route_count), 'point_count': counts})
+        return metrics, empty_splits
+
+    lat = np.concatenate([route['lat'] for route in routes])
+    lon = np.concatenate([route['lon'] for route in routes])
+    ele = np.concatenate([route['ele'] for route in routes])
+    time_ns = np.concatenate([route['time'] for route in routes])
+    route_of_point = np.repeat(np.arange(route_count), counts)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    # 隣接する点の区間（ルートをまたぐ区間は除く）
+    same_route = route_of_point[1:] == route_of_point[:-1]
+    segment_route = route_of_point[1:][same_route]
+    segment_m = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])[same_route]
+    climb = np.diff(ele)[same_route]
+    climb = np.where(np.isnan(climb) | (climb < 0), 0.0, climb)
+
+    distance = np.bincount(segment_route, weights=segment_m, minlength=route_count)
+    elevation_gain = np.bincount(segment_route, weights=climb, minlength=route_count)
+
+    nat = np.iinfo(np.int64).min
+    valid_time = time_ns != nat
+    start_time = np.full(route_count, nat, dtype=np.int64)
+    end_time = np.full(route_count, nat, dtype=np.int64)
+    if valid_time.any():
+        # ルート内の最初・最後の有効な時刻
+        first = np.full(route_count, np.iinfo(np.int64).max)
+        last = np.full(route_count, nat)
+        np.minimum.at(first, route_of_point[valid_time], time_ns[valid_time])
+        np.maximum.at(last, route_of_point[valid_time], time_ns[valid_time])
+        has_time = last != nat
+        start_time[has_time] = first[has_time]
+        end_time[has_time] = last[has_time]
+    duration_sec = np.where(start_time != nat, (end_time - start_time) / 1e9, np.nan)
+
+    splits = _compute_splits(route_of_point, starts, segment_m, same_route, time_ns, valid_time)
+    if splits.empty:
+        pace_variability = np.full(route_count, np.nan)
+    else:
+        # 1km区間のペースの変動係数（標準偏差 / 平均）
+        full = splits[splits['distance_m'] >= SPLIT_DISTANCE_M - 1e-6]
+        grouped = full.groupby('route')['split_sec']
+        pace_variability = (grouped.std(ddof=0) / grouped.mean()).reindex(np.arange(route_count)).to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_pace = np.where(distance > 0, duration_sec / (distance / SPLIT_DISTANCE_M), np.nan)
+
+    metrics = pd.DataFrame({
+        'route': np.arange(route_count),
+        'point_count': counts,
+        'start_time': pd.to_datetime(np.where(start_time != nat, start_time, nat), utc=True),
+        'end_time': pd.to_datetime(np.where(end_time != nat, end_time, nat), utc=True),
+        'duration_sec': duration_sec,
+        'distance_m': distance,
+        'elevation_gain_m': elevation_gain,
+        'avg_pace_sec_per_km': avg_pace,
+        'pace_variability': pace_variability,
+    })
+    return metrics, splits if not splits.empty else empty_splits
+
+
+def _compute_splits(route_of_point: np.ndarray, starts: np.ndarray, segment_m: np.ndarray,
+                    same_route: np.ndarray, time_ns: np.ndarray, valid_time: np.ndarray) -> pd.DataFrame:
+    """
+    各ルートの1kmごとの通過時刻を線形補間し、スプリットタイムを求める
+
+    パラメータ:
+    - route_of_point: 各点のルート番号
+    - starts: 各ルートの先頭の点の位置
+    - segment_m: ルート内の区間の距離
+    - same_route: 隣接する点が同じルートかどうか
+    - time_ns: 各点の時刻（UTCエポックのint64ナノ秒）
+    - valid_time: 時刻が有効かどうか
+
+    戻り値:
+    - route, km, split_sec, distance_m列のDataFrame（最後の1km未満の区間も含む）
+    """
+    if not valid_time.all():
+        # 時刻のない点を含むルートはスプリットを計算しない
+        bad_routes = np.unique(route_of_point[~valid_time])
+    else:
+        bad_routes = np.empty(0, dtype=np.int64)
+
+    # ルートの先頭からの累積距離
+    step = np.zeros(len(route_of_point))
+    step[1:][same_route] = segment_m
+    cumulative = np.cumsum(step)
+    cumulative -= cumulative[starts][route_of_point]
+
+    # 点ごとに「何km目の区間にいるか」を求め、区間が切り替わる点で境界を補間する
+    km_index = np.floor(cumulative / SPLIT_DISTANCE_M).astype(np.int64)
+    crossing = np.flatnonzero(same_route & (km_index[1:] > km_index[:-1])) + 1
+    rows = []
+    t = time_ns.astype(np.float64)
+    if len(crossing):
+        # 1区間で複数kmをまたぐ場合にも対応するため、またいだ各km境界を展開する
+        spans = km_index[crossing] - km_index[crossing - 1]
+        point = np.repeat(crossing, spans)
+        boundary_km = np.repeat(km_index[crossing - 1], spans) + (
+            np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans) + 1
+        )
+        boundary_m = boundary_km * SPLIT_DISTANCE_M
+        d0 = cumulative[point - 1]
+        d1 = cumulative[point]
+        ratio = np.where(d1 > d0, (boundary_m - d0) / np.where(d1 > d0, d1 - d0, 1.0), 0.0)
+        boundary_time = t[point - 1] + ratio * (t[point] - t[point - 1])
+        rows.append(pd.DataFrame({
+            'route': route_of_point[point],
+            'km': boundary_km,
+            'time': boundary_time,
+            'distance_m': boundary_m,
+        }))
+
+    # 各ルートの始点と終点（終点は最後の1km未満の区間になる）
+    route_count = len(starts)
+    ends = np.concatenate([starts[1:], [len(route_of_point)]]) - 1
+    nonempty = ends >= starts
+    rows.append(pd.DataFrame({
+        'route': np.arange(route_count)[nonempty],
+        'km': np.zeros(nonempty.sum(), dtype=np.int64),
+        'time': t[starts[nonempty]],
+        'distance_m': np.zeros(nonempty.sum()),
+    }))
+    rows.append(pd.DataFrame({
+        'route': np.arange(route_count)[nonempty],
+        'km': km_index[ends[nonempty]] + 1,
+        'time': t[ends[nonempty]],
+        'distance_m': cumulative[ends[nonempty]],
+    }))
+
+    boundaries = pd.concat(rows, ignore_index=True)
+    boundaries = boundaries[~boundaries['route'].isin(bad_routes)]
+    # 終点がちょうどkm境界上にある場合の重複を除く
+    boundaries = boundaries.sort_values(['route', 'distance_m', 'km'], kind='stable')
+    boundaries = boundaries.drop_duplicates(['route', 'distance_m'], keep='first')
+
+    previous = boundaries.groupby('route')[['time', 'distance_m']].shift(1)
+    splits = boundaries.assign(
+        split_sec=(boundaries['time'] - previous['time']) / 1e9,
+        distance_m=boundaries['distance_m'] - previous['distance_m'],
+    ).dropna(subset=['split_sec'])
+    splits = splits[splits['distance_m'] > 0]
+    return splits[['route', 'km', 'split_sec', 'distance_m']].reset_index(drop=True)
+
+
+class WorkoutRouteIngester:
+    """
+    エクスポート内のGPXファイルを並列に読み込み、ワークアウトに紐付けて指標を計算するクラス
+    """
+
+    ROUTE_DIRECTORY = 'workout-routes'
+
+    def __init__(self, export: HealthExport, workers: Optional[int] = None):
+        """
+        取り込み処理を初期化
+
+        パラメータ:
+        - export: HealthExportオブジェクト
+        - workers: GPXファイルを読み込むプロセス数（Noneの場合はCPU数）
+        """
+        self.export = export
+        self.workers = workers or os.cpu_count() or 1
+
+    def load_routes(self) -> List[Tuple[str, Dict[str, np.ndarray]]]:
+        """
+        すべてのGPXファイルを読み込む
+
+        戻り値:
+        - (メンバー名, parse_gpxの結果)のリスト（メンバー名順、読み込めなかったファイルは除く）
+        """
+        members = self.export.list_members(self.ROUTE_DIRECTORY, '.gpx')
+        if not members:
+            return []
+        batches = [members[i:i + FILES_PER_TASK] for i in range(0, len(members), FILES_PER_TASK)]
+
+        results = []
+        if self.workers > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [
+                    executor.submit(_parse_members, self.export.path, batch)
+                    for batch in batches
+                ]
+                for future in futures:
+                    results.extend(future.result())
+        else:
+            for batch in batches:
+                results.extend(_parse_members(self.export.path, batch))
+
+        skipped = sum(1 for _, route in results if route is None)
+        if skipped:
+            print(f"警告: 読み込めなかったGPXファイル{skipped}件をスキップしました")
+        return [(member, route) for member, route in results if route is not None]
+
+    def ingest(self, workouts: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """
+        GPXファイルを読み込み、ワークアウトに紐付けてルートの指標を計算
+
+        パラメータ:
+        - workouts: to_dataframes()の'workouts'テーブル
+
+        戻り値:
+        - 'workout_routes'（ルートごとの指標）と'route_splits'（1kmごとのスプリット）のDataFrameの辞書
+        """
+        routes = self.load_routes()
+        if not routes:
+            return {
+                'workout_routes': pd.DataFrame(columns=ROUTE_COLUMNS),
+                'route_splits': pd.DataFrame(columns=SPLIT_COLUMNS),
+            }
+        print(f"ワークアウトルート: {len(routes)}件のGPXファイルを読み込み")
+
+        members = [member for member, _ in routes]
+        metrics, splits = compute_route_metrics([route for _, route in routes])
+        route_files = np.array([PurePosixPath(member.replace(os.sep, '/')).name for member in members], dtype=object)
+        metrics['route_file'] = route_files[metrics['route'].to_numpy()]
+        metrics['workout_id'] = self._link_workouts(metrics, workouts)
+        splits['route_file'] = route_files[splits['route'].to_numpy()]
+        splits['workout_id'] = metrics['workout_id'].to_numpy()[splits['route'].to_numpy()]
+
+        linked = metrics['workout_id'].notna().sum()
+        print(f"  {linked}件のルートをワークアウトに紐付けました")
+        return {
+            'workout_routes': metrics[ROUTE_COLUMNS],
+            'route_splits': splits[SPLIT_COLUMNS],
+        }
+
+    def _link_workouts(self, metrics: pd.DataFrame, workouts: pd.DataFrame) -> pd.Series:
+        """
+        ルートに対応するワークアウトのworkout_idを求める
+
+        ワークアウトのFileReferenceのファイル名で紐付け、参照がないルートは
+        開始時刻がワークアウトの時間帯に含まれるものに紐付ける。
+
+        パラメータ:
+        - metrics: compute_route_metricsのルートごとの指標（route_file列付き）
+        - workouts: ワークアウトのDataFrame
+
+        戻り値:
+        - workout_id（紐付かない場合はNA）のSeries
+        """
+        workout_id = pd.Series(pd.NA, index=metrics.index, dtype='Int64')
+        if workouts is None or workouts.empty:
+            return workout_id
+
+        if 'route_path' in workouts.columns:
+            referenced = workouts.dropna(subset=['route_path'])
+            by_file = pd.Series(
+                referenced['workout_id'].to_numpy(),
+                index=[PurePosixPath(path).name for path in referenced['route_path']],
+            )
+            by_file = by_file[~by_file.index.duplicated()]
+            workout_id = metrics['route_file'].map(by_file).astype('Int64')
+
+        unlinked = workout_id.isna() & metrics['start_time'].notna()
+        if unlinked.any():
+            ordered = workouts.sort_values('start_date')
+            workout_start = ordered['start_date'].dt.tz_convert('UTC').to_numpy(dtype='datetime64[ns]')
+            workout_end = ordered['end_date'].dt.tz_convert('UTC').to_numpy(dtype='datetime64[ns]')
+            route_start = metrics.loc[unlinked, 'start_time'].dt.tz_convert('UTC').to_numpy(dtype='datetime64[ns]')
+            # ルート開始時刻以前に始まった直近のワークアウト
+            position = np.searchsorted(workout_start, route_start, side='right') - 1
+            inside = position >= 0
+            inside[inside] = route_start[inside] <= workout_end[position[inside]]
+            matched = np.full(len(route_start), pd.NA, dtype=object)
+            matched[inside] = ordered['workout_id'].to_numpy()[position[inside]]
+            workout_id.loc[unlinked] = pd.array(matched, dtype='Int64')
+        return workout_id
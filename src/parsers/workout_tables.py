@@ -0,0 +1,371 @@
+"""
+ワークアウトとその統計・イベント・メタデータを型付きの列バッファに蓄積する処理
+"""
+from array import array
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from src.parsers.columnar import CodeTable, TimestampColumn, _to_float, categorical_codes, decode_codes
+from src.parsers.timestamps import TIME_ZONE_METADATA_KEY, local_day_numbers, zone_offsets
+
+# 合計距離の属性がないワークアウトで、WorkoutStatisticsから距離を補う際の統計タイプの接頭辞
+DISTANCE_STATISTIC_PREFIX = 'HKQuantityTypeIdentifierDistance'
+ENERGY_STATISTIC_TYPE = 'HKQuantityTypeIdentifierActiveEnergyBurned'
+
+# to_frames()が返すテーブル名
+WORKOUT_TABLES = ('workouts', 'workout_statistics', 'workout_events', 'workout_metadata')
+
+
+class WorkoutTables:
+    """
+    ワークアウトを4つのフラットなテーブルの列バッファに蓄積するクラス
+
+    - workouts: ワークアウト1件につき1行
+    - workout_statistics: WorkoutStatistics（心拍数の平均・距離・消費エネルギーなど）
+    - workout_events: WorkoutEvent（一時停止・ラップ・セグメントなど）
+    - workout_metadata: MetadataEntry（キーと値）
+
+    子テーブルはworkout_id（workoutsの行番号）で親のワークアウトと結合できる。
+    to_frames()は統計・イベントにも親のワークアウトのutc_offset・local_dayを付ける
+    （日付で区切る処理で、子テーブルの行がUTCの日付ではなく親と同じ現地の日付に入るように）。
+    """
+
+    def __init__(self, workout_types: Dict[str, str]):
+        """
+        バッファを初期化
+
+        パラメータ:
+        - workout_types: ワークアウト識別子から名前への辞書
+        """
+        self.workout_types = workout_types
+        # 文字列のコード表（全テーブルで共有）
+        self.strings = CodeTable()
+
+        # workouts
+        self.type_identifier = array('i')
+        self.source = array('i')
+        self.start = TimestampColumn()
+        self.end = TimestampColumn()
+        self.duration = array('d')
+        self.duration_unit = array('i')
+        self.total_energy_burned = array('d')
+        self.total_energy_burned_unit = array('i')
+        self.total_distance = array('d')
+        self.total_distance_unit = array('i')
+        self.route_paths: Dict[int, str] = {}
+
+        # workout_statistics
+        self.stat_workout_id = array('i')
+        self.stat_type = array('i')
+        self.stat_start = TimestampColumn()
+        self.stat_end = TimestampColumn()
+        self.stat_sum = array('d')
+        self.stat_average = array('d')
+        self.stat_minimum = array('d')
+        self.stat_maximum = array('d')
+        self.stat_unit = array('i')
+
+        # workout_events
+        self.event_workout_id = array('i')
+        self.event_type = array('i')
+        self.event_date = TimestampColumn()
+        self.event_duration = array('d')
+        self.event_duration_unit = array('i')
+
+        # workout_metadata（値は数値・文字列が混在するため文字列のまま保持）
+        self.meta_workout_id = array('i')
+        self.meta_key = array('i')
+        self.meta_value: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.type_identifier)
+
+    def _code(self, value: Optional[str]) -> int:
+        """文字列のコード（Noneは空文字列として扱う）"""
+        return self.strings.encode(value or '')
+
+    def add_workout(self, attrib: Dict[str, str]) -> int:
+        """
+        Workout要素を追加
+
+        パラメータ:
+        - attrib: Workout要素の属性
+
+        戻り値:
+        - 追加したワークアウトのworkout_id
+        """
+        workout_id = len(self)
+        self.type_identifier.append(self._code(attrib.get('workoutActivityType')))
+        self.source.append(self._code(attrib.get('sourceName')))
+        self.start.append(attrib.get('startDate'))
+        self.end.append(attrib.get('endDate'))
+        self.duration.append(_to_float(attrib.get('duration')))
+        self.duration_unit.append(self._code(attrib.get('durationUnit')))
+        self.total_energy_burned.append(_to_float(attrib.get('totalEnergyBurned')))
+        self.total_energy_burned_unit.append(self._code(attrib.get('totalEnergyBurnedUnit')))
+        self.total_distance.append(_to_float(attrib.get('totalDistance')))
+        self.total_distance_unit.append(self._code(attrib.get('totalDistanceUnit')))
+        return workout_id
+
+    def add_statistics(self, workout_id: int, attrib: Dict[str, str]):
+        """
+        WorkoutStatistics要素を追加
+
+        パラメータ:
+        - workout_id: 親のワークアウトのworkout_id
+        - attrib: WorkoutStatistics要素の属性
+        """
+        self.stat_workout_id.append(workout_id)
+        self.stat_type.append(self._code(attrib.get('type')))
+        self.stat_start.append(attrib.get('startDate'))
+        self.stat_end.append(attrib.get('endDate'))
+        self.stat_sum.append(_to_float(attrib.get('sum')))
+        self.stat_average.append(_to_float(attrib.get('average')))
+        self.stat_minimum.append(_to_float(attrib.get('minimum')))
+        self.stat_maximum.append(_to_float(attrib.get('maximum')))
+        self.stat_unit.append(self._code(attrib.get('unit')))
+
+    def add_event(self, workout_id: int, attrib: Dict[str, str]):
+        """
+        WorkoutEvent要素を追加
+
+        パラメータ:
+        - workout_id: 親のワークアウトのworkout_id
+        - attrib: WorkoutEvent要素の属性
+        """
+        self.event_workout_id.append(workout_id)
+        self.event_type.append(self._code(attrib.get('type')))
+        self.event_date.append(attrib.get('date'))
+        self.event_duration.append(_to_float(attrib.get('duration')))
+        self.event_duration_unit.append(self._code(attrib.get('durationUnit')))
+
+    def add_metadata(self, workout_id: int, key: str, value: str):
+        """
+        MetadataEntry要素を追加
+
+        パラメータ:
+        - workout_id: 親のワークアウトのworkout_id
+        - key: メタデータのキー
+        - value: メタデータの値
+        """
+        self.meta_workout_id.append(workout_id)
+        self.meta_key.append(self._code(key))
+        self.meta_value.append(value)
+
+    def set_route(self, workout_id: int, path: str):
+        """
+        ワークアウトのルート（GPXファイル）のパスを設定
+
+        パラメータ:
+        - workout_id: ワークアウトのworkout_id
+        - path: FileReferenceのpath属性（'/workout-routes/route_....gpx'）
+        """
+        self.route_paths[workout_id] = path
+
+    def extend(self, other: 'WorkoutTables'):
+        """
+        別のバッファのワークアウトを末尾に追加（workout_idは通し番号に付け替える）
+
+        パラメータ:
+        - other: 追加するWorkoutTables
+        """
+        offset = len(self)
+        mapping = self.strings.remap(other.strings)
+
+        def extend_ids(ids: array, other_ids: array):
+            ids.frombytes((np.frombuffer(other_ids, dtype=np.int32) + offset).astype(np.int32).tobytes())
+
+        def extend_strings(codes: array, other_codes: array):
+            codes.frombytes(mapping[np.frombuffer(other_codes, dtype=np.int32)].tobytes())
+
+        for name in ('type_identifier', 'source', 'duration_unit', 'total_energy_burned_unit',
+                     'total_distance_unit', 'stat_type', 'stat_unit', 'event_type',
+                     'event_duration_unit', 'meta_key'):
+            extend_strings(getattr(self, name), getattr(other, name))
+        for name in ('stat_workout_id', 'event_workout_id', 'meta_workout_id'):
+            extend_ids(getattr(self, name), getattr(other, name))
+        for name in ('duration', 'total_energy_burned', 'total_distance', 'stat_sum',
+                     'stat_average', 'stat_minimum', 'stat_maximum', 'event_duration'):
+            getattr(self, name).extend(getattr(other, name))
+        for name in ('start', 'end', 'stat_start', 'stat_end', 'event_date'):
+            getattr(self, name).extend(getattr(other, name))
+        self.meta_value.extend(other.meta_value)
+        for workout_id, path in other.route_paths.items():
+            self.route_paths[workout_id + offset] = path
+
+    def flush(self):
+        """デコード待ちのタイムスタンプをすべてデコード"""
+        for column in (self.start, self.end, self.stat_start, self.stat_end, self.event_date):
+            column.flush()
+
+    def _decode(self, codes: array) -> np.ndarray:
+        """コード列を文字列に戻す（空文字列はNone）"""
+        values = decode_codes(self.strings, codes)
+        values[values == ''] = None
+        return values
+
+    def _categorical(self, codes: array) -> pd.Categorical:
+        """コード列をカテゴリ型にする（空文字列は欠損値、カテゴリはこの列に現れるものだけ）"""
+        return categorical_codes(self.strings, codes, empty_as_missing=True).remove_unused_categories()
+
+    def statistics_frame(self) -> pd.DataFrame:
+        """
+        workout_statisticsテーブルをDataFrameに変換
+
+        戻り値:
+        - workout_id, type, start_date, end_date, sum, average, minimum, maximum, unit列のDataFrame
+        """
+        if len(self.stat_workout_id) == 0:
+            return pd.DataFrame()
+        return pd.DataFrame({
+            'workout_id': np.frombuffer(self.stat_workout_id, dtype=np.int32),
+            'type': self._categorical(self.stat_type),
+            'start_date': self.stat_start.to_index(),
+            'end_date': self.stat_end.to_index(),
+            'sum': np.frombuffer(self.stat_sum, dtype=np.float64),
+            'average': np.frombuffer(self.stat_average, dtype=np.float64),
+            'minimum': np.frombuffer(self.stat_minimum, dtype=np.float64),
+            'maximum': np.frombuffer(self.stat_maximum, dtype=np.float64),
+            'unit': self._categorical(self.stat_unit),
+        }, copy=False)
+
+    def events_frame(self) -> pd.DataFrame:
+        """
+        workout_eventsテーブルをDataFrameに変換
+
+        戻り値:
+        - workout_id, type, date, duration, duration_unit列のDataFrame
+        """
+        if len(self.event_workout_id) == 0:
+            return pd.DataFrame()
+        return pd.DataFrame({
+            'workout_id': np.frombuffer(self.event_workout_id, dtype=np.int32),
+            'type': self._categorical(self.event_type),
+            'date': self.event_date.to_index(),
+            'duration': np.frombuffer(self.event_duration, dtype=np.float64),
+            'duration_unit': self._categorical(self.event_duration_unit),
+        }, copy=False)
+
+    def metadata_frame(self) -> pd.DataFrame:
+        """
+        workout_metadataテーブルをDataFrameに変換
+
+        戻り値:
+        - workout_id, key, value列のDataFrame
+        """
+        if len(self.meta_workout_id) == 0:
+            return pd.DataFrame()
+        return pd.DataFrame({
+            'workout_id': np.frombuffer(self.meta_workout_id, dtype=np.int32),
+            'key': self._categorical(self.meta_key),
+            'value': np.asarray(self.meta_value, dtype=object),
+        }, copy=False)
+
+    def workouts_frame(self, statistics: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        workoutsテーブルをDataFrameに変換
+
+        合計消費エネルギー・合計距離の属性がないワークアウト（新しいiOSのエクスポート）は、
+        WorkoutStatisticsの合計値で補う。
+
+        パラメータ:
+        - statistics: statistics_frame()の結果（省略時は作成する）
+
+        戻り値:
+        - workout_id, type, type_identifier, source, start_date, end_date, utc_offset, time_zone,
+          local_day, duration, duration_unit, total_energy_burned(_unit), total_distance(_unit),
+          route_path列のDataFrame
+        """
+        if len(self) == 0:
+            return pd.DataFrame()
+        type_identifier = self._decode(self.type_identifier)
+        workout_type = np.array(
+            [self.workout_types.get(identifier, identifier) for identifier in type_identifier],
+            dtype=object,
+        )
+        route_path = np.full(len(self), None, dtype=object)
+        for workout_id, path in self.route_paths.items():
+            route_path[workout_id] = path
+        time_zone = self._time_zones()
+        zone_codes, zone_names = pd.factorize(time_zone)
+        start_ns = self.start.ns_array()
+        offsets = zone_offsets(start_ns, self.start.offset_array(), zone_codes, zone_names)
+        time_zone[time_zone == ''] = None
+
+        df = pd.DataFrame({
+            'workout_id': np.arange(len(self), dtype=np.int32),
+            'type': workout_type,
+            'type_identifier': type_identifier,
+            'source': self._decode(self.source),
+            'start_date': self.start.to_index(),
+            'end_date': self.end.to_index(),
+            # HKTimeZoneがあるワークアウトは、記録した場所のその時点のオフセット
+            'utc_offset': offsets,
+            'time_zone': time_zone,
+            'local_day': local_day_numbers(start_ns, offsets),
+            'duration': np.array(self.duration, dtype=np.float64),
+            'duration_unit': self._decode(self.duration_unit),
+            'total_energy_burned': np.array(self.total_energy_burned, dtype=np.float64),
+            'total_energy_burned_unit': self._decode(self.total_energy_burned_unit),
+            'total_distance': np.array(self.total_distance, dtype=np.float64),
+            'total_distance_unit': self._decode(self.total_distance_unit),
+            'route_path': route_path,
+        })
+
+        if statistics is None:
+            statistics = self.statistics_frame()
+        if not statistics.empty:
+            self._fill_totals(df, statistics)
+        return df
+
+    def _time_zones(self) -> np.ndarray:
+        """ワークアウトごとのHKTimeZoneメタデータのタイムゾーン名（ない場合は空文字列）"""
+        time_zone = np.full(len(self), '', dtype=object)
+        key_code = self.strings.codes.get(TIME_ZONE_METADATA_KEY)
+        if key_code is None:
+            return time_zone
+        rows = np.flatnonzero(np.frombuffer(self.meta_key, dtype=np.int32) == key_code)
+        workout_ids = np.frombuffer(self.meta_workout_id, dtype=np.int32)[rows]
+        time_zone[workout_ids] = [self.meta_value[row] for row in rows.tolist()]
+        return time_zone
+
+    def _fill_totals(self, df: pd.DataFrame, statistics: pd.DataFrame):
+        """合計消費エネルギー・合計距離の欠損をWorkoutStatisticsの合計値で補う"""
+        for column, mask in (
+            ('total_energy_burned', statistics['type'] == ENERGY_STATISTIC_TYPE),
+            ('total_distance', statistics['type'].str.startswith(DISTANCE_STATISTIC_PREFIX, na=False)),
+        ):
+            rows = statistics[mask & statistics['sum'].notna()]
+            if rows.empty:
+                continue
+            # 1件のワークアウトに距離の統計が複数ある場合は最初のものを使う
+            first = rows.drop_duplicates('workout_id')
+            ids = first['workout_id'].to_numpy()
+            missing = np.isnan(df[column].to_numpy()[ids])
+            ids = ids[missing]
+            df.loc[ids, column] = first['sum'].to_numpy()[missing]
+            df.loc[ids, f'{column}_unit'] = first['unit'].to_numpy()[missing]
+
+    def to_frames(self) -> Dict[str, pd.DataFrame]:
+        """
+        4つのテーブルをDataFrameに変換
+
+        戻り値:
+        - 'workouts', 'workout_statistics', 'workout_events', 'workout_metadata'をキーとする辞書
+          （workout_statistics・workout_eventsには親のワークアウトのutc_offset・local_day列を加える）
+        """
+        self.flush()
+        statistics = self.statistics_frame()
+        workouts = self.workouts_frame(statistics)
+        events = self.events_frame()
+        for child in (statistics, events):
+            if not child.empty:
+                workout_ids = child['workout_id'].to_numpy()
+                child['utc_offset'] = workouts['utc_offset'].to_numpy()[workout_ids]
+                child['local_day'] = workouts['local_day'].to_numpy()[workout_ids]
+        return {
+            'workouts': workouts,
+            'workout_statistics': statistics,
+            'workout_events': events,
+            'workout_metadata': self.metadata_frame(),
+        }
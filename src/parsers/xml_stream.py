@@ -0,0 +1,187 @@
+"""
+XMLバイトストリームを逐次パースしてコレクターに流す処理
+
+パースには次のバックエンドを使える。
+- expat: pyexpatのハンドラーから直接コレクターを呼び出す（要素オブジェクトを作らない）
+- lxml: lxmlのプルパーサー（lxmlがインストールされている場合のみ）
+- etree: 標準ライブラリのxml.etree.ElementTreeのプルパーサー
+"""
+import json
+import os
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+# 1回に読み込むバイト数
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+# バックエンド名（'auto'の場合はこの順で利用できる最初のものを使う）
+XML_BACKENDS = ('expat', 'lxml', 'etree')
+AUTO_BACKEND = 'auto'
+
+
+def _has_module(name: str) -> bool:
+    """モジュールをインポートできるかどうか"""
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+
+def available_backends() -> List[str]:
+    """この環境で利用できるバックエンド名（優先順）"""
+    modules = {'expat': 'xml.parsers.expat', 'lxml': 'lxml.etree', 'etree': 'xml.etree.ElementTree'}
+    return [backend for backend in XML_BACKENDS if _has_module(modules[backend])]
+
+
+def resolve_backend(backend: Optional[str] = None) -> str:
+    """
+    バックエンド名を確定する
+
+    パラメータ:
+    - backend: バックエンド名（Noneまたは'auto'の場合は利用できる最初のもの）
+
+    戻り値:
+    - 利用できるバックエンド名
+    """
+    available = available_backends()
+    if backend is None or backend == AUTO_BACKEND:
+        return available[0]
+    if backend not in XML_BACKENDS:
+        raise ValueError(f"不明なXMLバックエンド: {backend}（{', '.join(XML_BACKENDS)}から指定）")
+    if backend not in available:
+        raise ValueError(f"XMLバックエンド{backend}は利用できません（{backend}がインストールされていません）")
+    return backend
+
+
+def load_backend_preference(path: str) -> Optional[str]:
+    """
+    ベンチマークで選んだバックエンドを読み込む
+
+    パラメータ:
+    - path: 保存先のJSONファイルのパス
+
+    戻り値:
+    - バックエンド名（保存されていない場合や、この環境で利用できない場合はNone）
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        backend = json.load(f).get('backend')
+    return backend if backend in available_backends() else None
+
+
+def save_backend_preference(path: str, backend: str, results: Dict[str, float]):
+    """
+    ベンチマークで選んだバックエンドを保存
+
+    パラメータ:
+    - path: 保存先のJSONファイルのパス
+    - backend: 選んだバックエンド名
+    - results: バックエンド名 → 件/秒の辞書（参考として一緒に保存する）
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'backend': backend, 'records_per_sec': results}, f, ensure_ascii=False, indent=2)
+
+
+def _read_blocks(stream: BinaryIO, limit: Optional[int], observer: Optional[Callable] = None):
+    """ストリームをREAD_BLOCK_SIZEずつ、最大limitバイトまで読み込む（observerにも各ブロックを渡す）"""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = READ_BLOCK_SIZE if remaining is None else min(READ_BLOCK_SIZE, remaining)
+        block = stream.read(size)
+        if not block:
+            break
+        if remaining is not None:
+            remaining -= len(block)
+        if observer is not None:
+            observer(block)
+        yield block
+
+
+def _stream_expat(collector, stream: BinaryIO, prefix: bytes, suffix: bytes,
+                  limit: Optional[int], observer: Optional[Callable]):
+    """pyexpatのハンドラーで直接コレクターを呼び出す（要素オブジェクトを作らない）"""
+    from xml.parsers import expat
+
+    parser = expat.ParserCreate()
+    # 属性は{名前: 値}の辞書として受け取り、そのままコレクターに渡す
+    parser.StartElementHandler = collector.start
+    parser.EndElementHandler = collector.end
+
+    if prefix:
+        parser.Parse(prefix, False)
+    for block in _read_blocks(stream, limit, observer):
+        parser.Parse(block, False)
+    parser.Parse(suffix, True)
+
+
+def _stream_pull(collector, stream: BinaryIO, prefix: bytes, suffix: bytes,
+                 limit: Optional[int], observer: Optional[Callable], create_parser: Callable):
+    """プルパーサー（ElementTree/lxml）のイベントをコレクターに渡す"""
+    parser = create_parser()
+    depth = 0
+    root = None
+
+    def drain():
+        nonlocal depth, root
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                collector.start(elem.tag, elem.attrib)
+            else:
+                depth -= 1
+                collector.end(elem.tag)
+                if depth == 1:
+                    # トップレベル要素（Record/Workoutなど）を処理し終えたら解放
+                    root.clear()
+
+    if prefix:
+        parser.feed(prefix)
+    for block in _read_blocks(stream, limit, observer):
+        parser.feed(block)
+        drain()
+    if suffix:
+        parser.feed(suffix)
+    parser.close()
+    drain()
+
+
+def _create_etree_parser():
+    return ET.XMLPullParser(events=('start', 'end'))
+
+
+def _create_lxml_parser():
+    from lxml import etree
+    # 数百MBのエクスポートでもテキストノードの上限に掛からないようにする
+    return etree.XMLPullParser(events=('start', 'end'), huge_tree=True)
+
+
+def stream_into(collector, stream: BinaryIO, prefix: bytes = b'', suffix: bytes = b'',
+                limit: Optional[int] = None, backend: Optional[str] = None,
+                observer: Optional[Callable] = None):
+    """
+    バイトストリームを逐次パースし、開始・終了イベントをコレクターに渡す
+
+    トップレベル要素を処理し終えるたびに要素を解放するため、
+    ツリー全体がメモリに載ることはない。
+
+    パラメータ:
+    - collector: start(tag, attrib)/end(tag)を持つコレクター
+    - stream: 読み込み元のバイナリストリーム
+    - prefix: 先頭に補うバイト列（バイト範囲をパースする際のルート開始タグなど）
+    - suffix: 末尾に補うバイト列
+    - limit: 読み込む最大バイト数（Noneの場合は末尾まで）
+    - backend: XMLバックエンド名（Noneまたは'auto'の場合は利用できる最初のもの）
+    - observer: 読み込んだブロックを順に受け取る関数（パースと同時に索引を作る場合など）
+    """
+    backend = resolve_backend(backend)
+    if backend == 'expat':
+        _stream_expat(collector, stream, prefix, suffix, limit, observer)
+    elif backend == 'lxml':
+        _stream_pull(collector, stream, prefix, suffix, limit, observer, _create_lxml_parser)
+    else:
+        _stream_pull(collector, stream, prefix, suffix, limit, observer, _create_etree_parser)